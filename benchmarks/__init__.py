@@ -0,0 +1 @@
+# Офлайн-бенчмарки горячих путей игры. Запуск: python -m benchmarks.<имя>
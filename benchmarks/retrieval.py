@@ -0,0 +1,357 @@
+# benchmarks/retrieval.py
+"""
+Бенчмарк поиска по памяти мира на синтетических данных.
+Лор и события генерируются из имен и тегов data/data_tables/*.yaml,
+затем для каждого размера памяти замеряются:
+  - скорость записи (add_memory + flush пачками);
+  - p50/p99 задержки retrieve_layers без фильтра, с фильтром type и type+location;
+  - recall@k векторного индекса против точного перебора;
+  - память процесса и размер базы на диске.
+Отчет пишется в JSON (benchmarks/results/), сравнение с прошлым отчетом - через --baseline.
+
+    python -m benchmarks.retrieval --sizes 1000,10000
+    python -m benchmarks.retrieval --sizes 1000,10000,100000,1000000 --queries 100
+    python -m benchmarks.retrieval --baseline benchmarks/results/retrieval_20260101_120000.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+import numpy as np
+import yaml
+
+DATA_TABLES_DIR = Path(__file__).parent.parent / "data" / "data_tables"
+TAGS_REGISTRY_FILE = Path(__file__).parent.parent / "data" / "tags_registry.yaml"
+RESULTS_DIR = Path(__file__).parent / "results"
+
+EMBEDDING_DIM = 384  # Как у all-MiniLM-L6-v2
+INSERT_BATCH = 2000  # Воспоминаний на один flush (ниже предела пачки Chroma)
+LORE_SHARE = 0.1  # Доля лора среди воспоминаний
+MEMORIES_PER_LOCATION = 50
+FILTER_MODES = ("none", "type", "type+location")
+# Порог регрессии при сравнении с --baseline
+LATENCY_REGRESSION = 0.20
+RECALL_REGRESSION = 0.02
+
+EVENT_TEMPLATES = [
+    "Игрок сразился с существом {name} у места {place}",
+    "Игрок нашел следы {name} неподалеку от {place}",
+    "Торговец рассказал игроку о {name} из {place}",
+    "Игрок спрятал добычу рядом с {name}, по дороге в {place}",
+    "В {place} игрок встретил {name} и заключил сделку",
+    "Игрок едва спасся от {name}, отступив к {place}",
+]
+LORE_TEMPLATES = [
+    "Легенды гласят, что {name} родом из {place}",
+    "Мудрецы считают {name} хранителем {place}",
+    "Древние хроники связывают {name} с падением {place}",
+]
+
+
+# --- Синтетический мир ---
+
+def _collect_vocabulary(node: Any, names: List[str], tags: List[str]):
+    if isinstance(node, dict):
+        if isinstance(node.get("name"), str):
+            names.append(node["name"])
+        for key, value in node.items():
+            if key.endswith("tags") and isinstance(value, list):
+                tags.extend(tag for tag in value if isinstance(tag, str))
+            else:
+                _collect_vocabulary(value, names, tags)
+    elif isinstance(node, list):
+        for item in node:
+            _collect_vocabulary(item, names, tags)
+
+
+def load_world_vocabulary() -> Tuple[List[str], List[str]]:
+    """Имена и теги из таблиц данных мира. Нечитаемые файлы пропускаются."""
+    names, tags = [], []
+    for path in sorted(DATA_TABLES_DIR.glob("*.yaml")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                _collect_vocabulary(yaml.safe_load(f), names, tags)
+        except yaml.YAMLError as e:
+            print(f"⚠️ {path.name} пропущен: {str(e).splitlines()[0]}")
+    try:
+        with open(TAGS_REGISTRY_FILE, "r", encoding="utf-8") as f:
+            registry = yaml.safe_load(f) or {}
+        tags.extend(tag for category in registry.values() for tag in (category.get("tags") or {}))
+    except (OSError, yaml.YAMLError, AttributeError):
+        pass
+    return sorted(set(names)), sorted(set(tags))
+
+
+class SyntheticWorld:
+    """Детерминированный генератор воспоминаний: i-е воспоминание всегда одно и то же."""
+    def __init__(self, size: int, names: List[str], tags: List[str], seed: int = 42):
+        self.size = size
+        self.names = names
+        self.tags = tags
+        self.seed = seed
+        self.location_count = max(1, size // MEMORIES_PER_LOCATION)
+
+    def location(self, number: int) -> Tuple[str, List[str]]:
+        rng = random.Random(f"{self.seed}:location:{number}")
+        return f"{rng.choice(self.names)} {number}", rng.sample(self.tags, k=min(3, len(self.tags)))
+
+    def memory(self, i: int) -> Tuple[str, Dict[str, Any]]:
+        rng = random.Random(f"{self.seed}:memory:{i}")
+        location, location_tags = self.location(rng.randrange(self.location_count))
+        if rng.random() < LORE_SHARE:
+            text = rng.choice(LORE_TEMPLATES).format(name=rng.choice(self.names), place=rng.choice(self.names))
+            return f"{text} (запись {i}).", {"type": "lore"}
+        text = rng.choice(EVENT_TEMPLATES).format(name=rng.choice(self.names), place=location)
+        return f"{text} (запись {i}).", {"type": "event", "location": location, "tags": "|".join(location_tags)}
+
+    def batches(self, batch_size: int) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+        for start in range(0, self.size, batch_size):
+            yield [self.memory(i) for i in range(start, min(self.size, start + batch_size))]
+
+
+class HashedEmbedder:
+    """
+    Быстрые детерминированные эмбеддинги: сумма псевдослучайных векторов слов.
+    Тексты с общими словами близки, как у настоящей модели, но миллион
+    воспоминаний эмбеддится за секунды. --embedder model включает настоящую модель.
+    """
+    model_id = "hashed-words"
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self._words: Dict[str, np.ndarray] = {}
+
+    def _word(self, word: str) -> np.ndarray:
+        vector = self._words.get(word)
+        if vector is None:
+            vector = np.random.default_rng(zlib.crc32(word.encode("utf-8"))).standard_normal(self.dim).astype(np.float32)
+            self._words[word] = vector
+        return vector
+
+    def __call__(self, texts: List[str]) -> List[np.ndarray]:
+        vectors = []
+        for text in texts:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for word in text.lower().split():
+                vector += self._word(word.strip(".,()"))
+            vectors.append(vector / max(float(np.linalg.norm(vector)), 1e-12))
+        return vectors
+
+
+# --- Замеры ---
+
+def _rss_mb() -> float:
+    """Текущая резидентная память процесса (Linux), иначе пиковая."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _disk_mb(path: Path) -> float:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file()) / 2**20
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+    return {"p50": pick(0.50) * 1000, "p99": pick(0.99) * 1000}
+
+
+def _filter_for(mode: str, metadata: Dict[str, Any]) -> Dict[str, Any] | None:
+    if mode == "none":
+        return None
+    if mode == "type":
+        return {"type": "event"}
+    return {"type": "event", "location": metadata["location"]}
+
+
+class BruteForceTopK:
+    """Точный top-k по L2 (метрика Chroma по умолчанию), накапливаемый по пачкам записи."""
+    def __init__(self, queries: np.ndarray, mode: str, query_locations: List[str], k: int):
+        self.queries = queries
+        self.mode = mode
+        self.query_locations = np.array(query_locations, dtype=object)
+        self.k = k
+        self.best_distances = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        self.best_ids = np.empty((len(queries), 0), dtype=object)
+
+    def add(self, ids: List[str], vectors: np.ndarray, metadatas: List[Dict[str, Any]]):
+        # ||q - v||^2 = |q|^2 + |v|^2 - 2 q.v - одно умножение матриц на пачку
+        distances = (np.sum(self.queries ** 2, axis=1)[:, None] + np.sum(vectors ** 2, axis=1)[None, :]
+                     - 2 * self.queries @ vectors.T)
+        if self.mode != "none":
+            is_event = np.array([metadata["type"] == "event" for metadata in metadatas])
+            mask = np.broadcast_to(is_event, distances.shape)
+            if self.mode == "type+location":
+                locations = np.array([metadata.get("location", "") for metadata in metadatas], dtype=object)
+                mask = mask & (locations[None, :] == self.query_locations[:, None])
+            distances = np.where(mask, distances, np.inf)
+
+        merged_distances = np.concatenate([self.best_distances, distances.astype(np.float32)], axis=1)
+        merged_ids = np.concatenate([self.best_ids, np.broadcast_to(np.array(ids, dtype=object), distances.shape)], axis=1)
+        keep = min(self.k, merged_distances.shape[1])
+        top = np.argsort(merged_distances, axis=1, kind="stable")[:, :keep]
+        self.best_distances = np.take_along_axis(merged_distances, top, axis=1)
+        self.best_ids = np.take_along_axis(merged_ids, top, axis=1)
+
+    def ids(self, q: int) -> List[str]:
+        return [doc_id for doc_id, distance in zip(self.best_ids[q], self.best_distances[q]) if np.isfinite(distance)]
+
+
+def benchmark_size(size: int, names: List[str], tags: List[str], args) -> Dict[str, Any]:
+    from services.embedding_service import EmbeddingService
+    from services.memory_service import MemoryService, MemoryLayer
+
+    world = SyntheticWorld(size, names, tags, seed=args.seed)
+    embedder = HashedEmbedder() if args.embedder == "hashed" else None
+    embeddings = EmbeddingService(embedder)
+
+    # Запросы выбираются заранее, чтобы точный top-k копился прямо во время записи
+    rng = random.Random(args.seed)
+    query_sources = []
+    while len(query_sources) < args.queries:
+        text, metadata = world.memory(rng.randrange(size))
+        if metadata["type"] == "event":
+            query_sources.append((" ".join(text.split()[:5]), metadata))
+    query_texts = [text for text, _ in query_sources]
+    query_vectors = np.asarray(embeddings.embed_many(query_texts, use_cache=False), dtype=np.float32)
+    query_locations = [metadata["location"] for _, metadata in query_sources]
+    brute_force = {mode: BruteForceTopK(query_vectors, mode, query_locations, args.k) for mode in FILTER_MODES}
+
+    workdir = Path(tempfile.mkdtemp(prefix="silgarron_retrieval_"))
+    devnull = open(os.devnull, "w")
+    try:
+        rss_before = _rss_mb()
+        with contextlib.redirect_stdout(devnull):
+            memory = MemoryService(embeddings, db_path=str(workdir / "chroma"), journal_path=workdir / "journal.jsonl",
+                                   index_backend=args.index)
+
+        insert_seconds = 0.0
+        for batch in world.batches(INSERT_BATCH):
+            started_at = time.perf_counter()
+            with contextlib.redirect_stdout(devnull):
+                ids = [memory.add_memory(text, None, metadata) for text, metadata in batch]
+                memory.flush()
+            insert_seconds += time.perf_counter() - started_at
+
+            # Векторы пачки уже в LRU сервиса эмбеддингов - точный перебор их не пересчитывает
+            vectors = np.asarray(embeddings.embed_many([text for text, _ in batch]), dtype=np.float32)
+            embeddings.begin_turn()
+            for mode in FILTER_MODES:
+                brute_force[mode].add(ids, vectors, [metadata for _, metadata in batch])
+        print(f"  {size:>9} воспоминаний записано за {insert_seconds:.1f} с")
+
+        latency, recall = {}, {}
+        for mode in FILTER_MODES:
+            durations, hits = [], 0
+            for q, (text, metadata) in enumerate(query_sources):
+                layer = MemoryLayer("bench", _filter_for(mode, metadata), args.k)
+                embeddings.begin_turn()
+                started_at = time.perf_counter()
+                with contextlib.redirect_stdout(devnull):
+                    memory.retrieve_layers(text, [layer])
+                durations.append(time.perf_counter() - started_at)
+
+                # recall@k - только векторный индекс против точного перебора
+                found = {doc_id for doc_id, _ in memory.vector_index.query(query_vectors[q], args.k, layer.filter_metadata)}
+                expected = brute_force[mode].ids(q)
+                hits += len(found & set(expected)) / max(1, len(expected))
+            latency[mode] = _percentiles(durations)
+            recall[mode] = hits / len(query_sources)
+
+        result = {
+            "size": size,
+            "insert_seconds": insert_seconds,
+            "inserts_per_second": size / insert_seconds if insert_seconds else 0.0,
+            "latency_ms": latency,
+            "recall_at_k": recall,
+            "rss_mb": _rss_mb() - rss_before,
+            "disk_mb": _disk_mb(workdir),
+            "index": memory.vector_index.stats(),
+        }
+        with contextlib.redirect_stdout(devnull):
+            memory.close()
+        return result
+    finally:
+        devnull.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# --- Отчет ---
+
+def compare_with_baseline(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Список регрессий относительно прошлого отчета (по совпадающим размерам)."""
+    previous = {result["size"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in report["results"]:
+        old = previous.get(result["size"])
+        if not old:
+            continue
+        for mode in FILTER_MODES:
+            for quantile in ("p50", "p99"):
+                was = old["latency_ms"].get(mode, {}).get(quantile)
+                now = result["latency_ms"][mode][quantile]
+                if was and now > was * (1 + LATENCY_REGRESSION):
+                    regressions.append(f"{result['size']} {mode} {quantile}: {was:.2f} -> {now:.2f} мс")
+            was = old["recall_at_k"].get(mode)
+            now = result["recall_at_k"][mode]
+            if was is not None and now < was - RECALL_REGRESSION:
+                regressions.append(f"{result['size']} {mode} recall@{report['k']}: {was:.3f} -> {now:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска по памяти мира")
+    parser.add_argument("--sizes", default="1000,10000", help="размеры памяти через запятую")
+    parser.add_argument("--queries", type=int, default=200, help="запросов на каждый режим фильтра")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--embedder", choices=["hashed", "model"], default="hashed",
+                        help="hashed - быстрые синтетические эмбеддинги, model - all-MiniLM-L6-v2")
+    parser.add_argument("--index", choices=["chroma", "bruteforce", "hnsw", "partitioned"], default="chroma",
+                        help="бэкенд векторного индекса памяти (см. services/vector_index.py)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, help="куда записать JSON-отчет")
+    parser.add_argument("--baseline", type=Path, help="прошлый отчет для поиска регрессий")
+    args = parser.parse_args()
+
+    names, tags = load_world_vocabulary()
+    print(f"Словарь мира: {len(names)} имен, {len(tags)} тегов")
+    report = {"timestamp": time.time(), "embedder": args.embedder, "index": args.index, "k": args.k,
+              "queries": args.queries, "results": []}
+    for size in (int(value) for value in args.sizes.split(",")):
+        result = benchmark_size(size, names, tags, args)
+        report["results"].append(result)
+        latency = "  ".join(f"{mode}: p50 {values['p50']:.2f} / p99 {values['p99']:.2f} мс"
+                            for mode, values in result["latency_ms"].items())
+        recall = "  ".join(f"{mode}: {value:.3f}" for mode, value in result["recall_at_k"].items())
+        print(f"  запись {result['inserts_per_second']:.0f}/с  {latency}")
+        print(f"  recall@{args.k}  {recall}  память +{result['rss_mb']:.0f} МБ  диск {result['disk_mb']:.0f} МБ")
+
+    output = args.output or RESULTS_DIR / f"retrieval_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Отчет: {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_with_baseline(report, json.load(f))
+        for line in regressions:
+            print(f"🔴 Регрессия: {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
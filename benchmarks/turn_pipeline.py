@@ -0,0 +1,75 @@
+# benchmarks/turn_pipeline.py
+"""
+Офлайн-бенчмарк игрового хода: Game.process_player_command целиком,
+но с replay- или http-бэкендом LLM вместо настоящего Gemini.
+
+    python -m benchmarks.turn_pipeline --turns 50
+    python -m benchmarks.turn_pipeline --backend http --profile
+"""
+import os
+import re
+import time
+import argparse
+import cProfile
+import pstats
+import statistics
+from pathlib import Path
+
+GAME_LOG = Path(__file__).parent.parent / "logs" / "game_events.log"
+DEFAULT_COMMANDS = ["осмотреться", "Посмотреть что в сундуке", "Атаковать врага мечом", "Убежать"]
+
+
+def load_commands() -> list:
+    """Команды игроков из игрового лога - реалистичная нагрузка."""
+    if not GAME_LOG.exists():
+        return DEFAULT_COMMANDS
+    pattern = re.compile(r"\[PLAYER_INPUT\] (.+)$")
+    with open(GAME_LOG, "r", encoding="utf-8") as f:
+        commands = [m.group(1) for m in map(pattern.search, f) if m]
+    return commands or DEFAULT_COMMANDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк игрового хода без живого API")
+    parser.add_argument("--backend", choices=["replay", "http"], default="replay")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--stream", action="store_true", help="запрашивать ответы потоком")
+    parser.add_argument("--profile", action="store_true", help="снять профиль cProfile")
+    args = parser.parse_args()
+
+    # Бэкенд выбирается при первом обращении к клиенту, поэтому до импорта игры
+    os.environ["LLM_BACKEND"] = args.backend
+    from game import Game
+    from services.llm_cache import response_cache
+
+    response_cache.policies = {}  # Кэш исказил бы замер повторяющихся команд
+    game = Game()
+    game.start_new_game(player_name="Бенчмарк", world_seed=0)
+    commands = load_commands()
+
+    profiler = cProfile.Profile() if args.profile else None
+    durations = []
+    for turn in range(args.turns):
+        command = commands[turn % len(commands)]
+        on_narrative = (lambda text: None) if args.stream else None
+        started_at = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        game.process_player_command(command, on_narrative=on_narrative)
+        if profiler:
+            profiler.disable()
+        durations.append(time.perf_counter() - started_at)
+        if game.player.is_dead():
+            game.start_new_game(player_name="Бенчмарк", world_seed=0)
+
+    durations.sort()
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    print(f"\n=== {len(durations)} ходов, бэкенд '{args.backend}' ===")
+    print(f"среднее {statistics.mean(durations) * 1000:.1f} мс, "
+          f"p50 {statistics.median(durations) * 1000:.1f} мс, p95 {p95 * 1000:.1f} мс")
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
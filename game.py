@@ -3,42 +3,78 @@ import re
 import json
 from pathlib import Path 
 import random 
-from typing import List
+from typing import Callable, List, Optional
 from logic.constants import *
 from models.character import Character
 from models.item import Item
 from models.location import Location
 from services.llm_service import _send_prompt_to_gemini
-from services.memory_service import MemoryService
+from services.memory_service import MemoryService, MemoryLayer
+from services.keyword_index import join_tags
+from services.memory_consolidation import MemoryConsolidator
+from services.embedding_service import get_embedding_service
 from logic.director import Director
 from logic.game_states import GameState
-from utils.prompt_manager import load_and_format_prompt
-from utils.logger import log_player_input
+from utils.prompt_manager import load_and_format_prompt, compact_combat_log
+from utils.logger import log_player_input, flush_logs
+from utils.response_parser import StreamingResponseParser
+from utils.metrics import TurnMetrics
 from services.world_data_service import WorldDataService
-from services.tag_registry_service import TagRegistry
+from services.tag_registry_service import get_tag_registry
+from services.pregeneration_service import PregenerationService
 import generators.region_generator as region_gen
 import generators.location_generator as loc_gen
+from generators.world_file import WorldFile
 
 SAVE_DIR = Path(__file__).parent / "saves"
 
+
 class Game:
     def __init__(self):
         self.player: Character | None = None
+        # Зерно мира: вся генерация локаций воспроизводима из него
+        self.world_seed: int = 0
+        # Заранее сгенерированный мир (generators/world_batch.py), если игра открыта из файла
+        self.world_file: WorldFile | None = None
         self.current_location: Location | None = None
         self.state = GameState.EXPLORATION
         self.short_term_memory: List[str] = []
-        self.director = Director()
+        # Сжатая сводка старых ходов боя, вытесненных из short_term_memory
+        self.combat_digest: str = ""
+        self.metrics = TurnMetrics()
+        # Один сервис эмбеддингов на намерения и память: каждый текст эмбеддится раз за ход
+        self.embedding_service = get_embedding_service()
+        self.director = Director(self.embedding_service)
 
         # Game создает и хранит сервисы как единый источник правды.
         print("--- Инициализация систем игры ---")
-        self.memory_service = MemoryService()
-        self.tag_registry = TagRegistry() # Загружает data/tags_registry.yaml
+        self.memory_service = MemoryService(self.embedding_service)
+        self.memory_consolidator = MemoryConsolidator(self.memory_service)
+        self.tag_registry = get_tag_registry() # Загружает data/tags_registry.yaml, один на процесс
         self.world_data = WorldDataService() # Загружает data/world_anatomy.yaml
+        self.pregeneration = PregenerationService(self.world_data, self.tag_registry)
         print("--- Все системы готовы ---")
 
-    def start_new_game(self, player_name: str):
-        """Инициализирует новую игру с использованием иерархической генерации."""
+    def open_world_file(self, path: str | Path):
+        """Подключает заранее сгенерированный мир: локации читаются из файла по требованию."""
+        self.world_file = WorldFile(Path(path))
+        self.world_seed = self.world_file.meta["world_seed"]
+        self.pregeneration.world_seed = self.world_seed
+        self.pregeneration.world_file = self.world_file
+        print(f"🌍 Открыт файл мира {path}: {len(self.world_file)} записей, зерно {self.world_seed}")
+
+    def start_new_game(self, player_name: str, world_seed: int | None = None, world_file: str | Path | None = None):
+        """
+        Инициализирует новую игру с использованием иерархической генерации.
+        Одно и то же world_seed дает тот же стартовый регион и тех же соседей.
+        С world_file стартовая локация и соседи берутся из готового файла мира.
+        """
         self.player = Character(name=player_name)
+        if world_file is not None:
+            self.open_world_file(world_file)
+        else:
+            self.world_seed = world_seed if world_seed is not None else random.randrange(2**32)
+            self.pregeneration.world_seed = self.world_seed
 
         # Даем стартовые предметы
         healing_potion = Item(name="Зелье лечения", description="Восстанавливает немного здоровья.")
@@ -50,38 +86,67 @@ class Game:
         # 1. Выбираем "континент" для старта. Пока что можно захардкодить.
         # В будущем здесь может быть выбор игрока или случайный выбор.
         start_continent_id = "torax" 
-        
-        # 2. Генерируем паспорт РЕГИОНА в контексте этого континента.
-        # Передаем сервисы как зависимости, чтобы генератор имел доступ к данным.
-        region_passport = region_gen.generate_region_passport_in_context(
-            world_data_service=self.world_data,
-            tag_registry=self.tag_registry, # Передаем, чтобы генератор мог использовать теги
-            continent_id=start_continent_id
-        )
-
-        # 3. На основе региона генерируем паспорт стартовой ЛОКАЦИИ.
-        location_passport = loc_gen.generate_location_passport(
-            region_passport=region_passport,
-            tag_registry=self.tag_registry,
-            world_data_service=self.world_data
-
-        )
+        start_key = self.world_file.start_location_key(start_continent_id) if self.world_file else None
+
+        if start_key:
+            # 2-3. Мир уже сгенерирован: стартовая локация - просто запись файла мира.
+            location_passport = self.world_file.get(start_key)
+        else:
+            # 2. Генерируем паспорт РЕГИОНА в контексте этого континента.
+            # Передаем сервисы как зависимости, чтобы генератор имел доступ к данным.
+            # Случайность берется из потока, заданного зерном мира, а не из глобального random.
+            rng = self.pregeneration.rng_for("start")
+            region_passport = region_gen.generate_region_passport_in_context(
+                world_data_service=self.world_data,
+                tag_registry=self.tag_registry, # Передаем, чтобы генератор мог использовать теги
+                continent_id=start_continent_id,
+                rng=rng
+            )
+
+            # 3. На основе региона генерируем паспорт стартовой ЛОКАЦИИ.
+            location_passport = loc_gen.generate_location_passport(
+                region_passport=region_passport,
+                tag_registry=self.tag_registry,
+                world_data_service=self.world_data,
+                rng=rng
+            )
+            location_passport["seed_path"] = "start"
 
         # 4. Создаем объект Location, передавая ему паспорт.
         # Класс Location должен быть обновлен, чтобы принимать 'passport' в __init__.
         self.current_location = Location(passport=location_passport)
 
         # 5. Просим LLM сгенерировать художественное описание
-        # на основе ПОЛНОГО и богатого паспорта локации.
-        # Это потребует создания нового, специализированного промпта.
-        # description = llm.generate_artistic_description(self.current_location.passport)
-        # self.current_location.description = description
-        # ПОКА ЧТО для теста можно использовать заглушку:
-        self.current_location.description = f"Вы находитесь в локации '{self.current_location.name}'.\n" \
-                                            f"Сгенерированные теги: {self.current_location.tags}"
+        # на основе тегов паспорта локации. Стартовая локация нужна сразу,
+        # поэтому генерируется синхронно; соседние готовятся в фоне.
+        self.pregeneration.describe(self.current_location.passport)
+        self.current_location.description = self.current_location.passport["description"]
+        self.pregeneration.schedule_neighbours(self.current_location.passport)
         
         print("--- Новая игра началась! ---")
 
+    def get_exits(self) -> List[dict]:
+        """Соседние локации, куда игрок может отправиться (готовые и еще генерирующиеся)."""
+        return self.pregeneration.candidates()
+
+    def enter_location(self, key: str) -> bool:
+        """
+        Переводит игрока в соседнюю локацию. Если она уже сгенерирована в фоне,
+        это просто выборка из хранилища, а не вызов модели.
+        """
+        passport = self.pregeneration.take(key)
+        if passport is None:
+            continent_id = self.current_location.passport.get("continent_id")
+            if not continent_id:
+                print(f"🔴 Неизвестно, куда ведет путь '{key}'.")
+                return False
+            print("⏳ Локация не была подготовлена заранее, генерируем сейчас...")
+            passport = self.pregeneration.generate_location(continent_id, key)
+
+        self.current_location = Location(passport=passport)
+        self.pregeneration.schedule_neighbours(passport)
+        return True
+
     def get_context_for_llm(self) -> dict:
         """Собирает словарь с текущей ситуацией для передачи в LLM."""
         return {
@@ -99,33 +164,27 @@ class Game:
         if new_state == GameState.COMBAT:
             # Начиная бой, очищаем лог и добавляем первую запись
             self.short_term_memory.clear()
+            self.combat_digest = ""
             self.short_term_memory.append(f"Начало боя в локации: {self.current_location.name}.")
         elif new_state == GameState.EXPLORATION:
             # Заканчивая бой, очищаем лог
             self.short_term_memory.clear()
+            self.combat_digest = ""
 
-    def _get_layered_context(self, search_query: str) -> List[str]:
-        """Собирает многослойный контекст для LLM."""
-        
-        all_context = []
-        
-        # Слой 1: Ищем 1-2 самых свежих СОБЫТИЯ, произошедших в ЭТОЙ ЖЕ локации
-        location_events = self.memory_service.retrieve_relevant_memories(
-            query_text=search_query,
-            n_results=2,
-            filter_metadata={"type": "event", "location": self.current_location.name}
-        )
-        if location_events:
-            all_context.extend(location_events)
-        
-        # Слой 2: Ищем 1 самый релевантный фрагмент глобального ЛОРА
-        global_lore = self.memory_service.retrieve_relevant_memories(
-            query_text=search_query,
-            n_results=1,
-            filter_metadata={"type": "lore"}
-        )
-        if global_lore:
-            all_context.extend(global_lore)
+    def _get_layered_context(self, search_query: str, tags: Optional[List[str]] = None) -> List[str]:
+        """Собирает многослойный контекст для LLM одним запросом к памяти."""
+        layers = [
+            # Слой 1: 1-2 самых свежих СОБЫТИЯ, произошедших в ЭТОЙ ЖЕ локации
+            MemoryLayer("events", {META_TYPE: TYPE_EVENT, META_LOCATION: self.current_location.name}, 2),
+            # Слой 2: 1 самый релевантный фрагмент глобального ЛОРА
+            MemoryLayer("lore", {META_TYPE: TYPE_LORE}, 1),
+            # Слой 3: сводка давних событий этой локации, свернутых консолидацией
+            MemoryLayer("digest", {META_TYPE: TYPE_DIGEST, META_LOCATION: self.current_location.name}, 1),
+        ]
+        with self.metrics.span("memory"):
+            found = self.memory_service.retrieve_layers(search_query, layers, tags)
+
+        all_context = [hit.text for layer in layers for hit in found[layer.name]]
 
         # Убираем дубликаты, если они есть
         unique_context = list(dict.fromkeys(all_context))
@@ -138,42 +197,61 @@ class Game:
         и формирует финальный ответ для игрока.
         """
         feedback_lines = [] # Собираем сюда сообщения о механических изменениях для игрока
+        was_in_combat = self.state == GameState.COMBAT
+
+        for key, value in changes.items():
+            self._apply_state_change(key, value, feedback_lines)
 
-        # --- Применение изменений ---
+        return self._finish_turn(narrative, command, feedback_lines, was_in_combat)
+
+    def _apply_state_change(self, key: str, value, feedback_lines: List[str]):
+        """Применяет ОДНО механическое изменение из state_changes."""
+        try:
+            # 1. Обработка добавления предметов
+            if key == ADD_ITEM:
+                new_item_name = value
+                self.player.inventory.add_item(Item(name=new_item_name, description="Неизвестный предмет"))
+                feedback_lines.append(f"(В инвентарь добавлен: {new_item_name})")
 
-        # 1. Обновление Краткосрочной Памяти (если мы в бою)
-        if self.state == GameState.COMBAT:
+            # 2. Обработка урона игроку
+            elif key == DAMAGE_PLAYER:
+                damage = int(value)
+                if damage > 0:
+                    self.player.take_damage(damage)
+                    feedback_lines.append(f"(Вы получили {damage} ед. урона!)")
+
+            # 3. Обновление Долгосрочной Памяти (создание событий)
+            elif key == NEW_EVENT:
+                event_text = value
+                event_metadata = {
+                    META_TYPE: TYPE_EVENT,
+                    META_LOCATION: self.current_location.name,
+                    META_TAGS: join_tags(self.current_location.tags),
+                }
+                # ID события (event_<seq>) выдает журнал памяти
+                self.memory_service.add_memory(event_text, None, event_metadata)
+
+            # 4. Проверка на смену состояния игры (триггер от LLM)
+            elif key == NEW_GAME_STATE:
+                new_state_str = value
+                # Этот блок можно будет улучшить, используя Enum, но пока оставим так
+                if new_state_str == "COMBAT" and self.state != GameState.COMBAT:
+                    self.change_state(GameState.COMBAT)
+                elif new_state_str == "EXPLORATION" and self.state != GameState.COMBAT:
+                    self.change_state(GameState.EXPLORATION)
+        except (KeyError, ValueError, TypeError) as e:
+            print(f"⚠️ Не удалось применить изменение '{key}': {value!r} ({e})")
+
+    def _finish_turn(self, narrative: str, command: str, feedback_lines: List[str], was_in_combat: bool) -> str:
+        """Записывает ход в лог боя и формирует финальный ответ для игрока."""
+        # Обновление Краткосрочной Памяти (если ход шел в бою)
+        if was_in_combat and self.state == GameState.COMBAT:
             self.short_term_memory.append(f"Игрок: '{command}'")
             self.short_term_memory.append(f"Результат: {narrative}")
-
-        # 2. Обработка добавления предметов
-        if ADD_ITEM in changes:
-            new_item_name = changes[ADD_ITEM]
-            self.player.inventory.add_item(Item(name=new_item_name, description="Неизвестный предмет"))
-            feedback_lines.append(f"(В инвентарь добавлен: {new_item_name})")
-
-        # 3. Обработка урона игроку
-        if DAMAGE_PLAYER in changes:
-            damage = int(changes[DAMAGE_PLAYER])
-            if damage > 0:
-                self.player.take_damage(damage)
-                feedback_lines.append(f"(Вы получили {damage} ед. урона!)")
-
-        # 4. Обновление Долгосрочной Памяти (создание событий)
-        if NEW_EVENT in changes:
-            event_text = changes[NEW_EVENT]
-            event_id = f"event_{random.randint(1000, 9999)}"
-            event_metadata = {META_TYPE: TYPE_EVENT, META_LOCATION: self.current_location.name}
-            self.memory_service.add_memory(event_text, event_id, event_metadata)
-        
-        # 5. Проверка на смену состояния игры (триггер от LLM)
-        if NEW_GAME_STATE in changes:
-            new_state_str = changes[NEW_GAME_STATE]
-            # Этот блок можно будет улучшить, используя Enum, но пока оставим так
-            if new_state_str == "COMBAT" and self.state != GameState.COMBAT:
-                self.change_state(GameState.COMBAT)
-            elif new_state_str == "EXPLORATION" and self.state != GameState.COMBAT:
-                self.change_state(GameState.EXPLORATION)
+            # Старые ходы сворачиваются в сводку, чтобы промпт боя не рос с длиной боя
+            self.short_term_memory, self.combat_digest = compact_combat_log(
+                self.short_term_memory, self.combat_digest
+            )
 
         # --- Формирование финального ответа ---
         full_response = narrative
@@ -183,43 +261,55 @@ class Game:
         return full_response
 
     @log_player_input
-    def process_player_command(self, command: str) -> str:
+    def process_player_command(self, command: str, on_narrative: Optional[Callable[[str], None]] = None) -> str:
         """
-        Делегирует команду Режиссёру, парсит ответ и передает
-        изменения в _apply_state_changes для применения.
+        Делегирует команду Режиссёру и разбирает ответ потоком: текст повествования
+        отдается в on_narrative по мере генерации, а изменения из state_changes
+        применяются, когда весь ответ разобран без ошибок.
+        Длительности этапов хода собираются в self.metrics.
         """
-        # 1. Получаем сырой ответ от LLM через Режиссёра
-        raw_response = self.director.decide_llm_action(self, command)
-        
-        # 2. Парсим ответ
-        try:          
-            # 1. Находим индекс первой открывающей скобки
-            start_index = raw_response.find('{')
-            # 2. Находим индекс ПОСЛЕДНЕЙ закрывающей скобки (поиск с конца)
-            end_index = raw_response.rfind('}')
-
-            # 3. Проверяем, что обе скобки найдены
-            if start_index == -1 or end_index == -1:
-                print(f"⚠️ Не удалось найти JSON-объект в ответе LLM.")
-                return raw_response
-
-            # 4. Вырезаем строку между этими индексами
-            json_string = raw_response[start_index : end_index + 1]
-
-            # 5. Парсим чистый JSON
-            response_data = json.loads(json_string)
-            narrative = response_data.get(NARRATIVE, "Мир погрузился в тишину...")
-            changes = response_data.get(STATE_CHANGES, {})
-            
-            return self._apply_state_changes(changes, narrative, command)
-            
-        except json.JSONDecodeError:
-            print(f"⚠️ Извлеченный текст похож на JSON, но содержит ошибку: {json_string}")
-            return raw_response
-        except Exception as e:
-            print(f"⚠️ Произошла непредвиденная ошибка при обработке ответа: {e}")
+        self.metrics.begin_turn(state=self.state.name)
+        self.embedding_service.begin_turn()
+        try:
+            return self._process_turn(command, on_narrative)
+        finally:
+            # Все воспоминания хода уходят в базу одной пачкой
+            with self.metrics.span("memory_flush"):
+                self.memory_service.flush()
+            self.memory_consolidator.schedule()
+            self.metrics.end_turn()
+
+    def _process_turn(self, command: str, on_narrative: Optional[Callable[[str], None]]) -> str:
+        parser = StreamingResponseParser(on_narrative=on_narrative)
+
+        def on_chunk(chunk: str):
+            with self.metrics.span("json_parse"):
+                parser.feed(chunk)
+
+        # 1. Получаем ответ от LLM через Режиссёра, разбирая его по кускам
+        raw_response = self.director.decide_llm_action(self, command, on_chunk=on_chunk)
+        parser.close()
+        self.metrics.record("response_chars", len(raw_response))
+
+        # 2. Если JSON так и не сложился, показываем игроку ответ как есть и ничего не применяем
+        if parser.error:
+            print(f"⚠️ Не удалось разобрать JSON-ответ LLM: {parser.error}")
             return raw_response
 
+        # 3. Изменения применяются только из целиком разобранного ответа: оборванный ответ не оставит полхода
+        narrative = parser.narrative if parser.narrative is not None else "Мир погрузился в тишину..."
+        with self.metrics.span("apply_state_changes"):
+            return self._apply_state_changes(parser.state_changes, narrative, command)
+
+    def close(self):
+        """Останавливает фоновые задачи игры перед выходом или заменой на загруженную."""
+        self.pregeneration.shutdown()
+        if self.world_file is not None:
+            self.world_file.close()
+        self.memory_consolidator.shutdown()
+        self.memory_service.close()
+        flush_logs()
+
     # --- СИСТЕМА SAVE/LOAD ---
 
     def to_dict(self) -> dict:
@@ -230,6 +320,9 @@ class Game:
             "current_location": self.current_location.to_dict() if self.current_location else None,
             "game_state": self.state.name, # Сохраняем имя Enum, например 'EXPLORATION'
             "short_term_memory": self.short_term_memory,
+            "combat_digest": self.combat_digest,
+            "world_seed": self.world_seed,
+            "world_file": str(self.world_file.path) if self.world_file else None,
             # Долгосрочную память (ChromaDB) мы не сохраняем, она живет отдельно в своей папке.
             # Мы доверяем, что она будет на месте при следующей загрузке.
         }
@@ -246,6 +339,18 @@ class Game:
         
         # Восстанавливаем простые данные
         self.short_term_memory = data.get("short_term_memory", [])
+        self.combat_digest = data.get("combat_digest", "")
+        # В старых сохранениях зерна нет - мир дальше генерируется от нового
+        self.world_seed = data.get("world_seed", random.randrange(2**32))
+        self.pregeneration.world_seed = self.world_seed
+        if data.get("world_file"):
+            if Path(data["world_file"]).exists():
+                self.open_world_file(data["world_file"])
+            else:
+                print(f"⚠️ Файл мира {data['world_file']} не найден, новые локации будут генерироваться.")
+
+        if self.current_location:
+            self.pregeneration.schedule_neighbours(self.current_location.passport)
         
         print("--- Игра успешно загружена ---")
 
@@ -254,6 +359,8 @@ class Game:
         # Создаем папку 'saves', если ее еще нет. `exist_ok=True` предотвращает ошибку, если папка уже есть.
         SAVE_DIR.mkdir(exist_ok=True) 
         filepath = SAVE_DIR / f"{filename}.json"
+        # События, на которые ссылается сохранение, должны быть уже в базе памяти
+        self.memory_service.flush()
         
         try:
             with open(filepath, "w", encoding="utf-8") as f:
@@ -1,26 +1,39 @@
 import random
 from typing import Dict, Any
 
-# Пока что у нас нет данных о локациях, поэтому генератор будет очень простым.
-# Он просто выберет биом, который подходит для сгенерированного региона.
-# Это ЗАГЛУШКА, которую мы разовьём в Фазе II Roadmap.
+# Локация-заглушка: биом выбирается из биомов сгенерированного региона,
+# ориентир - из ориентиров биома. Полноценные location_blueprints появятся в Фазе II Roadmap.
 
 def generate_location_passport(
     region_passport: Dict[str, Any],
-    tag_registry: object, # Пока не используется, но оставляем для совместимости
-    world_data_service: object # Пока не используется
+    tag_registry: object, # Интернирует теги в битовые маски
+    world_data_service: object,
+    rng: random.Random
 ) -> Dict[str, Any]:
     print(f"--- Генерация локации-заглушки в регионе '{region_passport['name']}' ---")
 
+    biome_table = world_data_service.biome_table(region_passport.get("id"))
+    biome = biome_table.sample(rng) if biome_table else None
+    landmark_table = world_data_service.landmark_table(biome["id"]) if biome else None
+    landmark = landmark_table.sample(rng) if landmark_table else None
+
     # В будущем здесь будет сложная логика выбора из location_blueprints
-    # А пока просто создаем локацию, которая наследует имя и теги региона
-    location_name = f"Неизведанная часть '{region_passport['name']}'"
+    # А пока локация наследует теги региона, а имя берет от биома
+    if biome:
+        location_name = f"{biome['name']} ({region_passport['name']})"
+    else:
+        location_name = f"Неизведанная часть '{region_passport['name']}'"
 
     location_passport = {
         "name": location_name,
         "description": "Это место еще предстоит исследовать и описать...",
-        "tags": region_passport.get("tags", []) + ["неизведанное"]
+        "tags": region_passport["tags"].add(tag_registry.intern("неизведанное")),
+        # Откуда локация родом - нужно, чтобы готовить соседние локации
+        "region_id": region_passport.get("id"),
+        "continent_id": region_passport.get("continent_id"),
+        "biome_id": biome["id"] if biome else None,
+        "landmark_id": landmark["id"] if landmark else None
     }
     
-    print(f"  -> Паспорт локации-заглушки создан. Теги: {location_passport['tags']}")
+    print(f"  -> Паспорт локации-заглушки создан. Теги: {tag_registry.tag_names(location_passport['tags'])}")
     return location_passport
\ No newline at end of file
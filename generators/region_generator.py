@@ -6,8 +6,10 @@ from services.tag_registry_service import TagRegistry
 def generate_region_passport_in_context(
     world_data_service: WorldDataService,
     tag_registry: TagRegistry,
-    continent_id: str
+    continent_id: str,
+    rng: random.Random
 ) -> Dict[str, Any]:
+    """rng - отдельный поток случайности: при одном зерне получается один и тот же регион."""
     print(f"--- Генерация региона в контексте континента '{continent_id}' ---")
 
     continent_data = world_data_service.get_continent_data(continent_id)
@@ -18,13 +20,12 @@ def generate_region_passport_in_context(
     if not allowed_region_ids:
         raise ValueError(f"Для континента '{continent_id}' не указаны типы регионов.")
 
-    allowed_regions_data = [world_data_service.get_region_type_by_id(rid) for rid in allowed_region_ids if world_data_service.get_region_type_by_id(rid)]
-
-    if not allowed_regions_data:
+    # Таблица алиасов построена при загрузке данных: выбор за O(1)
+    region_table = world_data_service.region_type_table(continent_id)
+    if region_table is None:
         raise ValueError(f"Ни один из разрешенных типов регионов для '{continent_id}' не найден в data_tables.")
 
-    weights = [data.get("weight", 1) for data in allowed_regions_data]
-    chosen_region_type = random.choices(population=allowed_regions_data, weights=weights, k=1)[0]
+    chosen_region_type = region_table.sample(rng)
 
     print(f"  -> Выбран тип региона: {chosen_region_type['name']}")
 
@@ -32,14 +33,14 @@ def generate_region_passport_in_context(
         "id": chosen_region_type['id'],
         "name": chosen_region_type['name'],
         "description": chosen_region_type.get("description", ""),
-        "tags": chosen_region_type.get("base_tags", []) # ПРЕДУПРЕЖДЕНИЕ: 'base_tags' нужно добавить в YAML!
+        "tags": tag_registry.to_tag_set(chosen_region_type.get("base_tags", [])), # Битовая маска TagSet
+        "continent_id": continent_id
     }
 
     # Валидация тегов (хорошая практика)
-    for tag in region_passport["tags"]:
-        if not tag_registry.validate_tag(tag):
-             print(f"⚠️ ВНИМАНИЕ: Тег '{tag}' из региона '{region_passport['id']}' не зарегистрирован!")
+    for tag in tag_registry.unregistered(region_passport["tags"]):
+        print(f"⚠️ ВНИМАНИЕ: Тег '{tag}' из региона '{region_passport['id']}' не зарегистрирован!")
 
 
-    print(f"  -> Паспорт региона создан. Теги: {region_passport['tags']}")
+    print(f"  -> Паспорт региона создан. Теги: {tag_registry.tag_names(region_passport['tags'])}")
     return region_passport
\ No newline at end of file
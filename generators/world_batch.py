@@ -0,0 +1,168 @@
+# generators/world_batch.py
+"""
+Пакетная генерация мира: все континенты из world_anatomy.yaml, все их регионы
+и локации, параллельно в пуле процессов. Шард - один регион со своими локациями;
+его поток случайности задается зерном мира и ключом шарда, поэтому результат
+не зависит ни от числа процессов, ни от порядка их завершения.
+
+    python -m generators.world_batch --seed 42
+    python -m generators.world_batch --seed 42 --regions 40 --locations 8 --output worlds/big.silw
+    python -m generators.world_batch --seed 42 --workers 16 --verify   # 1 и 16 процессов дают один файл
+
+Готовый файл открывается игрой вместо генерации на старте:
+    WORLD_FILE=worlds/world_42.silw python main.py
+"""
+import io
+import os
+import hashlib
+import tempfile
+import time
+import random
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+import generators.region_generator as region_gen
+import generators.location_generator as loc_gen
+from generators.world_file import WorldFileWriter
+from services.tag_registry_service import get_tag_registry
+from services.world_data_service import WorldDataService
+
+WORLDS_DIR = Path(__file__).parent.parent / "worlds"
+REGIONS_PER_CONTINENT = int(os.getenv("WORLD_REGIONS_PER_CONTINENT", "24"))
+LOCATIONS_PER_REGION = int(os.getenv("WORLD_LOCATIONS_PER_REGION", "6"))
+
+# Сервисы данных мира загружаются один раз на процесс пула
+_world_data: WorldDataService | None = None
+
+
+def _init_worker():
+    global _world_data
+    with contextlib.redirect_stdout(io.StringIO()):
+        _world_data = WorldDataService()
+        get_tag_registry()
+
+
+def region_key(continent_id: str, region_index: int) -> str:
+    return f"{continent_id}/r{region_index}"
+
+
+def generate_shard(world_seed: int, continent_id: str, region_index: int,
+                   locations_per_region: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Один регион и его локации. Возвращает записи (ключ, запись) со строковыми
+    тегами: ID тегов у каждого процесса свои, в файл идут имена. Имена сортируются:
+    порядок ID незарегистрированных тегов зависит от того, какие шарды процесс
+    обработал раньше, а файл от этого зависеть не должен.
+    """
+    world_data = _world_data or WorldDataService()
+    tag_registry = get_tag_registry()
+    key = region_key(continent_id, region_index)
+    rng = random.Random(f"{world_seed}:{key}")
+
+    # Генераторы печатают ход работы на каждую локацию - в пакетном режиме это шум
+    with contextlib.redirect_stdout(io.StringIO()):
+        region_passport = region_gen.generate_region_passport_in_context(world_data, tag_registry, continent_id, rng)
+        locations = [loc_gen.generate_location_passport(region_passport, tag_registry, world_data, rng)
+                     for _ in range(locations_per_region)]
+
+    records = []
+    location_keys = []
+    for location_index, location_passport in enumerate(locations):
+        location_key = f"{key}/l{location_index}"
+        location_keys.append(location_key)
+        location_passport.update(
+            key=location_key,
+            seed_path=location_key,
+            region_key=key,
+            tags=sorted(tag_registry.tag_names(location_passport["tags"]))
+        )
+        records.append((location_key, location_passport))
+
+    region_record = {
+        "key": key,
+        "type_id": region_passport["id"],
+        "name": region_passport["name"],
+        "description": region_passport["description"],
+        "tags": sorted(tag_registry.tag_names(region_passport["tags"])),
+        "continent_id": continent_id,
+        "location_keys": location_keys,
+    }
+    return [(key, region_record)] + records
+
+
+def _run_shard(args: Tuple[int, str, int, int]) -> List[Tuple[str, Dict[str, Any]]]:
+    return generate_shard(*args)
+
+
+def generate_world(world_seed: int, output: Path, regions_per_continent: int = REGIONS_PER_CONTINENT,
+                   locations_per_region: int = LOCATIONS_PER_REGION, workers: int | None = None) -> Path:
+    """Генерирует все континенты и пишет файл мира. Записи идут в порядке шардов."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        continent_ids = WorldDataService().continent_ids()
+    shards = [(world_seed, continent_id, region_index, locations_per_region)
+              for continent_id in continent_ids for region_index in range(regions_per_continent)]
+    meta = {
+        "world_seed": world_seed,
+        "regions_per_continent": regions_per_continent,
+        "locations_per_region": locations_per_region,
+        "continents": {continent_id: [region_key(continent_id, i) for i in range(regions_per_continent)]
+                       for continent_id in continent_ids},
+    }
+
+    started_at = time.perf_counter()
+    print(f"🌍 Генерация мира (зерно {world_seed}): {len(continent_ids)} континентов, {len(shards)} регионов...")
+    records = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool, WorldFileWriter(output, meta) as writer:
+        # map сохраняет порядок шардов: файл одинаков при любом числе процессов
+        for shard_records in pool.map(_run_shard, shards, chunksize=max(1, len(shards) // 64)):
+            for key, record in shard_records:
+                writer.add(key, record)
+                records += 1
+
+    size_kb = output.stat().st_size / 1024
+    print(f"✅ Мир записан в {output}: {records} записей, {size_kb:.0f} КБ, {time.perf_counter() - started_at:.1f} с")
+    return output
+
+
+def verify_determinism(world_seed: int, workers: int, regions_per_continent: int = REGIONS_PER_CONTINENT,
+                       locations_per_region: int = LOCATIONS_PER_REGION) -> bool:
+    """Генерирует мир одним процессом и workers процессами и сравнивает sha256 файлов."""
+    digests = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for worker_count in (1, workers):
+            path = Path(tmp_dir) / f"world_{worker_count}.silw"
+            generate_world(world_seed, path, regions_per_continent, locations_per_region, worker_count)
+            digests[worker_count] = hashlib.sha256(path.read_bytes()).hexdigest()
+    same = digests[1] == digests[workers]
+    print(("✅" if same else "🔴") + f" sha256 при 1 процессе: {digests[1][:16]}…, при {workers}: {digests[workers][:16]}…")
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная генерация мира в файл")
+    parser.add_argument("--seed", type=int, required=True, help="зерно мира")
+    parser.add_argument("--regions", type=int, default=REGIONS_PER_CONTINENT, help="регионов на континент")
+    parser.add_argument("--locations", type=int, default=LOCATIONS_PER_REGION, help="локаций на регион")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов")
+    parser.add_argument("--output", type=Path, default=None, help="путь к файлу мира")
+    parser.add_argument("--strict", action="store_true", help="не генерировать, если валидация данных нашла ошибки")
+    parser.add_argument("--verify", action="store_true",
+                        help="проверить, что файл при 1 и при --workers процессах одинаков, и выйти")
+    args = parser.parse_args()
+
+    if args.verify:
+        workers = args.workers or os.cpu_count() or 2
+        raise SystemExit(0 if verify_determinism(args.seed, workers, args.regions, args.locations) else 1)
+
+    from validate_data import run_validation
+    if not run_validation() and args.strict:
+        raise SystemExit("🔴 Данные мира не прошли валидацию, генерация отменена.")
+
+    output = args.output or WORLDS_DIR / f"world_{args.seed}.silw"
+    generate_world(args.seed, output, args.regions, args.locations, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# generators/world_file.py
+"""
+Компактный индексированный файл заранее сгенерированного мира.
+
+    [заголовок 24 байта][запись 1][запись 2]...[индекс]
+
+Заголовок: MAGIC (8 байт), версия (uint32), резерв (uint32), смещение индекса (uint64).
+Запись - JSON, сжатый zlib. Индекс - тоже сжатый zlib JSON: метаданные мира
+и ключ записи -> [смещение, длина]. Читатель загружает только заголовок и индекс,
+а записи распаковывает по запросу.
+"""
+import json
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+MAGIC = b"SILGWRLD"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+
+
+def _pack(obj: Any) -> bytes:
+    return zlib.compress(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _unpack(data: bytes) -> Any:
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+class WorldFileWriter:
+    """Пишет записи последовательно; индекс и заголовок дописываются в close()."""
+    def __init__(self, path: Path, meta: Dict[str, Any]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.meta = dict(meta)
+        self._tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, 0))
+        self._index: Dict[str, List[int]] = {}
+
+    def add(self, key: str, record: Dict[str, Any]):
+        if key in self._index:
+            raise ValueError(f"Запись '{key}' уже есть в файле мира.")
+        data = _pack(record)
+        self._index[key] = [self._file.tell(), len(data)]
+        self._file.write(data)
+
+    def close(self):
+        index_offset = self._file.tell()
+        self._file.write(_pack({"meta": self.meta, "records": self._index}))
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, index_offset))
+        self._file.close()
+        # Недописанный файл мира никогда не оказывается под итоговым именем
+        self._tmp_path.replace(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            self._tmp_path.unlink(missing_ok=True)
+
+
+class WorldFile:
+    """
+    Ленивый читатель файла мира. Записи регионов (ключ "<континент>/r<N>")
+    и локаций ("<континент>/r<N>/l<M>") распаковываются только при обращении.
+    Безопасен для чтения из нескольких потоков.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._lock = threading.Lock()
+        magic, version, _, index_offset = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} не является файлом мира.")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Версия файла мира {version} не поддерживается (ожидается {FORMAT_VERSION}).")
+        self._file.seek(index_offset)
+        index = _unpack(self._file.read())
+        self.meta: Dict[str, Any] = index["meta"]
+        self._index: Dict[str, List[int]] = index["records"]
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        position = self._index.get(key)
+        if position is None:
+            return None
+        offset, length = position
+        with self._lock:
+            self._file.seek(offset)
+            data = self._file.read(length)
+        return _unpack(data)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def keys(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def region_keys(self, continent_id: str) -> List[str]:
+        return self.meta["continents"].get(continent_id, [])
+
+    def start_location_key(self, continent_id: str) -> str | None:
+        """Первая локация первого региона континента."""
+        for region_key in self.region_keys(continent_id):
+            region = self.get(region_key)
+            if region and region["location_keys"]:
+                return region["location_keys"][0]
+        return None
+
+    def neighbours(self, location_key: str, count: int) -> List[str]:
+        """
+        Соседи локации: следующие локации того же региона по кругу,
+        а последним - вход в следующий регион континента.
+        """
+        location = self.get(location_key)
+        if location is None:
+            return []
+        region = self.get(location["region_key"])
+        siblings = region["location_keys"]
+        position = siblings.index(location_key)
+        result = [siblings[(position + step) % len(siblings)] for step in range(1, len(siblings))]
+
+        regions = self.region_keys(location["continent_id"])
+        if len(regions) > 1 and count > 0:
+            next_region = self.get(regions[(regions.index(region["key"]) + 1) % len(regions)])
+            if next_region and next_region["location_keys"]:
+                return result[:count - 1] + [next_region["location_keys"][0]]
+        return result[:count]
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
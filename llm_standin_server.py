@@ -0,0 +1,98 @@
+# llm_standin_server.py
+"""
+Локальная HTTP-заглушка LLM для нагрузочных прогонов без ключа API.
+Отвечает записанными ответами из logs/llm_trace.jsonl (как replay-бэкенд),
+но добавляет искусственную задержку и случайные ошибки.
+
+Запуск:
+    python llm_standin_server.py --port 8765 --latency-ms 800 --jitter-ms 300 --error-rate 0.05
+Игра подключается к ней так:
+    LLM_BACKEND=http LLM_HTTP_URL=http://127.0.0.1:8765 python main.py
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from services.llm_backends import ReplayBackend, DEFAULT_TRACE_FILE
+
+
+def make_handler(backend: ReplayBackend, latency_ms: float, jitter_ms: float,
+                 error_rate: float, chunk_delay_ms: float, rng: random.Random):
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/generate":
+                self.send_error(404)
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length).decode("utf-8"))
+
+            time.sleep(max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000)
+            if rng.random() < error_rate:
+                self.send_error(503, "Искусственная ошибка заглушки")
+                return
+
+            text = asyncio.run(backend.generate(payload.get("prompt", "")))
+            if payload.get("stream"):
+                self._send_stream(text)
+            else:
+                self._send_json({"text": text})
+
+        def _send_json(self, data: dict):
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_stream(self, text: str):
+            # По одному JSON-объекту на строку; соединение закрывается в конце
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            size = backend.chunk_size
+            for i in range(0, len(text), size):
+                line = json.dumps({"text": text[i:i + size]}, ensure_ascii=False) + "\n"
+                self.wfile.write(line.encode("utf-8"))
+                self.wfile.flush()
+                if chunk_delay_ms:
+                    time.sleep(chunk_delay_ms / 1000)
+            self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass  # Заглушка не должна засорять консоль на каждом запросе
+
+    return StandInHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная HTTP-заглушка LLM")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--trace", type=Path, default=DEFAULT_TRACE_FILE, help="файл трассы для ответов")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="задержка до первого байта")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="разброс задержки")
+    parser.add_argument("--chunk-delay-ms", type=float, default=30.0, help="пауза между кусками потока")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов, завершающихся 503")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    backend = ReplayBackend(trace_file=args.trace)
+    handler = make_handler(backend, args.latency_ms, args.jitter_ms, args.error_rate,
+                           args.chunk_delay_ms, random.Random(args.seed))
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"🧪 Заглушка LLM слушает http://{args.host}:{args.port} "
+          f"(задержка {args.latency_ms}±{args.jitter_ms} мс, ошибки {args.error_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Заглушка остановлена.")
+
+
+if __name__ == "__main__":
+    main()
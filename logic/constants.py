@@ -11,8 +11,10 @@ NEW_GAME_STATE = "new_game_state"
 # Типы метаданных для памяти
 META_TYPE = "type"
 META_LOCATION = "location"
+META_TAGS = "tags"  # Теги локации события, склеенные через "|"
 TYPE_LORE = "lore"
 TYPE_EVENT = "event"
+TYPE_DIGEST = "digest"  # Сводка давних событий локации (см. services/memory_consolidation.py)
 
 # --- Названия Состояний Игры ---
 # (пока не используем, но хорошо иметь здесь)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Callable, List, Optional
 from logic.game_states import GameState
 # Важно: используем 'import game' чтобы избежать циклических импортов
 # и используем type hint в кавычках: 'game.Game'
@@ -6,23 +6,45 @@ import game
 import services.llm_service as llm
 from logic.constants import *
 from services.intent_service import IntentService
+from services.embedding_service import EmbeddingService
+from services.memory_service import MemoryLayer
 import json
-from utils.prompt_manager import load_and_format_prompt 
+from utils.prompt_manager import load_and_format_prompt, fit_dict_to_budget, fit_items_to_budget, get_slot_budget, prompt_registry, estimate_tokens
+
+# Переменные, которые обработчики Режиссёра передают в свои шаблоны.
+# Сверяются с файлами из prompts/ при старте, а не в момент первого хода.
+PROMPT_FIELDS = {
+    'exploration_action': {
+        "narrative_key", "state_changes_key", "new_game_state_key",
+        "memories", "context_json", "player_action",
+    },
+    'combat_action': {
+        "narrative_key", "state_changes_key", "damage_player_key", "new_event_key",
+        "add_item_key", "new_game_state_key", "lore", "combat_log", "player_action",
+    },
+}
 
 class Director:
     # Первым идёт анализ от all-MiniLM-L6-v2 по data\intents.json
     """Инициализирует Director и его подсистемы, такие как сервис распознавания намерений."""
-    def __init__(self):
-        self.intent_service = IntentService()
+    def __init__(self, embedding_service: EmbeddingService | None = None):
+        self.intent_service = IntentService(embedding_service)
+        for prompt_name, fields in PROMPT_FIELDS.items():
+            prompt_registry.expect(prompt_name, fields)
+        prompt_registry.validate()
 
-    def decide_llm_action(self, game_instance: 'game.Game', player_command: str) -> str:
+    def decide_llm_action(self, game_instance: 'game.Game', player_command: str,
+                          on_chunk: Optional[Callable[[str], None]] = None) -> str:
         """
         Главный метод-маршрутизатор. Распознает намерение, определяет стратегию
         и делегирует выполнение соответствующему обработчику.
+        Если передан on_chunk, ответ LLM отдается в него по мере генерации.
         """
         
         # --- ШАГ 1: Распознавание намерения ---
-        intent = self.intent_service.recognize_intent(player_command)
+        with game_instance.metrics.span("intent"):
+            intent = self.intent_service.recognize_intent(player_command)
+        game_instance.metrics.record("command_chars", len(player_command))
         
         # --- ШАГ 2: Принятие решения на основе намерения и состояния ---
         
@@ -32,7 +54,7 @@ class Director:
 
         # Выбор обработчика в зависимости от ТЕКУЩЕГО состояния игры
         if game_instance.state == GameState.COMBAT:
-            return self._handle_combat(game_instance, player_command, recognized_intent=intent)
+            return self._handle_combat(game_instance, player_command, recognized_intent=intent, on_chunk=on_chunk)
                        
         # (Здесь будет логика для DIALOGUE и других методов)
 
@@ -42,35 +64,41 @@ class Director:
             print("⚠️ Намерение не распознано, используется EXPLORATION по умолчанию.")
 
         # По умолчанию (или если намерение не распознано) используется режим исследования
-        return self._handle_exploration(game_instance, player_command, recognized_intent=intent)
+        return self._handle_exploration(game_instance, player_command, recognized_intent=intent, on_chunk=on_chunk)
 
-    def _handle_exploration(self, game_instance: 'game.Game', command: str, recognized_intent: str) -> str:
+    def _handle_exploration(self, game_instance: 'game.Game', command: str, recognized_intent: str,
+                            on_chunk: Optional[Callable[[str], None]] = None) -> str:
         """Собирает контекст и промпт для режима ИССЛЕДОВАНИЯ."""
         print("🎬 Режиссёр: Сцена 'Исследование'.")
        
         if recognized_intent == "UNKNOWN":
             print("⚠️ Намерение не распознано, используется EXPLORATION по умолчанию.")
         
-        # 1. Сборка долгосрочной памяти
-        search_query = f"{' '.join(game_instance.current_location.tags)} {command}"
-        memories_list = game_instance._get_layered_context(search_query)
+        prompt_template_name = 'exploration_action'
+
+        # 1. Сборка долгосрочной памяти (в пределах бюджета шаблона)
+        # Теги локации ищутся точным совпадением отдельно от текста команды
+        memories_list = game_instance._get_layered_context(command, game_instance.current_location.tags)
+        memories_list = fit_items_to_budget(memories_list, get_slot_budget(prompt_template_name, "memories"))
         memories_str = "\n".join(f"- {item}" for item in memories_list) if memories_list else "Нет особых воспоминаний."
 
-        # 2. Сборка краткосрочной памяти
-        context_dict = game_instance.get_context_for_llm()
-        context_json_str = json.dumps(context_dict, ensure_ascii=False, indent=2)
-        
-        # 3. Сборка промпта
-        prompt_template_name = 'exploration_action'
-        prompt = load_and_format_prompt(
-            prompt_template_name,
-            narrative_key=NARRATIVE,
-            state_changes_key=STATE_CHANGES,
-            new_game_state_key=NEW_GAME_STATE,
-            memories=memories_str,
-            context_json=context_json_str,
-            player_action=command
-        )
+        with game_instance.metrics.span("prompt_render"):
+            # 2. Сборка краткосрочной памяти
+            context_dict = game_instance.get_context_for_llm()
+            # Не влезающие в бюджет ключи отбрасываются целиком: обрезанный посередине JSON модель не разберет
+            context_json_str = fit_dict_to_budget(context_dict, get_slot_budget(prompt_template_name, "context_json"),
+                                                  ensure_ascii=False, indent=2)
+            
+            # 3. Сборка промпта
+            prompt = load_and_format_prompt(
+                prompt_template_name,
+                narrative_key=NARRATIVE,
+                state_changes_key=STATE_CHANGES,
+                new_game_state_key=NEW_GAME_STATE,
+                memories=memories_str,
+                context_json=context_json_str,
+                player_action=command
+            )
         
         # 4. Формирование и отправка пакета в LLM-сервис
         llm_request = {
@@ -78,38 +106,49 @@ class Director:
             "prompt_template_name": prompt_template_name,
             "game_state": game_instance.state.name
         }
-        return llm._send_prompt_to_gemini(llm_request)
+        return self._send(game_instance, llm_request, on_chunk)
 
-    def _handle_combat(self, game_instance: 'game.Game', command: str, recognized_intent: str) -> str:
+    def _handle_combat(self, game_instance: 'game.Game', command: str, recognized_intent: str,
+                       on_chunk: Optional[Callable[[str], None]] = None) -> str:
         """Собирает контекст и промпт для режима БОЯ."""
         print("🎬 Режиссёр: Сцена 'Бой'.")
 
         if recognized_intent == "UNKNOWN":
             print("⚠️ Намерение не распознано, используется EXPLORATION по умолчанию.")
 
-        # 1. Сборка контекста
-        log_str = "\n".join(game_instance.short_term_memory)
+        prompt_template_name = 'combat_action'
+
+        # 1. Сборка контекста. Лог боя уже ужат до бюджета в Game (compact_combat_log):
+        # старые ходы лежат в сводке, свежие - дословно.
+        log_lines = game_instance.short_term_memory
+        if game_instance.combat_digest:
+            log_lines = ["Ранее в этом бою (кратко):", game_instance.combat_digest, "Последние ходы:"] + log_lines
+        log_str = "\n".join(log_lines)
         
-        search_query = f"уязвимости или тактика против {' '.join(game_instance.current_location.tags)}"
-        lore_list = game_instance.memory_service.retrieve_relevant_memories(
-            search_query, n_results=1, filter_metadata={META_TYPE: TYPE_LORE}
-        )
+        search_query = "уязвимости или тактика против врагов"
+        with game_instance.metrics.span("memory"):
+            found = game_instance.memory_service.retrieve_layers(
+                search_query, [MemoryLayer("lore", {META_TYPE: TYPE_LORE}, 1)],
+                tags=game_instance.current_location.tags
+            )
+        lore_list = [hit.text for hit in found["lore"]]
+        lore_list = fit_items_to_budget(lore_list, get_slot_budget(prompt_template_name, "lore"))
         lore_str = "\n".join(lore_list) if lore_list else "Нет особых данных."
         
         # 2. Сборка промпта
-        prompt_template_name = 'combat_action'
-        prompt = load_and_format_prompt(
-            prompt_template_name,
-            narrative_key=NARRATIVE,
-            state_changes_key=STATE_CHANGES,
-            damage_player_key=DAMAGE_PLAYER,
-            new_event_key=NEW_EVENT,
-            add_item_key=ADD_ITEM,
-            new_game_state_key=NEW_GAME_STATE,
-            lore=lore_str,
-            combat_log=log_str,
-            player_action=command
-        )
+        with game_instance.metrics.span("prompt_render"):
+            prompt = load_and_format_prompt(
+                prompt_template_name,
+                narrative_key=NARRATIVE,
+                state_changes_key=STATE_CHANGES,
+                damage_player_key=DAMAGE_PLAYER,
+                new_event_key=NEW_EVENT,
+                add_item_key=ADD_ITEM,
+                new_game_state_key=NEW_GAME_STATE,
+                lore=lore_str,
+                combat_log=log_str,
+                player_action=command
+            )
         
         # 3. Формирование и отправка пакета в LLM-сервис
         llm_request = {
@@ -117,4 +156,22 @@ class Director:
             "prompt_template_name": prompt_template_name,
             "game_state": game_instance.state.name
         }
-        return llm._send_prompt_to_gemini(llm_request)
\ No newline at end of file
+        return self._send(game_instance, llm_request, on_chunk)
+
+    def _send(self, game_instance: 'game.Game', llm_request: dict,
+              on_chunk: Optional[Callable[[str], None]]) -> str:
+        """Отправляет пакет в LLM-сервис, замеряя вызов и время до первого куска ответа."""
+        metrics = game_instance.metrics
+        metrics.record("prompt_chars", len(llm_request["prompt"]))
+        metrics.record("prompt_tokens", estimate_tokens(llm_request["prompt"]))
+        first_chunk = {"seen": False}
+
+        def timed_chunk(text: str):
+            if not first_chunk["seen"]:
+                first_chunk["seen"] = True
+                metrics.record("llm_first_chunk_seconds", metrics.seconds_since_turn_start())
+            if on_chunk is not None:
+                on_chunk(text)
+
+        with metrics.span("llm"):
+            return llm._send_prompt_to_gemini(llm_request, on_chunk=timed_chunk)
@@ -1,7 +1,9 @@
 # main.py
+import os
 from game import Game
 from services.memory_service import MemoryService 
 from logic.constants import META_TYPE, TYPE_LORE
+from services.llm_cache import response_cache
 
 
 def run_console_version():
@@ -27,11 +29,13 @@ def run_console_version():
         memory_id="fact_002",
         metadata={META_TYPE: TYPE_LORE}
     )
+    memory.flush()
     # -----------------------------
 
     # Создаем экземпляр игры
     game = Game()
-    game.start_new_game(player_name="Авантюрист")
+    # WORLD_FILE - заранее сгенерированный мир (python -m generators.world_batch --seed N)
+    game.start_new_game(player_name="Авантюрист", world_file=os.getenv("WORLD_FILE") or None)
     
     # Отображаем стартовое состояние ОДИН РАЗ
     print("\n" + "="*20)
@@ -45,6 +49,7 @@ def run_console_version():
         if game.player and game.player.is_dead():
             print("\nВаше приключение подошло к концу.")
             print("GAME OVER")
+            game.close()
             break
 
         player_input = input("\n> ")
@@ -59,6 +64,7 @@ def run_console_version():
 
         if command_verb in ["выход", "exit", "quit", "выйти"]:
             print("До новых встреч, авантюрист!")
+            game.close()
             break
         
         if command_verb == "save":
@@ -69,11 +75,68 @@ def run_console_version():
                 print("ИСПОЛЬЗОВАНИЕ: save <имя_файла>")
             continue # Пропускаем остаток цикла, чтобы не отправлять 'save' как игровое действие
 
+        if command_verb == "profile":
+            summary = game.metrics.summary()
+            if not summary:
+                print("Еще не сыграно ни одного хода.")
+                continue
+            print(f"Замеры за последние ходы (всего ходов: {game.metrics.turns}):")
+            for name, values in sorted(summary.items(), key=lambda item: (item[1]["kind"], item[0])):
+                if values["kind"] == "stage":
+                    print(f"  {name:<22} p50 {values['p50'] * 1000:8.1f} мс   p95 {values['p95'] * 1000:8.1f} мс")
+                else:
+                    print(f"  {name:<22} p50 {values['p50']:10.2f}     p95 {values['p95']:10.2f}")
+            continue
+
+        if command_verb in ["go", "идти"]:
+            exits = game.get_exits()
+            if len(command_parts) > 1 and command_parts[1].isdigit() and 0 < int(command_parts[1]) <= len(exits):
+                if game.enter_location(exits[int(command_parts[1]) - 1]["key"]):
+                    print("\n" + "="*20)
+                    print(game.current_location)
+                    print("="*20)
+            else:
+                print("Пути отсюда:")
+                for number, exit_info in enumerate(exits, start=1):
+                    status = "" if exit_info["ready"] else " (еще в тумане)"
+                    print(f"  {number}. {exit_info['name']}{status}")
+                print("ИСПОЛЬЗОВАНИЕ: go <номер>")
+            continue
+
+        if command_verb == "cache":
+            stats = response_cache.stats()
+            if not stats["templates"]:
+                print("Кэш ответов LLM еще не использовался.")
+            for template_name, values in stats["templates"].items():
+                total = values["hits"] + values["misses"]
+                hit_rate = values["hits"] / total * 100 if total else 0
+                print(f"{template_name}: попаданий {values['hits']}, промахов {values['misses']} "
+                      f"({hit_rate:.0f}%), сэкономлено {values['saved_seconds']:.1f} с")
+            print(f"Вытеснено записей: {stats['evictions']}")
+            continue
+
+        if command_verb == "index":
+            # Отчет по векторному индексу памяти (бэкенд задается MEMORY_INDEX_BACKEND)
+            report = game.memory_service.index_report()
+            print(f"Индекс памяти '{report['backend']}': {report['size']} векторов, "
+                  f"построен за {report['build_seconds']:.2f} с")
+            print(f"  запрос p50 {report['query_p50_ms']:.2f} мс, p99 {report['query_p99_ms']:.2f} мс, "
+                  f"recall@{report['k']} {report['recall_at_k']:.3f}, "
+                  f"с фильтром по '{report['filter_field']}' {report['filtered_recall_at_k']:.3f}")
+            continue
+
+        if command_verb == "reindex":
+            # Пересобирает поисковый индекс памяти из журнала (db/memory_journal.jsonl)
+            game.memory_service.flush()
+            game.memory_service.rebuild_index()
+            continue
+
         if command_verb == "load":
             if len(command_parts) > 1:
                 save_name = command_parts[1]
                 loaded_game = Game.load_from_file(save_name)
                 if loaded_game:
+                    game.close()
                     game = loaded_game # Заменяем текущий объект игры на загруженный
                     # Сразу показываем игроку, где он оказался, для погружения
                     print("\n" + "="*20 + " ЗАГРУЗКА ЗАВЕРШЕНА " + "="*20)
@@ -85,8 +148,20 @@ def run_console_version():
             continue
 
         # --- ИГРОВОЕ ДЕЙСТВИЕ ---
-        result_text = game.process_player_command(player_input)
-        print("\n" + result_text)
+        # Повествование печатается по мере генерации, остальное - после разбора ответа
+        streamed_parts = []
+        def show_narrative(text: str):
+            if not streamed_parts:
+                print()
+            streamed_parts.append(text)
+            print(text, end="", flush=True)
+
+        result_text = game.process_player_command(player_input, on_narrative=show_narrative)
+        streamed_text = "".join(streamed_parts)
+        if streamed_text and result_text.startswith(streamed_text):
+            print(result_text[len(streamed_text):])
+        else:
+            print("\n" + result_text)
         
         # Обновляем отображение состояния персонажа
         print("\n" + "-"*20)
@@ -1,13 +1,21 @@
 from typing import List, Dict, Any
+from models.tag_set import TagSet
+from services.tag_registry_service import get_tag_registry
 
 class Location:
     def __init__(self, passport: Dict[str, Any]):
         self.name: str = passport.get("name", "Неизвестное место")
-        self.tags: List[str] = passport.get("tags", [])
+        # Теги хранятся битовой маской; в паспорте из сохранения они еще строками
+        self.tag_set: TagSet = get_tag_registry().to_tag_set(passport.get("tags", []))
         # Описание тоже может быть в паспорте, либо генерироваться позже
         self.description: str = passport.get("description", "Место выглядит неопределенно...")
         self.passport = passport # Сохраняем весь паспорт на всякий случай
 
+    @property
+    def tags(self) -> List[str]:
+        """Строковые теги - для промптов, памяти и сохранений."""
+        return get_tag_registry().tag_names(self.tag_set)
+
     def __str__(self):
         # Метод для отображения не меняется
         tags_str = ", ".join(self.tags)
@@ -24,7 +32,7 @@ class Location:
             "name": self.name,
             "tags": self.tags,
             "description": self.description,
-            "passport": self.passport # Сохраняем и паспорт
+            "passport": {**self.passport, "tags": self.tags} # Сохраняем и паспорт, теги - строками
         }
 
     @classmethod
@@ -35,6 +43,6 @@ class Location:
         else: # Обратная совместимость со старыми сохранениями
             location = cls(passport={}) # Создаем с пустым паспортом
             location.name = data.get("name", "Неизвестная локация")
-            location.tags = data.get("tags", [])
+            location.tag_set = get_tag_registry().to_tag_set(data.get("tags", []))
             location.description = data.get("description", "Таинственный туман...")
             return location
\ No newline at end of file
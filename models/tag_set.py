@@ -0,0 +1,71 @@
+# models/tag_set.py
+from typing import Iterable, Iterator
+
+
+class TagSet:
+    """
+    Неизменяемое множество тегов в виде битовой маски: бит N установлен,
+    если в множестве есть тег с целочисленным ID N (ID выдает TagRegistry).
+    Объединение, пересечение и проверки совместимости - одна операция над int.
+    Строковые имена тегов получаются только через TagRegistry.tag_names().
+    """
+    __slots__ = ("bits",)
+
+    def __init__(self, bits: int = 0):
+        self.bits = bits
+
+    @classmethod
+    def from_ids(cls, tag_ids: Iterable[int]) -> "TagSet":
+        bits = 0
+        for tag_id in tag_ids:
+            bits |= 1 << tag_id
+        return cls(bits)
+
+    def ids(self) -> Iterator[int]:
+        """ID тегов по возрастанию."""
+        bits = self.bits
+        while bits:
+            low_bit = bits & -bits
+            yield low_bit.bit_length() - 1
+            bits ^= low_bit
+
+    def add(self, tag_id: int) -> "TagSet":
+        return TagSet(self.bits | (1 << tag_id))
+
+    def __contains__(self, tag_id: int) -> bool:
+        return bool(self.bits >> tag_id & 1)
+
+    def __iter__(self) -> Iterator[int]:
+        return self.ids()
+
+    def __len__(self) -> int:
+        return self.bits.bit_count()
+
+    def __bool__(self) -> bool:
+        return self.bits != 0
+
+    def __or__(self, other: "TagSet") -> "TagSet":
+        return TagSet(self.bits | other.bits)
+
+    def __and__(self, other: "TagSet") -> "TagSet":
+        return TagSet(self.bits & other.bits)
+
+    def __sub__(self, other: "TagSet") -> "TagSet":
+        return TagSet(self.bits & ~other.bits)
+
+    def issubset(self, other: "TagSet") -> bool:
+        """Все теги этого множества есть в other (например, требования биома выполнены регионом)."""
+        return self.bits & ~other.bits == 0
+
+    def isdisjoint(self, other: "TagSet") -> bool:
+        """Нет общих тегов (например, ни одного запрещенного тега)."""
+        return self.bits & other.bits == 0
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, TagSet) and self.bits == other.bits
+
+    def __hash__(self) -> int:
+        return hash(self.bits)
+
+    def __repr__(self):
+        return f"TagSet({list(self.ids())})"
@@ -0,0 +1,133 @@
+# services/embedding_runtime.py
+import os
+import time
+import threading
+from pathlib import Path
+from typing import List
+import numpy as np
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Та же папка, куда Chroma скачивает модель для DefaultEmbeddingFunction: второй копии не будет
+MODEL_DIR = Path.home() / ".cache" / "chroma" / "onnx_models" / MODEL_NAME / "onnx"
+# int8-вариант модели: заметно быстрее на CPU ценой небольшой потери точности
+QUANTIZED = os.getenv("EMBEDDING_QUANTIZED", "0") == "1"
+# Потоки ONNX Runtime внутри одного прогона (0 - на усмотрение ONNX Runtime)
+INTRA_OP_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+INTER_OP_THREADS = int(os.getenv("EMBEDDING_INTER_THREADS", "1"))
+# Сколько текстов идет в модель за один прогон
+BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+MAX_TOKENS = 256
+
+
+class EmbeddingRuntime:
+    """
+    Локальный ONNX-рантайм all-MiniLM-L6-v2: модель и токенизатор загружаются
+    один раз на процесс, тексты идут в модель пачками, число потоков задается
+    явно. Вызывается так же, как функции эмбеддингов Chroma: runtime(input=[...]).
+    """
+    def __init__(self, model_dir: Path = MODEL_DIR, quantized: bool = QUANTIZED,
+                 intra_op_threads: int = INTRA_OP_THREADS, inter_op_threads: int = INTER_OP_THREADS,
+                 batch_size: int = BATCH_SIZE):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.batch_size = batch_size
+        self.model_id = f"{MODEL_NAME}-int8" if quantized else MODEL_NAME
+
+        started_at = time.perf_counter()
+        self._ensure_model()
+        model_path = self._quantized_model() if quantized else model_dir / "model.onnx"
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+        self.session = onnxruntime.InferenceSession(str(model_path), sess_options=options,
+                                                    providers=["CPUExecutionProvider"])
+        self._input_names = {node.name for node in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_TOKENS)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+        self._lock = threading.Lock()
+        self.texts_embedded = 0
+        self.batches_run = 0
+        self.inference_seconds = 0.0
+        print(f"✅ Модель эмбеддингов '{self.model_id}' загружена за {time.perf_counter() - started_at:.2f} с")
+
+    def _ensure_model(self):
+        """Если модели еще нет на диске, ее скачивает штатная функция эмбеддингов Chroma."""
+        if (self.model_dir / "model.onnx").exists():
+            return
+        from chromadb.utils import embedding_functions
+        print(f"⬇️ Загрузка модели эмбеддингов {MODEL_NAME}...")
+        embedding_functions.DefaultEmbeddingFunction()(["загрузка модели"])
+
+    def _quantized_model(self) -> Path:
+        """int8-версия модели. Квантуется один раз и кладется рядом с исходной."""
+        path = self.model_dir / "model.int8.onnx"
+        if not path.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            print("⚙️ Квантование модели эмбеддингов в int8 (один раз)...")
+            quantize_dynamic(str(self.model_dir / "model.onnx"), str(path), weight_type=QuantType.QInt8)
+        return path
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        vectors = []
+        for start in range(0, len(input), self.batch_size):
+            vectors.extend(self._run_batch(list(input[start:start + self.batch_size])))
+        return vectors
+
+    def _run_batch(self, texts: List[str]) -> np.ndarray:
+        started_at = time.perf_counter()
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        last_hidden_state = self.session.run(None, feeds)[0]
+        # Mean pooling по настоящим токенам (без паддинга) и L2-нормировка, как в Chroma
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (last_hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+        with self._lock:
+            self.texts_embedded += len(texts)
+            self.batches_run += 1
+            self.inference_seconds += time.perf_counter() - started_at
+        return pooled.astype(np.float32)
+
+    def warm_up(self):
+        """Первый прогон ONNX Runtime медленный (выделение памяти, JIT графа) - делаем его при запуске."""
+        started_at = time.perf_counter()
+        self(["осмотреться вокруг"] * min(self.batch_size, 8))
+        print(f"🔥 Прогрев модели эмбеддингов: {(time.perf_counter() - started_at) * 1000:.0f} мс")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "model": self.model_id,
+                "texts": self.texts_embedded,
+                "batches": self.batches_run,
+                "seconds": self.inference_seconds,
+            }
+
+
+_runtime: EmbeddingRuntime | None = None
+_runtime_lock = threading.Lock()
+
+def get_embedding_runtime() -> EmbeddingRuntime:
+    """Единый на процесс рантайм: модель загружается и прогревается один раз."""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = EmbeddingRuntime()
+            _runtime.warm_up()
+        return _runtime
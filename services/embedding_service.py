@@ -0,0 +1,96 @@
+# services/embedding_service.py
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Sequence
+from chromadb.utils import embedding_functions
+
+# Сколько последних эмбеддингов держать в памяти между ходами
+LRU_SIZE = 2048
+# Чем считать эмбеддинги: onnx - общий рантайм services/embedding_runtime.py,
+# chroma - штатная DefaultEmbeddingFunction
+EMBEDDING_RUNTIME = os.getenv("EMBEDDING_RUNTIME", "onnx")
+
+
+def _default_embedding_function():
+    if EMBEDDING_RUNTIME == "onnx":
+        from services.embedding_runtime import get_embedding_runtime
+        return get_embedding_runtime()
+    return embedding_functions.DefaultEmbeddingFunction()
+
+
+class EmbeddingService:
+    """
+    Общий сервис эмбеддингов для IntentService и MemoryService.
+    Каждый уникальный текст за ход превращается в вектор ровно один раз,
+    а недавние векторы переживают ход в ограниченном LRU-кэше.
+    В коллекции Chroma уходят уже готовые векторы (query_embeddings / embeddings).
+    """
+    def __init__(self, embedding_function=None, max_entries: int = LRU_SIZE):
+        # По умолчанию - та же модель, которой Chroma эмбеддит коллекции (all-MiniLM-L6-v2)
+        self.embedding_function = embedding_function or _default_embedding_function()
+        # Идентификатор модели: векторы разных вариантов (например, int8) несравнимы
+        self.model_id = getattr(self.embedding_function, "model_id", "all-MiniLM-L6-v2")
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, list]" = OrderedDict()
+        self._turn: Dict[str, list] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def begin_turn(self):
+        """Начало хода: векторы прошлого хода остаются только в LRU."""
+        with self._lock:
+            self._turn.clear()
+
+    def embed(self, text: str) -> list:
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts: Sequence[str], use_cache: bool = True) -> List[list]:
+        """
+        Возвращает векторы для списка текстов. Все отсутствующие в кэше
+        уникальные тексты считаются одной пачкой за один вызов модели.
+        use_cache=False - для массовой загрузки (например, примеров намерений),
+        чтобы не вытеснять из LRU тексты игровых ходов.
+        """
+        if not use_cache:
+            return list(self.embedding_function(list(texts)))
+
+        result: Dict[str, list] = {}
+        with self._lock:
+            for text in texts:
+                vector = self._turn.get(text)
+                if vector is None and text in self._lru:
+                    vector = self._lru[text]
+                    self._lru.move_to_end(text)
+                if vector is not None:
+                    result[text] = vector
+                    self._turn[text] = vector
+            missing = list(dict.fromkeys(text for text in texts if text not in result))
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = self.embedding_function(missing)
+            with self._lock:
+                for text, vector in zip(missing, vectors):
+                    result[text] = vector
+                    self._turn[text] = vector
+                    self._lru[text] = vector
+                    self._lru.move_to_end(text)
+                while len(self._lru) > self.max_entries:
+                    self._lru.popitem(last=False)
+
+        return [result[text] for text in texts]
+
+
+_shared_service: EmbeddingService | None = None
+_shared_lock = threading.Lock()
+
+def get_embedding_service() -> EmbeddingService:
+    """Единый на процесс сервис эмбеддингов: модель загружается один раз."""
+    global _shared_service
+    with _shared_lock:
+        if _shared_service is None:
+            _shared_service = EmbeddingService()
+        return _shared_service
@@ -0,0 +1,115 @@
+# services/intent_classifier.py
+import numpy as np
+from typing import Dict, List, Sequence, Tuple
+
+UNKNOWN_INTENT = "UNKNOWN"
+
+# Минимальная уверенность, с которой принимается намерение.
+# Для COMBAT порог выше: ошибочно начатый бой обходится игроку дороже всего.
+INTENT_THRESHOLDS: Dict[str, float] = {
+    "COMBAT": 0.45,
+    "EXPLORATION": 0.30,
+    "DIALOGUE": 0.40,
+}
+DEFAULT_THRESHOLD = 0.35
+
+# Косинусная близость, ниже которой сосед считается "ничем не похожим",
+# и выше которой - "точным совпадением". Между ними уверенность растет линейно.
+SIMILARITY_FLOOR = 0.20
+SIMILARITY_CEILING = 0.70
+
+
+class KNNIntentClassifier:
+    """
+    k-NN классификатор намерений целиком в памяти процесса.
+    Эмбеддинги всех примеров лежат одной нормированной матрицей NumPy,
+    поэтому классификация команды - это одно умножение матрицы на вектор,
+    а пачки команд - одно умножение матриц.
+    """
+    def __init__(self, embeddings, labels: Sequence[str], k: int = 5, temperature: float = 0.05,
+                 thresholds: Dict[str, float] = None, default_threshold: float = DEFAULT_THRESHOLD):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        self.matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        self.intents: List[str] = sorted(set(labels))
+        self._intent_index = {intent: i for i, intent in enumerate(self.intents)}
+        self.label_ids = np.array([self._intent_index[label] for label in labels], dtype=np.int64)
+        self.k = max(1, min(k, len(labels)))
+        self.temperature = temperature
+        self.thresholds = INTENT_THRESHOLDS if thresholds is None else thresholds
+        self.default_threshold = default_threshold
+
+    @classmethod
+    def from_collection(cls, collection, **kwargs) -> "KNNIntentClassifier":
+        """Строит классификатор из эмбеддингов, уже сохраненных в коллекции Chroma."""
+        data = collection.get(include=["embeddings", "metadatas"])
+        labels = [metadata["intent"] for metadata in data["metadatas"]]
+        return cls(data["embeddings"], labels, **kwargs)
+
+    def _normalize(self, vectors) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def _score(self, similarities: np.ndarray) -> List[Tuple[str, float]]:
+        """Взвешенное голосование top-k соседей для каждой строки матрицы близостей."""
+        n = similarities.shape[0]
+        k = min(self.k, similarities.shape[1])
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(similarities, top, axis=1)
+
+        # Веса соседей - softmax по близости: ближайшие голосуют сильнее
+        weights = np.exp((top_sims - top_sims.max(axis=1, keepdims=True)) / self.temperature)
+        weights /= weights.sum(axis=1, keepdims=True)
+        votes = np.zeros((n, len(self.intents)), dtype=np.float32)
+        np.add.at(votes, (np.repeat(np.arange(n), k), self.label_ids[top].ravel()), weights.ravel())
+
+        winners = votes.argmax(axis=1)
+        vote_share = votes[np.arange(n), winners]
+        # Калибровка: доля голосов умножается на то, насколько близок лучший пример
+        # победившего намерения. Непохожая ни на что команда не получит высокой уверенности.
+        winner_mask = self.label_ids[top] == winners[:, None]
+        best_sim = np.where(winner_mask, top_sims, -1.0).max(axis=1)
+        closeness = np.clip((best_sim - SIMILARITY_FLOOR) / (SIMILARITY_CEILING - SIMILARITY_FLOOR), 0.0, 1.0)
+        confidence = vote_share * closeness
+
+        results = []
+        for winner, score in zip(winners, confidence):
+            intent = self.intents[winner]
+            if score < self.thresholds.get(intent, self.default_threshold):
+                intent = UNKNOWN_INTENT
+            results.append((intent, float(score)))
+        return results
+
+    def classify(self, embedding) -> Tuple[str, float]:
+        """Возвращает (намерение, уверенность 0..1). Ниже порога намерения - UNKNOWN."""
+        return self.classify_batch([embedding])[0]
+
+    def classify_batch(self, embeddings) -> List[Tuple[str, float]]:
+        """Классифицирует сразу много команд одним умножением матриц."""
+        if len(self.label_ids) == 0:
+            return [(UNKNOWN_INTENT, 0.0) for _ in range(len(embeddings))]
+        return self._score(self._normalize(embeddings) @ self.matrix.T)
+
+    def evaluate(self) -> Dict[str, object]:
+        """
+        Офлайн-оценка leave-one-out по самим примерам (например, из intents.json):
+        каждый пример классифицируется по всем остальным.
+        """
+        similarities = self.matrix @ self.matrix.T
+        np.fill_diagonal(similarities, -np.inf)
+        predictions = self._score(similarities)
+
+        per_intent = {intent: {"total": 0, "correct": 0, "unknown": 0} for intent in self.intents}
+        for label_id, (predicted, _) in zip(self.label_ids, predictions):
+            stats = per_intent[self.intents[label_id]]
+            stats["total"] += 1
+            stats["correct"] += predicted == self.intents[label_id]
+            stats["unknown"] += predicted == UNKNOWN_INTENT
+
+        total = len(predictions)
+        correct = sum(stats["correct"] for stats in per_intent.values())
+        return {
+            "examples": total,
+            "accuracy": correct / total if total else 0.0,
+            "unknown_rate": sum(stats["unknown"] for stats in per_intent.values()) / total if total else 0.0,
+            "per_intent": per_intent,
+        }
@@ -1,29 +1,66 @@
 import json
+import hashlib
 import chromadb
 from pathlib import Path
+from typing import List, Tuple
+from services.intent_classifier import KNNIntentClassifier
+from services.embedding_service import EmbeddingService, get_embedding_service
 
 INTENTS_FILE = Path(__file__).parent.parent / "data/intents.json"
+DB_PATH = str(Path(__file__).parent.parent / "db")
 COLLECTION_NAME = "intent_recognition_collection"
+# Модель эмбеддингов Chroma по умолчанию. Входит в хэш индекса:
+# сменится модель - индекс будет пересобран.
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# Сколько примеров отправлять в Chroma за один вызов add
+ADD_BATCH_SIZE = 512
 
 class IntentService:
-    def __init__(self):
+    def __init__(self, embedding_service: EmbeddingService | None = None):
         print("⚙️ Инициализация Сервиса Распознавания Намерений...")
-        client = chromadb.Client()
-        # 1. Получаем список ВСЕХ существующих коллекций
-        existing_collections = [c.name for c in client.list_collections()]
-        
-        # 2. Проверяем, есть ли НАША коллекция в этом списке
-        if COLLECTION_NAME in existing_collections:
-            # 3. И удаляем ее, только если она была найдена
-            print(f"Очистка старой базы намерений ('{COLLECTION_NAME}')...")
-            client.delete_collection(name=COLLECTION_NAME)
-        
-        # 4. Теперь мы можем безопасно создавать новую, чистую коллекцию
-        self.collection = client.get_or_create_collection(name=COLLECTION_NAME)
-        self._load_intents_into_chroma()
+        # Индекс хранится на диске и переживает перезапуски и загрузки сохранений
+        client = chromadb.PersistentClient(path=DB_PATH)
+
+        # Общий с MemoryService сервис эмбеддингов: команда игрока эмбеддится один раз за ход
+        self.embeddings = embedding_service or get_embedding_service()
+        source_hash = self._compute_source_hash(self.embeddings.model_id)
+
+        existing = self._get_existing_collection(client)
+        if existing is not None and (existing.metadata or {}).get("source_hash") == source_hash:
+            self.collection = existing
+            print(f"✅ Векторная база намерений актуальна, пересчет не нужен ({self.collection.count()} примеров).")
+        else:
+            if existing is not None:
+                # Примеры или модель изменились - старые эмбеддинги недействительны
+                print(f"Очистка устаревшей базы намерений ('{COLLECTION_NAME}')...")
+                client.delete_collection(name=COLLECTION_NAME)
+
+            self.collection = client.create_collection(
+                name=COLLECTION_NAME,
+                metadata={"source_hash": source_hash, "embedding_model": self.embeddings.model_id}
+            )
+            self._load_intents_into_chroma()
+
+        # Все эмбеддинги примеров - одной матрицей в памяти, без запросов к Chroma на каждый ход
+        self.classifier = KNNIntentClassifier.from_collection(self.collection)
+
+    @staticmethod
+    def _compute_source_hash(model_id: str = EMBEDDING_MODEL_NAME) -> str:
+        """Хэш содержимого intents.json вместе с именем модели эмбеддингов (и ее варианта, например int8)."""
+        digest = hashlib.sha256()
+        digest.update(model_id.encode("utf-8"))
+        digest.update(INTENTS_FILE.read_bytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _get_existing_collection(client):
+        try:
+            return client.get_collection(name=COLLECTION_NAME)
+        except Exception:
+            return None  # Коллекции еще нет (первый запуск)
 
     def _load_intents_into_chroma(self):
-        """Загружает все примеры из JSON в векторную базу."""
+        """Загружает все примеры из JSON в векторную базу пачками."""
         with open(INTENTS_FILE, "r", encoding="utf-8") as f:
             intents_data = json.load(f)
         
@@ -32,22 +69,45 @@ class IntentService:
         metadatas = [item['metadata'] for item in intents_data]
         ids = [f"intent_{i}" for i in range(len(documents))]
 
-        self.collection.add(documents=documents, metadatas=metadatas, ids=ids)
+        for start in range(0, len(documents), ADD_BATCH_SIZE):
+            end = start + ADD_BATCH_SIZE
+            # Примеры не кладем в LRU, чтобы не вытеснить из него тексты ходов
+            embeddings = self.embeddings.embed_many(documents[start:end], use_cache=False)
+            self.collection.add(documents=documents[start:end], embeddings=embeddings,
+                                metadatas=metadatas[start:end], ids=ids[start:end])
         print(f"✅ Векторная база намерений успешно загружена ({len(documents)} примеров).")
 
+    def recognize_intent_with_confidence(self, player_command: str) -> Tuple[str, float]:
+        """
+        Находит наиболее вероятное намерение команды игрока и уверенность в нем (0..1).
+        Если уверенность ниже порога намерения, возвращается UNKNOWN.
+        """
+        embedding = self.embeddings.embed(player_command)
+        recognized_intent, confidence = self.classifier.classify(embedding)
+        print(f"🔍 Распознано намерение: '{player_command}' -> {recognized_intent} ({confidence:.2f})")
+        return recognized_intent, confidence
+
     def recognize_intent(self, player_command: str) -> str:
         """
         Находит наиболее близкое намерение к команде игрока.
         """
-        results = self.collection.query(
-            query_texts=[player_command],
-            n_results=1 # Нам нужен только один, самый похожий результат
-        )
-        
-        if not results['metadatas'][0]:
-            return "UNKNOWN" # На случай, если ничего не найдено
-        
-        # Извлекаем намерение из метаданных самого похожего примера
-        recognized_intent = results['metadatas'][0][0]['intent']
-        print(f"🔍 Распознано намерение: '{player_command}' -> {recognized_intent}")
-        return recognized_intent
\ No newline at end of file
+        return self.recognize_intent_with_confidence(player_command)[0]
+
+    def recognize_intents(self, player_commands: List[str]) -> List[Tuple[str, float]]:
+        """Пакетное распознавание: одна пачка эмбеддингов и одно умножение матриц."""
+        if not player_commands:
+            return []
+        return self.classifier.classify_batch(self.embeddings.embed_many(player_commands))
+
+    def evaluate(self) -> dict:
+        """Оценка классификатора leave-one-out по примерам из intents.json."""
+        return self.classifier.evaluate()
+
+
+if __name__ == "__main__":
+    # Офлайн-проверка качества: python -m services.intent_service
+    report = IntentService().evaluate()
+    print(f"Примеров: {report['examples']}, точность: {report['accuracy']:.1%}, "
+          f"UNKNOWN: {report['unknown_rate']:.1%}")
+    for intent, stats in report["per_intent"].items():
+        print(f"  {intent:<12} {stats['correct']}/{stats['total']} верно, {stats['unknown']} UNKNOWN")
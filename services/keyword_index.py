@@ -0,0 +1,180 @@
+# services/keyword_index.py
+import math
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+# Разделитель тегов в метаданных воспоминания (Chroma хранит в метаданных только скаляры)
+TAG_SEPARATOR = "|"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Частые окончания русских слов, от длинных к коротким: "руинах" и "руины" -> "руин"
+_ENDINGS = sorted([
+    "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ах", "ях", "ов", "ев", "ой", "ей",
+    "ом", "ем", "ам", "ям", "ую", "юю", "ая", "яя", "ые", "ие", "ый", "ий", "ых", "их",
+    "а", "я", "ы", "и", "у", "ю", "о", "е", "ь",
+], key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+def _stem(token: str) -> str:
+    for ending in _ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= MIN_STEM_LENGTH:
+            return token[:-len(ending)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Основы слов текста в нижнем регистре. Однобуквенные слова (предлоги) не индексируются."""
+    return [_stem(token) for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+
+def split_tags(value: str | None) -> List[str]:
+    return [tag for tag in (value or "").split(TAG_SEPARATOR) if tag]
+
+
+def join_tags(tags: Iterable[str]) -> str:
+    return TAG_SEPARATOR.join(tags)
+
+
+class KeywordIndex:
+    """
+    Инвертированные индексы памяти в оперативной памяти процесса:
+      - BM25 по словам текста воспоминания;
+      - точные постинги по тегам (тег совпадает целиком, без "похожести");
+      - индекс метаданных (ключ, значение) -> id для мгновенного сужения кандидатов.
+    Стоимость запроса зависит от длины постингов слов запроса, а не от размера памяти.
+    """
+    def __init__(self, tags_field: str, k1: float = 1.5, b: float = 0.75):
+        self.tags_field = tags_field
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # слово -> {id: частота}
+        self._tag_postings: Dict[str, Set[str]] = defaultdict(set)
+        self._metadata_postings: Dict[Tuple[str, Any], Set[str]] = defaultdict(set)
+        self._doc_lengths: Dict[str, int] = {}
+        self._documents: Dict[str, str] = {}
+        self._doc_keys: Dict[str, Tuple[List[str], List[Tuple[str, Any]]]] = {}  # id -> (теги, метаданные)
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._tag_postings.clear()
+            self._metadata_postings.clear()
+            self._doc_lengths.clear()
+            self._documents.clear()
+            self._doc_keys.clear()
+            self._total_length = 0
+
+    def document(self, doc_id: str) -> str | None:
+        return self._documents.get(doc_id)
+
+    def add(self, doc_id: str, text: str, metadata: Dict[str, Any]):
+        with self._lock:
+            if doc_id in self._documents:
+                self._remove_locked(doc_id)
+            tokens = tokenize(text)
+            for token in tokens:
+                postings = self._postings[token]
+                postings[doc_id] = postings.get(doc_id, 0) + 1
+            tags = split_tags(metadata.get(self.tags_field))
+            metadata_items = [(key, value) for key, value in metadata.items() if key != self.tags_field]
+            for tag in tags:
+                self._tag_postings[tag].add(doc_id)
+            for item in metadata_items:
+                self._metadata_postings[item].add(doc_id)
+            self._doc_keys[doc_id] = (tags, metadata_items)
+            self._documents[doc_id] = text
+            self._doc_lengths[doc_id] = len(tokens)
+            self._total_length += len(tokens)
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            if doc_id in self._documents:
+                self._remove_locked(doc_id)
+
+    def _remove_locked(self, doc_id: str):
+        for token in tokenize(self._documents[doc_id]):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[token]
+        tags, metadata_items = self._doc_keys.pop(doc_id)
+        for index, keys in ((self._tag_postings, tags), (self._metadata_postings, metadata_items)):
+            for key in keys:
+                index[key].discard(doc_id)
+                if not index[key]:
+                    del index[key]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        del self._documents[doc_id]
+
+    def candidates(self, filter_metadata: Dict[str, Any] | None) -> Set[str] | None:
+        """
+        Множество id, удовлетворяющих всем равенствам фильтра.
+        None - фильтра нет, подходят все документы.
+        """
+        if not filter_metadata:
+            return None
+        with self._lock:
+            sets = [self._metadata_postings.get((key, value), set()) for key, value in filter_metadata.items()]
+        sets.sort(key=len)  # Пересечение начинаем с самого короткого постинга
+        result = set(sets[0])
+        for other in sets[1:]:
+            result &= other
+            if not result:
+                break
+        return result
+
+    def search(self, query_text: str, filter_metadata: Dict[str, Any] | None = None,
+               limit: int = 10) -> List[Tuple[str, float]]:
+        """BM25 по словам запроса среди кандидатов фильтра. Возвращает [(id, оценка)] по убыванию."""
+        allowed = self.candidates(filter_metadata)
+        if allowed is not None and not allowed:
+            return []
+        scores: Dict[str, float] = defaultdict(float)
+        with self._lock:
+            total_docs = len(self._documents)
+            if not total_docs:
+                return []
+            average_length = self._total_length / total_docs or 1.0
+            for token in set(tokenize(query_text)):
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    if allowed is not None and doc_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / average_length)
+                    scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def search_tags(self, tags: Iterable[str], filter_metadata: Dict[str, Any] | None = None,
+                    limit: int = 10) -> List[Tuple[str, float]]:
+        """Воспоминания с точным совпадением тегов. Оценка - число совпавших тегов."""
+        allowed = self.candidates(filter_metadata)
+        if allowed is not None and not allowed:
+            return []
+        scores: Dict[str, float] = defaultdict(float)
+        with self._lock:
+            for tag in set(tags):
+                for doc_id in self._tag_postings.get(tag, ()):
+                    if allowed is None or doc_id in allowed:
+                        scores[doc_id] += 1.0
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Объединяет несколько ранжированных списков id (Reciprocal Rank Fusion)."""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
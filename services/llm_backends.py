@@ -0,0 +1,208 @@
+# services/llm_backends.py
+import os
+import gzip
+import json
+import asyncio
+import hashlib
+import urllib.request
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import AsyncIterator, Dict, List
+
+LOG_DIR = Path(__file__).parent.parent / "logs"
+DEFAULT_TRACE_FILE = LOG_DIR / "llm_trace.jsonl"
+
+
+def prompt_hash(prompt: str) -> str:
+    """Ключ, по которому replay-бэкенд находит записанный ответ."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class LLMBackend(ABC):
+    """
+    Интерфейс бэкенда LLM. Бэкенд умеет только одно - превратить промпт в текст.
+    Трассировка, кэш и "аварийные" ответы живут уровнем выше, в llm_service.
+    """
+    name = "base"
+    model_name = "unknown"
+
+    @abstractmethod
+    async def generate(self, prompt: str) -> str:
+        ...
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        # По умолчанию - один кусок с полным ответом
+        yield await self.generate(prompt)
+
+
+class UnavailableBackend(LLMBackend):
+    """Заглушка на случай, если настоящий бэкенд не удалось сконфигурировать."""
+    def __init__(self, name: str, model_name: str, error: Exception):
+        self.name = name
+        self.model_name = model_name
+        self.error = error
+
+    async def generate(self, prompt: str) -> str:
+        raise RuntimeError(f"бэкенд не сконфигурирован: {self.error}")
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        raise RuntimeError(f"бэкенд не сконфигурирован: {self.error}")
+        yield  # делает метод асинхронным генератором
+
+
+class GeminiBackend(LLMBackend):
+    """Настоящий Gemini через google.generativeai. Держит один экземпляр модели."""
+    name = "gemini"
+
+    def __init__(self, model_name: str, api_key: str | None):
+        import google.generativeai as genai
+        if not api_key:
+            raise ValueError("Ключ API Gemini не найден. Проверьте файл .env и переменную GEMINI_API_KEY.")
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+        print(f"Сервис Gemini успешно сконфигурирован. Используется модель: {model_name}")
+
+    async def generate(self, prompt: str) -> str:
+        response = await self._model.generate_content_async(prompt)
+        return response.text.strip()
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        response = await self._model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Детерминированный офлайн-бэкенд: отвечает тем, что уже записано
+    в logs/llm_trace.jsonl для промпта с тем же хэшем.
+    Для незнакомых промптов возвращает синтетический, но валидный JSON-ответ.
+    """
+    name = "replay"
+
+    def __init__(self, trace_file: Path = DEFAULT_TRACE_FILE, latency_ms: float = 0.0,
+                 chunk_size: int = 24, strict: bool = False):
+        self.model_name = f"replay:{Path(trace_file).name}"
+        self.latency_ms = latency_ms
+        self.chunk_size = chunk_size
+        self.strict = strict
+        self.responses = self._load_trace(Path(trace_file))
+        print(f"🎞️ Replay-бэкенд: загружено {len(self.responses)} записанных ответов из {trace_file}")
+
+    @staticmethod
+    def _trace_files(trace_file: Path) -> List[Path]:
+        """Текущая трасса и ее сжатые ротации (llm_trace.jsonl.N.gz), от старых к новым."""
+        rotated = sorted(
+            trace_file.parent.glob(trace_file.name + ".*.gz"),
+            key=lambda path: int(path.name[len(trace_file.name) + 1:].split(".")[0]),
+            reverse=True,
+        )
+        return rotated + ([trace_file] if trace_file.exists() else [])
+
+    @classmethod
+    def _load_trace(cls, trace_file: Path) -> Dict[str, str]:
+        responses: Dict[str, str] = {}
+        for path in cls._trace_files(trace_file):
+            opener = gzip.open if path.suffix == ".gz" else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        trace = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    prompt, raw_response = trace.get("prompt"), trace.get("raw_response")
+                    if not prompt or raw_response is None:
+                        continue
+                    key = prompt_hash(prompt)
+                    # Успешный ответ всегда важнее "аварийного" для того же промпта
+                    if trace.get("error") is None or key not in responses:
+                        responses[key] = raw_response
+        return responses
+
+    def _lookup(self, prompt: str) -> str:
+        key = prompt_hash(prompt)
+        if key in self.responses:
+            return self.responses[key]
+        if self.strict:
+            raise KeyError(f"В трассе нет ответа для промпта {key[:12]}")
+        return json.dumps({
+            "narrative": f"[replay {key[:8]}] Ничего необычного не происходит.",
+            "state_changes": {},
+        }, ensure_ascii=False)
+
+    async def generate(self, prompt: str) -> str:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self._lookup(prompt)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        text = self._lookup(prompt)
+        pieces = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        delay = self.latency_ms / 1000 / len(pieces)
+        for piece in pieces:
+            if delay:
+                await asyncio.sleep(delay)
+            yield piece
+
+
+class HttpBackend(LLMBackend):
+    """
+    Клиент локальной HTTP-заглушки (см. llm_standin_server.py).
+    Заглушка добавляет искусственные задержки и ошибки, чтобы нагрузочный
+    прогон видел сеть, а не только локальные вызовы.
+    """
+    name = "http"
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        self.url = url.rstrip("/")
+        self.model_name = f"http:{self.url}"
+        self.timeout = timeout
+
+    def _open(self, prompt: str, stream: bool):
+        body = json.dumps({"prompt": prompt, "stream": stream}, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.url}/generate", data=body, headers={"Content-Type": "application/json"}
+        )
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _generate_blocking(self, prompt: str) -> str:
+        with self._open(prompt, stream=False) as response:
+            return json.loads(response.read().decode("utf-8"))["text"]
+
+    async def generate(self, prompt: str) -> str:
+        return await asyncio.to_thread(self._generate_blocking, prompt)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        # Заглушка отдает поток как JSON-строки, по одному куску на строку
+        response = await asyncio.to_thread(self._open, prompt, True)
+        try:
+            while True:
+                line = await asyncio.to_thread(response.readline)
+                if not line:
+                    break
+                text = json.loads(line.decode("utf-8")).get("text", "")
+                if text:
+                    yield text
+        finally:
+            response.close()
+
+
+def create_backend(kind: str, model_name: str, api_key: str | None) -> LLMBackend:
+    """
+    Создает бэкенд по имени (переменная окружения LLM_BACKEND):
+    gemini (по умолчанию), replay или http.
+    """
+    kind = (kind or "gemini").lower()
+    if kind == "gemini":
+        return GeminiBackend(model_name, api_key)
+    if kind == "replay":
+        return ReplayBackend(
+            trace_file=Path(os.getenv("LLM_REPLAY_TRACE", str(DEFAULT_TRACE_FILE))),
+            latency_ms=float(os.getenv("LLM_REPLAY_LATENCY_MS", "0")),
+            strict=os.getenv("LLM_REPLAY_STRICT", "0") == "1",
+        )
+    if kind == "http":
+        return HttpBackend(os.getenv("LLM_HTTP_URL", "http://127.0.0.1:8765"))
+    raise ValueError(f"Неизвестный бэкенд LLM: '{kind}'. Доступны: gemini, replay, http.")
@@ -0,0 +1,168 @@
+# services/llm_cache.py
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+DB_DIR = Path(__file__).parent.parent / "db"
+CACHE_FILE = DB_DIR / "llm_cache.sqlite3"
+
+# Общий лимит размера кэша на диске (сумма длин ответов в байтах)
+MAX_CACHE_BYTES = int(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """Правило кэширования для одного шаблона промпта."""
+    enabled: bool = False
+    ttl_seconds: int = 0  # 0 - без ограничения по времени
+    json_response: bool = False  # Ответ - JSON хода; неразбираемый ответ в кэш не попадает
+
+
+# Детерминированные генерации кэшируем надолго, бой - никогда:
+# там каждый ход обязан быть новым, даже если промпт совпал.
+CACHE_POLICIES: Dict[str, CachePolicy] = {
+    "location_description": CachePolicy(enabled=True, ttl_seconds=7 * 24 * 3600),
+    "exploration_action": CachePolicy(enabled=True, ttl_seconds=10 * 60, json_response=True),
+    "combat_action": CachePolicy(enabled=False, json_response=True),
+}
+DEFAULT_POLICY = CachePolicy(enabled=False)
+
+
+def make_cache_key(model_name: str, template_name: str, prompt: str) -> str:
+    """Адрес ответа в кэше - хэш модели, шаблона и готового промпта."""
+    digest = hashlib.sha256()
+    for part in (model_name, template_name or "", prompt):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Контентно-адресуемый кэш ответов LLM на диске (SQLite).
+    Вытесняет записи по TTL шаблона и по LRU, когда превышен общий размер.
+    """
+    def __init__(self, path: Path = CACHE_FILE, max_bytes: int = MAX_CACHE_BYTES,
+                 policies: Dict[str, CachePolicy] = None):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.policies = CACHE_POLICIES if policies is None else policies
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                       key TEXT PRIMARY KEY,
+                       template TEXT,
+                       response TEXT NOT NULL,
+                       size INTEGER NOT NULL,
+                       latency REAL NOT NULL,
+                       created_at REAL NOT NULL,
+                       last_access REAL NOT NULL
+                   )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+            self._conn.commit()
+        return self._conn
+
+    def policy_for(self, template_name: str) -> CachePolicy:
+        return self.policies.get(template_name, DEFAULT_POLICY)
+
+    def get(self, model_name: str, template_name: str, prompt: str) -> Optional[str]:
+        """Возвращает сохраненный ответ или None. Учитывает попадания и промахи."""
+        policy = self.policy_for(template_name)
+        if not policy.enabled:
+            return None
+
+        key = make_cache_key(model_name, template_name, prompt)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT response, latency, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and policy.ttl_seconds and now - row[2] > policy.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                row = None
+
+            stats = self._template_stats(template_name)
+            if row is None:
+                stats["misses"] += 1
+                return None
+
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            stats["hits"] += 1
+            stats["saved_seconds"] += row[1]
+            return row[0]
+
+    def put(self, model_name: str, template_name: str, prompt: str, response: str, latency: float):
+        """Сохраняет ответ, если шаблон кэшируемый, и при необходимости вытесняет старые записи."""
+        if not self.policy_for(template_name).enabled:
+            return
+
+        key = make_cache_key(model_name, template_name, prompt)
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, template_name, response, size, latency, now, now),
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        # 1. Просроченные записи по TTL своего шаблона
+        for template_name, policy in self.policies.items():
+            if policy.ttl_seconds:
+                conn.execute(
+                    "DELETE FROM responses WHERE template = ? AND created_at < ?",
+                    (template_name, now - policy.ttl_seconds),
+                )
+
+        # 2. Самые давно использованные, пока не уложимся в лимит размера
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _template_stats(self, template_name: str) -> Dict[str, float]:
+        return self._stats.setdefault(
+            template_name, {"hits": 0, "misses": 0, "saved_seconds": 0.0}
+        )
+
+    def stats(self) -> Dict[str, object]:
+        """Счетчики попаданий/промахов и сэкономленное время API по шаблонам."""
+        with self._lock:
+            return {
+                "templates": {name: dict(values) for name, values in self._stats.items()},
+                "evictions": self._evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+
+response_cache = LLMResponseCache()
@@ -1,12 +1,16 @@
 # services/llm_service.py
 import os
-from typing import List
-import google.generativeai as genai
+import time
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, List, Optional, Tuple
 from dotenv import load_dotenv
-from typing import List, Optional
 import json
 from utils.logger import log_llm_trace
-from utils.prompt_manager import load_and_format_prompt
+from utils.prompt_manager import load_and_format_prompt, prompt_registry
+from utils.response_parser import StreamingResponseParser
+from services.llm_cache import response_cache
+from services.llm_backends import LLMBackend, UnavailableBackend, create_backend
 from logic.constants import *
 
 # --- Конфигурация ---
@@ -15,64 +19,200 @@ load_dotenv()
 
 API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.5-pro") 
+# gemini - настоящий API, replay - ответы из logs/llm_trace.jsonl, http - локальная заглушка
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
 
+# "Аварийный" JSON-ответ, который получает игра, если вызов API не удался
+FALLBACK_RESPONSE = """
+        {
+          "narrative": "В мироздании произошел сбой. На мгновение реальность треснула, не в силах обработать ваше действие. Попробуйте еще раз.",
+          "state_changes": {}
+        }
+        """
 
-try:
-    if not API_KEY:
-        raise ValueError("Ключ API Gemini не найден. Проверьте файл .env и переменную GEMINI_API_KEY.")
-    
-    genai.configure(api_key=API_KEY)
-    print(f"Сервис Gemini успешно сконфигурирован. Используется модель: {MODEL_NAME}")
 
-except Exception as e:
-    print(f"Ошибка конфигурации Gemini: {e}")
+class LLMClient:
+    """
+    Асинхронный клиент LLM поверх выбранного бэкенда (см. services/llm_backends.py).
+    Бэкенд создается один раз на процесс, клиент умеет как возвращать ответ
+    целиком (generate), так и отдавать его по кускам (stream).
+    """
+    def __init__(self, backend: LLMBackend):
+        self.backend = backend
+        # Асинхронный клиент gRPC привязан к event loop, в котором был создан,
+        # поэтому все вызовы идут через один долгоживущий loop в фоновом потоке.
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_lock = threading.Lock()
+
+    @property
+    def model_name(self) -> str:
+        return self.backend.model_name
+
+    async def generate(self, request_package: dict, status: dict | None = None) -> str:
+        """
+        Отправляет промпт и возвращает полный ответ модели.
+        В status["error"] записывается ошибка вызова (None, если ее не было).
+        """
+        prompt = request_package.get("prompt", "")
+        trace = request_package.copy()
+        trace["error"] = None
+        trace["backend"] = self.backend.name
+
+        try:
+            print(f"...Отправка запроса в LLM ({self.backend.name})...")
+            raw_response = (await self.backend.generate(prompt)).strip()
+            trace["raw_response"] = raw_response
+            return raw_response
+        except Exception as e:
+            return self._fail(trace, e)
+        finally:
+            if status is not None:
+                status["error"] = trace["error"]
+            log_llm_trace(trace)
+
+    async def stream(self, request_package: dict, status: dict | None = None) -> AsyncIterator[str]:
+        """
+        Отправляет промпт и отдает текст ответа по мере генерации.
+        Если ошибка случилась до первого куска, отдает "аварийный" ответ целиком.
+        Оборванный ответ отдается как есть, но status["error"] сообщает об ошибке.
+        """
+        prompt = request_package.get("prompt", "")
+        trace = request_package.copy()
+        trace["error"] = None
+        trace["backend"] = self.backend.name
+        parts: List[str] = []
+
+        try:
+            print(f"...Отправка запроса в LLM ({self.backend.name}, потоковый режим)...")
+            async for text in self.backend.stream(prompt):
+                if text:
+                    parts.append(text)
+                    yield text
+            trace["raw_response"] = "".join(parts).strip()
+        except Exception as e:
+            fallback = self._fail(trace, e)
+            if not parts:
+                yield fallback
+            else:
+                # Часть ответа игрок уже увидел, подменять его поздно
+                trace["raw_response"] = "".join(parts).strip()
+        finally:
+            if status is not None:
+                status["error"] = trace["error"]
+            log_llm_trace(trace)
+
+    async def _collect_stream(self, request_package: dict, on_chunk: Callable[[str], None], status: dict) -> str:
+        parts = []
+        async for text in self.stream(request_package, status):
+            parts.append(text)
+            try:
+                on_chunk(text)
+            except Exception as e:
+                print(f"⚠️ Ошибка в обработчике потока: {e}")
+        return "".join(parts).strip()
+
+    def _fail(self, trace: dict, error: Exception) -> str:
+        error_message = f"КРИТИЧЕСКАЯ ОШИБКА API {self.backend.name}: {error}"
+        print(f"🔴 {error_message}")
+        trace["error"] = error_message
+        trace["raw_response"] = FALLBACK_RESPONSE
+        return FALLBACK_RESPONSE
+
+    # --- Синхронный мост для игрового цикла ---
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name="llm-loop", daemon=True)
+                thread.start()
+            return self._loop
+
+    def run(self, coroutine):
+        """Выполняет корутину клиента в его event loop и ждет результат."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result()
+
+    def generate_sync(self, request_package: dict) -> Tuple[str, str | None]:
+        """Возвращает (ответ, ошибка); ошибка None, если вызов прошел успешно."""
+        status = {"error": None}
+        return self.run(self.generate(request_package, status)), status["error"]
+
+    def stream_sync(self, request_package: dict, on_chunk: Callable[[str], None]) -> Tuple[str, str | None]:
+        """
+        Потоковый вызов: on_chunk получает каждый кусок текста, возвращается (полный ответ, ошибка).
+        При обрыве потока ответ может быть неполным - тогда ошибка не None.
+        """
+        status = {"error": None}
+        return self.run(self._collect_stream(request_package, on_chunk, status)), status["error"]
+
+
+_client: LLMClient | None = None
+_client_lock = threading.Lock()
+
+def get_client() -> LLMClient:
+    """Возвращает единственный на процесс экземпляр клиента."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            try:
+                backend = create_backend(LLM_BACKEND, MODEL_NAME, API_KEY)
+            except Exception as e:
+                print(f"Ошибка конфигурации LLM ({LLM_BACKEND}): {e}")
+                backend = UnavailableBackend(LLM_BACKEND, MODEL_NAME, e)
+            _client = LLMClient(backend)
+        return _client
+
+
+def _is_parseable(template_name: str, raw_response: str) -> bool:
+    """Для шаблонов с JSON-ответом проверяет, что ответ разберет StreamingResponseParser в Game."""
+    if not response_cache.policy_for(template_name).json_response:
+        return True
+    parser = StreamingResponseParser()
+    parser.feed(raw_response)
+    if parser.close().error:
+        print(f"⚠️ Ответ для '{template_name}' не разбирается как JSON и не будет закэширован: {parser.error}")
+        return False
+    return True
 
 
 # --- Основная точка входа в API ---
-def _send_prompt_to_gemini(request_package: dict) -> str:
+def _send_prompt_to_gemini(request_package: dict, on_chunk: Optional[Callable[[str], None]] = None) -> str:
     """
-    Единая, централизованная функция для отправки любого промпта в Gemini.
+    Единая, централизованная функция для отправки любого промпта в LLM.
     Принимает "пакет запроса", отправляет его и логирует полный след.
+    Если передан on_chunk, ответ запрашивается потоком и каждый кусок
+    текста отдается в on_chunk сразу по получении.
+    Перед вызовом API проверяется кэш ответов (см. services/llm_cache.py).
     """
-    # 1. Распаковываем данные из пакета
+    client = get_client()
     prompt = request_package.get("prompt", "")
-    
-    raw_response = ""
-    # 2. Создаем "скелет" для лога, копируя данные из пакета
-    trace = request_package.copy()
-    trace["error"] = None
-    
-    try:
-        # 3. Вызываем API
-        model = genai.GenerativeModel(MODEL_NAME)
-        print("...Отправка запроса в Gemini...")
-        response = model.generate_content(prompt)
-        raw_response = response.text.strip()
-        
-        trace["raw_response"] = raw_response
-        return raw_response
-        
-    except Exception as e:
-        # 4. Обрабатываем любые ошибки
-        error_message = f"КРИТИЧЕСКАЯ ОШИБКА API Gemini: {e}"
-        print(f"🔴 {error_message}")
-        
-        # Формируем "аварийный" JSON-ответ
-        raw_response = """
-        {
-          "narrative": "В мироздании произошел сбой. На мгновение реальность треснула, не в силах обработать ваше действие. Попробуйте еще раз.",
-          "state_changes": {}
-        }
-        """
-        trace["error"] = error_message
-        trace["raw_response"] = raw_response
-        return raw_response
-        
-    finally:
-        # 5. Логируем результат, неважно, успешный он или нет
-        log_llm_trace(trace)
+    template_name = request_package.get("prompt_template_name", "")
+
+    cached_response = response_cache.get(client.model_name, template_name, prompt)
+    if cached_response is not None:
+        print(f"💾 Ответ для '{template_name}' взят из кэша.")
+        log_llm_trace({**request_package, "error": None, "raw_response": cached_response, "cache_hit": True})
+        if on_chunk is not None:
+            on_chunk(cached_response)
+        return cached_response
+
+    started_at = time.perf_counter()
+    if on_chunk is not None:
+        raw_response, error = client.stream_sync(request_package, on_chunk)
+    else:
+        raw_response, error = client.generate_sync(request_package)
+
+    # Ни "аварийный", ни оборванный на середине, ни неразбираемый ответ не кэшируем,
+    # иначе сбой API или битый JSON закрепится надолго
+    if (error is None and raw_response.strip() != FALLBACK_RESPONSE.strip()
+            and _is_parseable(template_name, raw_response)):
+        response_cache.put(client.model_name, template_name, prompt, raw_response,
+                           latency=time.perf_counter() - started_at)
+    return raw_response
 
 # --- Вспомогательная функция (пока что) ---
+prompt_registry.expect('location_description', {"tags_str", "context_block"})
+
 def generate_location_description(tags: List[str], context: Optional[List[str]] = None) -> str:
     """
     Генерирует описание для НОВОЙ локации.
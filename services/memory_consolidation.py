@@ -0,0 +1,114 @@
+# services/memory_consolidation.py
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
+from logic.constants import META_LOCATION, META_TAGS, META_TYPE, TYPE_DIGEST, TYPE_EVENT
+from services.memory_journal import JournalEntry
+from services.memory_service import MemoryService
+from utils.prompt_manager import estimate_tokens, first_sentence
+
+# Сколько событий может лежать в горячем (поисковом) слое памяти
+HOT_EVENT_LIMIT = int(os.getenv("MEMORY_HOT_EVENT_LIMIT", "2000"))
+# После сворачивания горячих событий остается не больше этой доли лимита,
+# чтобы консолидация не запускалась на каждом ходу
+HOT_EVENT_TARGET_FRACTION = 0.8
+# Сколько последних событий каждой локации всегда остаются дословными
+KEEP_RECENT_PER_LOCATION = 3
+# Бюджет одной сводки локации
+DIGEST_MAX_TOKENS = 120
+DIGEST_SEPARATOR = " • "
+
+
+def digest_id(location: str) -> str:
+    """У каждой локации одна сводка: новая версия заменяет прежнюю в индексе."""
+    return f"digest:{location}"
+
+
+def summarize_events(location: str, texts: List[str], previous_digest: str | None) -> str:
+    """
+    Экстрактивная сводка: первое предложение каждого события, от старых к новым.
+    Прежняя сводка локации продолжается; если бюджет превышен, вытесняются самые старые строки.
+    """
+    header = f"Давние события в локации «{location}»: "
+    lines = previous_digest[len(header):].split(DIGEST_SEPARATOR) if previous_digest and previous_digest.startswith(header) else []
+    lines += [first_sentence(text.strip()) for text in texts if text.strip()]
+    while len(lines) > 1 and estimate_tokens(header + DIGEST_SEPARATOR.join(lines)) > DIGEST_MAX_TOKENS:
+        lines.pop(0)
+    return header + DIGEST_SEPARATOR.join(lines)
+
+
+class MemoryConsolidator:
+    """
+    Фоновое сворачивание старых событий. Когда событий в горячем слое больше
+    hot_limit, старые события каждой локации (кроме последних keep_recent)
+    сворачиваются в одну сводку TYPE_DIGEST, а сами события уходят в холодный
+    слой: журнал хранит их, но поиск по умолчанию их не видит.
+    """
+    def __init__(self, memory_service: MemoryService, hot_limit: int = HOT_EVENT_LIMIT,
+                 keep_recent: int = KEEP_RECENT_PER_LOCATION):
+        self.memory = memory_service
+        self.hot_limit = hot_limit
+        self.keep_recent = keep_recent
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-consolidation")
+        self._lock = threading.Lock()
+        self._running: Future | None = None
+
+    def schedule(self):
+        """Запускает консолидацию в фоне, если горячий слой переполнен и она еще не идет."""
+        if self.memory.hot_count({META_TYPE: TYPE_EVENT}) <= self.hot_limit:
+            return
+        with self._lock:
+            if self._running is not None and not self._running.done():
+                return
+            self._running = self._executor.submit(self._run)
+
+    def _run(self):
+        try:
+            self.consolidate()
+        except Exception as e:
+            print(f"⚠️ Консолидация памяти не удалась: {e}")
+
+    def consolidate(self) -> int:
+        """Сворачивает старые события до целевого размера горячего слоя. Возвращает число свернутых событий."""
+        journal = self.memory.journal
+        by_location: Dict[str, List[JournalEntry]] = defaultdict(list)
+        for entry in journal.hot_entries():
+            if entry.metadata.get(META_TYPE) == TYPE_EVENT:
+                by_location[entry.metadata.get(META_LOCATION, "")].append(entry)
+
+        hot_events = sum(len(entries) for entries in by_location.values())
+        target = int(self.hot_limit * HOT_EVENT_TARGET_FRACTION)
+        if hot_events <= self.hot_limit:
+            return 0
+
+        # Первыми сворачиваются локации, где игрок не бывал дольше всего
+        locations = sorted(by_location, key=lambda location: by_location[location][-1].seq)
+        consolidated = 0
+        for location in locations:
+            if hot_events - consolidated <= target:
+                break
+            old_events = by_location[location][:-self.keep_recent] if self.keep_recent else by_location[location]
+            if not old_events:
+                continue
+            previous = self.memory.keyword_index.document(digest_id(location))
+            tags = old_events[-1].metadata.get(META_TAGS, "")
+            metadata = {META_TYPE: TYPE_DIGEST, META_LOCATION: location}
+            if tags:
+                metadata[META_TAGS] = tags
+            self.memory.add_memory(
+                summarize_events(location, [entry.text for entry in old_events], previous),
+                digest_id(location),
+                metadata,
+                consolidates=[entry.memory_id for entry in old_events]
+            )
+            consolidated += len(old_events)
+
+        self.memory.flush()
+        print(f"🗜️ Консолидация памяти: {consolidated} событий свернуто в сводки локаций.")
+        return consolidated
+
+    def shutdown(self):
+        """Дожидается текущей консолидации, чтобы журнал и индекс остались согласованными."""
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,155 @@
+# services/memory_journal.py
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Set
+
+JOURNAL_FILE = Path(__file__).parent.parent / "db" / "memory_journal.jsonl"
+
+
+class JournalEntry(NamedTuple):
+    """Одна запись журнала памяти."""
+    seq: int
+    memory_id: str
+    text: str
+    metadata: Dict[str, Any]
+    content_hash: str
+    # ID воспоминаний, которые эта запись (сводка) переводит в холодный слой
+    consolidates: tuple = ()
+
+    def to_json(self) -> str:
+        data = self._asdict()
+        if not self.consolidates:
+            del data["consolidates"]
+        else:
+            data["consolidates"] = list(self.consolidates)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def content_hash(text: str, metadata: Dict[str, Any], consolidates: List[str] | None = None) -> str:
+    """Хэш содержимого воспоминания: одинаковый текст с одинаковыми метаданными - дубликат."""
+    data = {"text": text, "metadata": metadata}
+    if consolidates:
+        data["consolidates"] = sorted(consolidates)
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryJournal:
+    """
+    Журнал всех записей в память мира: только дописывается, каждая запись
+    получает монотонный номер seq. Журнал - источник правды, а векторный
+    индекс Chroma - производное представление, которое можно пересобрать
+    из журнала целиком или догнать с последнего проиндексированного seq.
+    """
+    def __init__(self, path: Path = JOURNAL_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.last_seq = 0
+        self._hashes: Dict[str, str] = {}  # хэш содержимого -> memory_id
+        self._unindexed: set = set()  # seq, добавленные в этом процессе и еще не попавшие в индекс
+        # Холодный слой: воспоминания, свернутые в сводки. Хранятся в журнале, но не в поисковом индексе.
+        self.cold_ids: Set[str] = set()
+        self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self._file.tell() > 0 and not self.path.read_bytes().endswith(b"\n"):
+            self._file.write("\n")  # Не дописываем новую запись в хвост оборванной строки
+
+    def _load(self):
+        for entry in self.entries():
+            self.last_seq = max(self.last_seq, entry.seq)
+            self._hashes[entry.content_hash] = entry.memory_id
+            self.cold_ids.update(entry.consolidates)
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def append(self, text: str, metadata: Dict[str, Any], memory_id: str | None = None,
+               consolidates: List[str] | None = None) -> JournalEntry | None:
+        """
+        Дописывает воспоминание в журнал. Без memory_id идентификатор строится
+        из seq. consolidates - ID воспоминаний, которые эта сводка заменяет в поиске.
+        Возвращает None, если такое содержимое уже есть в журнале.
+        """
+        digest = content_hash(text, metadata, consolidates)
+        with self._lock:
+            if digest in self._hashes:
+                return None
+            self.last_seq += 1
+            entry = JournalEntry(self.last_seq, memory_id or f"event_{self.last_seq}", text, metadata, digest,
+                                 tuple(consolidates or ()))
+            self._file.write(entry.to_json() + "\n")
+            self._file.flush()
+            self._hashes[digest] = entry.memory_id
+            self._unindexed.add(entry.seq)
+            self.cold_ids.update(entry.consolidates)
+        return entry
+
+    def entries(self, after_seq: int = 0) -> Iterator[JournalEntry]:
+        """Читает записи журнала с номером больше after_seq в порядке записи."""
+        if not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                    data["consolidates"] = tuple(data.get("consolidates", ()))
+                    entry = JournalEntry(**data)
+                except (json.JSONDecodeError, TypeError) as e:
+                    # Оборванная последняя строка после аварийного выхода - не повод терять журнал
+                    print(f"⚠️ Пропущена поврежденная запись журнала памяти (строка {line_number}): {e}")
+                    continue
+                if entry.seq > after_seq:
+                    yield entry
+
+    def hot_entries(self, after_seq: int = 0) -> Iterator[JournalEntry]:
+        """Записи, которые должны быть в поисковом индексе (без холодного слоя)."""
+        for entry in self.entries(after_seq):
+            if entry.memory_id not in self.cold_ids:
+                yield entry
+
+    def cold_entries(self) -> Iterator[JournalEntry]:
+        for entry in self.entries():
+            if entry.memory_id in self.cold_ids:
+                yield entry
+
+    def batches(self, batch_size: int, after_seq: int = 0) -> Iterator[List[JournalEntry]]:
+        """Горячие записи журнала пачками - для индексации."""
+        batch = []
+        for entry in self.hot_entries(after_seq):
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # --- Отметка индексации ---
+
+    def mark_indexed(self, seqs: List[int]):
+        with self._lock:
+            self._unindexed.difference_update(seqs)
+
+    def mark_all_indexed(self):
+        with self._lock:
+            self._unindexed.clear()
+
+    def indexed_watermark(self) -> int:
+        """Наибольший seq, до которого включительно все записи уже есть в индексе."""
+        with self._lock:
+            return min(self._unindexed) - 1 if self._unindexed else self.last_seq
+
+
+_journals: Dict[Path, MemoryJournal] = {}
+_journals_lock = threading.Lock()
+
+def get_memory_journal(path: Path = JOURNAL_FILE) -> MemoryJournal:
+    """Один журнал на файл в процессе: иначе два MemoryService выдали бы одинаковые seq."""
+    with _journals_lock:
+        if path not in _journals:
+            _journals[path] = MemoryJournal(path)
+        return _journals[path]
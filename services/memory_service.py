@@ -1,77 +1,337 @@
 # services/memory_service.py
+import threading
 import chromadb
+try:
+    from chromadb.errors import NotFoundError as _CollectionNotFound
+except ImportError:  # Старые версии chromadb сообщают об отсутствии коллекции через ValueError
+    _CollectionNotFound = ValueError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
-from logic.constants import META_TYPE, TYPE_EVENT, TYPE_LORE
+from typing import List, Dict, Any, NamedTuple, Tuple
+from logic.constants import META_TAGS, META_TYPE, TYPE_EVENT, TYPE_LORE
+from services.embedding_service import EmbeddingService, get_embedding_service
+from services.memory_journal import JOURNAL_FILE, JournalEntry, get_memory_journal
+from services.keyword_index import KeywordIndex, reciprocal_rank_fusion
+from services.vector_index import INDEX_BACKEND, VectorIndex, chroma_hnsw_metadata, create_vector_index, evaluate_index
 
-# Инициализируем клиент ChromaDB. 
-# Он создаст файлы для хранения данных в папке проекта.
-client = chromadb.Client()
-DB_PATH = str(Path(__file__).parent.parent / "db") 
+DB_PATH = str(Path(__file__).parent.parent / "db")
+COLLECTION_NAME = "game_world_lore"
+# Размер пачки при пересборке индекса из журнала
+REINDEX_BATCH_SIZE = 1024
+# Во сколько раз больше кандидатов, чем нужно слою, берет каждый ретривер перед слиянием
+CANDIDATE_MULTIPLIER = 4
+
+
+class MemoryLayer(NamedTuple):
+    """Слой многослойного поиска: имя, фильтр по метаданным и сколько результатов взять."""
+    name: str
+    filter_metadata: Dict[str, Any] | None
+    n_results: int
+
+
+class MemoryHit(NamedTuple):
+    """Найденное воспоминание: текст, векторное расстояние (None - найдено только по словам/тегам) и итоговая оценка."""
+    text: str
+    distance: float | None
+    score: float
 
-# Создаем "коллекцию" (аналог таблицы в SQL). 
-# Если она уже есть, просто подключаемся к ней.
-# embedding_function - это то, как Chroma будет превращать текст в векторы.
-# Мы оставляем значение по умолчанию, которое отлично работает.
-collection = client.get_or_create_collection(name="game_world_lore")
 
 class MemoryService:
-    def __init__(self):
-    # PersistentClient гарантирует, что данные будут сохраняться на диск по указанному пути.
-        client = chromadb.PersistentClient(path=DB_PATH)
+    """
+    Долговременная память мира. Источник правды - журнал db/memory_journal.jsonl,
+    а коллекция ChromaDB (db/) - производный поисковый индекс, который
+    догоняет журнал при запуске и пересобирается из него командой rebuild_index().
+    Новые воспоминания сразу пишутся в журнал, а в индекс попадают одной
+    пачкой в flush(): в конце хода, при сохранении и при выходе из игры.
+    Поиск гибридный: векторный индекс, BM25 по словам и точное совпадение
+    тегов (KeywordIndex) объединяются через Reciprocal Rank Fusion.
+    Векторы хранит коллекция Chroma, а искать по ним может сама Chroma или
+    индекс в памяти (index_backend: bruteforce, hnsw, partitioned - см. vector_index.py).
+    """
+    def __init__(self, embedding_service: EmbeddingService | None = None,
+                 db_path: str = DB_PATH, journal_path: Path = JOURNAL_FILE,
+                 index_backend: str = INDEX_BACKEND):
+        # PersistentClient гарантирует, что данные будут сохраняться на диск по указанному пути.
+        self.client = chromadb.PersistentClient(path=db_path)
+        self.index_backend = index_backend
+        self.collection = self._open_collection()
+        self.journal = get_memory_journal(journal_path)
+        self._import_untracked_documents()
+        # Векторы считает общий сервис эмбеддингов, Chroma получает их готовыми
+        self.embeddings = embedding_service or get_embedding_service()
+        # Слои одного запроса опрашиваются параллельно
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="memory")
+        # Буфер индексации: id -> запись журнала, еще не попавшая в Chroma
+        self._lock = threading.Lock()
+        self._pending: "OrderedDict[str, JournalEntry]" = OrderedDict()
+        # Словарный, теговый и метаданный индексы строятся из журнала в памяти процесса
+        self.keyword_index = KeywordIndex(tags_field=META_TAGS)
+        for entry in self.journal.hot_entries():
+            self.keyword_index.add(entry.memory_id, entry.text, entry.metadata)
+        # Индекс холодного слоя строится только при первом поиске с include_cold
+        self._cold_index: KeywordIndex | None = None
+        # Поисковый индекс строится по коллекции, уже догнавшей журнал (пересборка строит его сама)
+        self.vector_index: VectorIndex | None = None
+        self._catch_up()
+        if self.vector_index is None:
+            self.vector_index = create_vector_index(index_backend, self.collection)
 
-    def add_memory(self, text: str, memory_id: str, metadata: Dict[str, Any]):
+    def _open_collection(self):
         """
-        Добавляет фрагмент текста с метаданными.
+        Открывает коллекцию, не трогая ее метаданные. get_or_create_collection с metadata
+        заменил бы их целиком и стер бы indexed_seq и embedding_model, поэтому
+        параметры HNSW передаются только при создании новой коллекции.
         """
         try:
-            collection.add(
-                documents=[text],
-                ids=[memory_id],
-                metadatas=[metadata]
-            )
-            print(f"✅ Добавлено воспоминание типа '{metadata.get(META_TYPE)}' с ID: {memory_id}")
+            return self.client.get_collection(name=COLLECTION_NAME)
+        except (ValueError, _CollectionNotFound):
+            return self.client.create_collection(name=COLLECTION_NAME, metadata=chroma_hnsw_metadata())
+
+    def _import_untracked_documents(self):
+        """
+        Переносит в журнал документы коллекции, которых в нем нет: базу, собранную
+        до появления журнала (например, лор в db/chroma.sqlite3). Иначе поиск,
+        который берет тексты и кандидатов из журнала, таких документов не видел бы.
+        """
+        known = {entry.memory_id for entry in self.journal.entries()}
+        imported = 0
+        offset = 0
+        while True:
+            page = self.collection.get(include=["documents", "metadatas"], limit=REINDEX_BATCH_SIZE, offset=offset)
+            if not page["ids"]:
+                break
+            offset += len(page["ids"])
+            for memory_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                if memory_id in known or not text:
+                    continue
+                if self.journal.append(text, dict(metadata or {}), memory_id) is not None:
+                    imported += 1
+        if imported:
+            print(f"📥 В журнал памяти перенесено документов из старой базы: {imported}")
+
+    def add_memory(self, text: str, memory_id: str | None, metadata: Dict[str, Any],
+                   consolidates: List[str] | None = None) -> str | None:
+        """
+        Записывает фрагмент текста с метаданными в журнал и ставит его в буфер индексации.
+        Без memory_id идентификатор выдает журнал (event_<seq>).
+        consolidates - ID воспоминаний, которые эта сводка переводит в холодный слой.
+        Возвращает ID воспоминания или None, если такое уже есть в памяти.
+        """
+        entry = self.journal.append(text, metadata, memory_id, consolidates)
+        if entry is None:
+            print(f"ℹ️ Воспоминание типа '{metadata.get(META_TYPE)}' уже есть в памяти, пропускаем.")
+            return None
+        self.keyword_index.add(entry.memory_id, entry.text, entry.metadata)
+        for cold_id in entry.consolidates:
+            self.keyword_index.remove(cold_id)
+        self._cold_index = None  # Холодный слой изменился
+        with self._lock:
+            self._pending[entry.memory_id] = entry
+            self._pending.move_to_end(entry.memory_id)
+        print(f"📝 Воспоминание типа '{metadata.get(META_TYPE)}' с ID {entry.memory_id} ждет записи.")
+        return entry.memory_id
+
+    def _index_entries(self, entries: List[JournalEntry], use_cache: bool = True):
+        # Сводки уводят свернутые ими события из горячего индекса
+        cold_ids = [cold_id for entry in entries for cold_id in entry.consolidates]
+        if cold_ids:
+            self.collection.delete(ids=cold_ids)
+            self._vector_index_call("delete", cold_ids)
+        entries = [entry for entry in entries if entry.memory_id not in self.journal.cold_ids]
+        if not entries:
+            return
+        documents = [entry.text for entry in entries]
+        ids = [entry.memory_id for entry in entries]
+        embeddings = self.embeddings.embed_many(documents, use_cache=use_cache)
+        metadatas = [entry.metadata for entry in entries]
+        self.collection.upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+        self._vector_index_call("add", ids, embeddings, metadatas)
+
+    def _vector_index_call(self, method: str, *args):
+        # Пока догоняется журнал, индекса еще нет: он будет построен из коллекции
+        if self.vector_index is not None:
+            getattr(self.vector_index, method)(*args)
+
+    def _save_watermark(self):
+        """Запоминает в метаданных коллекции, до какого seq журнала индекс полон."""
+        # modify заменяет метаданные целиком: параметры HNSW сохраняем (кроме неизменяемой метрики)
+        metadata = {key: value for key, value in (self.collection.metadata or {}).items() if key != "hnsw:space"}
+        metadata["indexed_seq"] = self.journal.indexed_watermark()
+        metadata["embedding_model"] = self.embeddings.model_id
+        self.collection.modify(metadata=metadata)
+
+    def flush(self) -> int:
+        """Индексирует все накопленные воспоминания одной пачкой. Возвращает их количество."""
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, OrderedDict()
+
+        entries = list(pending.values())
+        try:
+            self._index_entries(entries)
+            self.journal.mark_indexed([entry.seq for entry in entries])
+            self._save_watermark()
         except Exception as e:
-            print(f"⚠️ Не удалось добавить воспоминание: {e}")
+            print(f"⚠️ Не удалось записать воспоминания ({len(entries)}): {e}")
+            with self._lock:
+                # Возвращаем в буфер, не затирая более свежие записи с теми же id
+                for memory_id, entry in pending.items():
+                    self._pending.setdefault(memory_id, entry)
+            return 0
+        print(f"✅ Записано воспоминаний: {len(entries)}")
+        return len(entries)
+
+    def _catch_up(self):
+        """Доиндексирует записи журнала, не попавшие в индекс (например, после аварийного выхода)."""
+        metadata = self.collection.metadata or {}
+        watermark = int(metadata.get("indexed_seq", 0))
+        indexed_model = metadata.get("embedding_model", self.embeddings.model_id)
+        if indexed_model != self.embeddings.model_id:
+            print(f"⚠️ Индекс памяти построен моделью '{indexed_model}', а сейчас '{self.embeddings.model_id}'. Пересобираем.")
+            self.rebuild_index()
+            return
+        if watermark > self.journal.last_seq:
+            print("⚠️ Индекс памяти новее журнала. Пересобираем его из журнала.")
+            self.rebuild_index()
+            return
+        if watermark == self.journal.last_seq:
+            return
+
+        indexed = 0
+        for batch in self.journal.batches(REINDEX_BATCH_SIZE, after_seq=watermark):
+            self._index_entries(batch, use_cache=False)
+            self.journal.mark_indexed([entry.seq for entry in batch])
+            indexed += len(batch)
+        self._save_watermark()
+        print(f"🔁 Индекс памяти догнал журнал: {indexed} записей.")
+
+    def rebuild_index(self, batch_size: int = REINDEX_BATCH_SIZE) -> int:
+        """Пересоздает поисковый индекс из журнала крупными пачками. Возвращает число записей."""
+        with self._lock:
+            self._pending.clear()  # Все записи буфера уже в журнале и войдут в пересборку
+            print(f"🏗️ Пересборка индекса памяти из журнала ({len(self.journal)} записей)...")
+            self.client.delete_collection(name=COLLECTION_NAME)
+            self.collection = self.client.create_collection(name=COLLECTION_NAME, metadata=chroma_hnsw_metadata())
+            self.vector_index = create_vector_index(self.index_backend, self.collection)
+            self.keyword_index.clear()
+            self._cold_index = None
+            indexed = 0
+            for batch in self.journal.batches(batch_size):
+                self._index_entries(batch, use_cache=False)
+                for entry in batch:
+                    self.keyword_index.add(entry.memory_id, entry.text, entry.metadata)
+                indexed += len(batch)
+            self.journal.mark_all_indexed()
+            self._save_watermark()
+        print(f"✅ Индекс памяти пересобран: {indexed} записей.")
+        return indexed
 
-    def retrieve_relevant_memories(self, query_text: str, n_results: int = 2, filter_metadata: Dict[str, Any] = None) -> List[str]:
+    def hot_count(self, filter_metadata: Dict[str, Any] | None = None) -> int:
+        """Сколько воспоминаний (под фильтром) сейчас в горячем, поисковом слое."""
+        candidates = self.keyword_index.candidates(filter_metadata)
+        return len(self.keyword_index) if candidates is None else len(candidates)
+
+    def _get_cold_index(self) -> KeywordIndex:
+        with self._lock:
+            if self._cold_index is None:
+                cold_index = KeywordIndex(tags_field=META_TAGS)
+                for entry in self.journal.cold_entries():
+                    cold_index.add(entry.memory_id, entry.text, entry.metadata)
+                self._cold_index = cold_index
+            return self._cold_index
+
+    def index_report(self, sample_size: int = 50, k: int = 5) -> Dict[str, Any]:
+        """Время построения, задержки и recall@k текущего векторного индекса против точного перебора."""
+        return evaluate_index(self.vector_index, self.collection, sample_size, k)
+
+    def close(self):
+        """Сбрасывает буфер в индекс и останавливает пул поиска."""
+        self.flush()
+        self._executor.shutdown(wait=False)
+
+    def _query_layer(self, query_embedding, keyword_query: str, tags: List[str],
+                     layer: MemoryLayer, cold_index: KeywordIndex | None = None) -> List[MemoryHit]:
         """
-        Ищет релевантные воспоминания, опционально фильтруя по метаданным
-        с корректным формированием фильтра для ChromaDB.
+        Гибридный поиск в одном слое: вектор + BM25 + теги, слитые через RRF.
+        С cold_index в слияние добавляются словарные и теговые совпадения из холодного слоя.
         """
-        query_options = {
-            "query_texts": [query_text],
-            "n_results": n_results
-        }
-
-        if filter_metadata:
-            log_message = ", ".join(f"{k}: {v}" for k, v in filter_metadata.items())
-            print(f"🧠 Поиск воспоминаний ({log_message}), связанных с: '{query_text}'...")
-
-            # --- КОНВЕРТЕР ФИЛЬТРА ---
-            # Преобразуем простой словарь в формат, понятный ChromaDB
-            conditions = []
-            for key, value in filter_metadata.items():
-                conditions.append({key: {"$eq": value}})
-            
-            if len(conditions) > 1:
-                chroma_where_filter = {"$and": conditions}
-            elif len(conditions) == 1:
-                chroma_where_filter = conditions[0]
-            else:
-                chroma_where_filter = {} # Пустой фильтр, если словарь был пуст
+        limit = layer.n_results * CANDIDATE_MULTIPLIER
+        candidates = self.keyword_index.candidates(layer.filter_metadata)
+        rankings = []
+        if cold_index is not None:
+            rankings.append([doc_id for doc_id, _ in cold_index.search(keyword_query, layer.filter_metadata, limit)])
+            if tags:
+                rankings.append([doc_id for doc_id, _ in cold_index.search_tags(tags, layer.filter_metadata, limit)])
+        if candidates is not None and not candidates and not any(rankings):
+            return []  # Индекс метаданных уже знает, что под фильтр ничего не попадает
 
-            if chroma_where_filter:
-                query_options["where"] = chroma_where_filter
-        else:
-            print(f"🧠 Поиск общих воспоминаний, связанных с: '{query_text}'...")
-        
-        results = collection.query(**query_options)
-        
-        retrieved = results['documents'][0]
-        if retrieved:
-            print(f"📚 Найдено: {retrieved}")
+        distances = {}
+        if candidates is None or candidates:
+            n_results = limit if candidates is None else min(limit, len(candidates))
+            vector_hits = self.vector_index.query(query_embedding, n_results, layer.filter_metadata)
+            distances = dict(vector_hits)
+            rankings.append([doc_id for doc_id, _ in vector_hits])
+        keyword_hits = self.keyword_index.search(keyword_query, layer.filter_metadata, limit)
+        rankings.append([doc_id for doc_id, _ in keyword_hits])
+        if tags:
+            tag_hits = self.keyword_index.search_tags(tags, layer.filter_metadata, limit)
+            rankings.append([doc_id for doc_id, _ in tag_hits])
+
+        hits = []
+        for doc_id, score in reciprocal_rank_fusion(rankings)[:layer.n_results]:
+            text = self.keyword_index.document(doc_id)
+            if text is None and cold_index is not None:
+                text = cold_index.document(doc_id)
+            if text is not None:
+                hits.append(MemoryHit(text, distances.get(doc_id), score))
+        return hits
+
+    def retrieve_layers(self, query_text: str, layers: List[MemoryLayer],
+                        tags: List[str] | None = None, include_cold: bool = False) -> Dict[str, List[MemoryHit]]:
+        """
+        Многослойный поиск по одному запросу: запрос эмбеддится один раз,
+        а слои (фильтр + количество результатов) опрашиваются параллельно.
+        Теги передаются отдельно от текста и совпадают только точно.
+        Холодный слой (события, свернутые в сводки) ищется только с include_cold=True.
+        Возвращает для каждого слоя список MemoryHit от лучшего к худшему.
+        """
+        tags = list(tags or [])
+        layer_names = ", ".join(f"{layer.name}:{layer.n_results}" for layer in layers)
+        print(f"🧠 Поиск воспоминаний по слоям ({layer_names}), связанных с: '{query_text}' (теги: {tags})...")
+        # Воспоминания, добавленные в этом ходу, должны находиться сразу
+        self.flush()
+        query_embedding = self.embeddings.embed(query_text)
+        # В словарный запрос теги входят словами: так они находят и лор без тегов в метаданных
+        keyword_query = " ".join([query_text] + tags)
+        cold_index = self._get_cold_index() if include_cold else None
+
+        def query(layer: MemoryLayer) -> List[MemoryHit]:
+            return self._query_layer(query_embedding, keyword_query, tags, layer, cold_index)
+
+        if len(layers) == 1:
+            found = [query(layers[0])]
         else:
-            print("📚 Ничего релевантного не найдено.")
-            
-        return retrieved
\ No newline at end of file
+            found = list(self._executor.map(query, layers))
+
+        results = {layer.name: layer_found for layer, layer_found in zip(layers, found)}
+        for name, layer_found in results.items():
+            if layer_found:
+                print(f"📚 [{name}] Найдено: " + "; ".join(f"{hit.text} ({hit.score:.3f})" for hit in layer_found))
+            else:
+                print(f"📚 [{name}] Ничего релевантного не найдено.")
+        return results
+
+    def retrieve_relevant_memories(self, query_text: str, n_results: int = 2, filter_metadata: Dict[str, Any] = None,
+                                   tags: List[str] | None = None) -> List[str]:
+        """
+        Ищет релевантные воспоминания, опционально фильтруя по метаданным.
+        Частный случай retrieve_layers с одним слоем.
+        """
+        layer = MemoryLayer("memories", filter_metadata, n_results)
+        return [hit.text for hit in self.retrieve_layers(query_text, [layer], tags)[layer.name]]
+
+if __name__ == "__main__":
+    # Пересборка индекса памяти из журнала: python -m services.memory_service
+    MemoryService().rebuild_index()
@@ -0,0 +1,166 @@
+# services/pregeneration_service.py
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Any, Dict, List
+import services.llm_service as llm
+import generators.region_generator as region_gen
+import generators.location_generator as loc_gen
+from services.world_data_service import WorldDataService
+from services.tag_registry_service import TagRegistry
+from generators.world_file import WorldFile
+
+
+class PregenerationService:
+    """
+    Фоновая генерация локаций, в которые игрок может попасть следующим ходом.
+    Пока игрок читает и набирает команду, пул потоков готовит паспорта
+    и LLM-описания соседних локаций. Готовые результаты лежат в ограниченном
+    хранилище, а незавершенная работа отменяется, когда игрок уходит в другое место.
+
+    У каждой локации свой поток случайности, заданный зерном мира и путем
+    seed_path ("start", "start/2", "start/2/1", ...): результат не зависит
+    от порядка, в котором фоновые потоки доходят до генерации.
+    """
+    def __init__(self, world_data_service: WorldDataService, tag_registry: TagRegistry,
+                 max_workers: int = 2, max_entries: int = 16, neighbour_count: int = 3,
+                 world_seed: int = 0):
+        self.world_data = world_data_service
+        self.tag_registry = tag_registry
+        self.world_seed = world_seed
+        # Заранее сгенерированный мир: паспорта берутся из файла, в фоне остаются только описания
+        self.world_file: WorldFile | None = None
+        self.neighbour_count = neighbour_count
+        self.max_entries = max_entries
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pregen")
+        self._lock = threading.Lock()
+        self._ready: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._seed_paths: Dict[str, str] = {}
+        # Номер "поколения" соседей: результаты устаревших задач выбрасываются
+        self._epoch = 0
+
+    # --- Генерация ---
+
+    def rng_for(self, seed_path: str) -> random.Random:
+        """Поток случайности локации: одно зерно мира и один путь - один и тот же результат."""
+        return random.Random(f"{self.world_seed}:{seed_path}")
+
+    def generate_location(self, continent_id: str, key: str, seed_path: str | None = None) -> Dict[str, Any]:
+        """Синхронно генерирует регион, паспорт локации и ее художественное описание."""
+        if self.world_file is not None and key in self.world_file:
+            return self.describe(self.world_file.get(key))
+        seed_path = seed_path or self._seed_paths.get(key, key)
+        rng = self.rng_for(seed_path)
+        region_passport = region_gen.generate_region_passport_in_context(
+            world_data_service=self.world_data,
+            tag_registry=self.tag_registry,
+            continent_id=continent_id,
+            rng=rng
+        )
+        location_passport = loc_gen.generate_location_passport(
+            region_passport=region_passport,
+            tag_registry=self.tag_registry,
+            world_data_service=self.world_data,
+            rng=rng
+        )
+        location_passport["key"] = key
+        location_passport["seed_path"] = seed_path
+        self.describe(location_passport)
+        return location_passport
+
+    def describe(self, location_passport: Dict[str, Any]) -> Dict[str, Any]:
+        """Просит LLM описать локацию по тегам паспорта. При сбое API описание-заглушка остается."""
+        tags = self.tag_registry.to_tag_set(location_passport.get("tags", []))
+        description = llm.generate_location_description(self.tag_registry.tag_names(tags))
+        if description and description.strip() != llm.FALLBACK_RESPONSE.strip():
+            location_passport["description"] = description
+        return location_passport
+
+    # --- Планирование ---
+
+    def schedule_neighbours(self, location_passport: Dict[str, Any]):
+        """
+        Отменяет подготовку прежних соседей и ставит в очередь новых
+        для локации, в которой игрок оказался.
+        """
+        continent_id = location_passport.get("continent_id")
+        if not continent_id:
+            return
+
+        with self._lock:
+            self._epoch += 1
+            epoch = self._epoch
+            self._cancel_pending_locked()
+            self._ready.clear()
+            self._seed_paths.clear()
+            parent_path = location_passport.get("seed_path") or location_passport.get("key", "start")
+            if self.world_file is not None and location_passport.get("key") in self.world_file:
+                keys = self.world_file.neighbours(location_passport["key"], self.neighbour_count)
+            else:
+                keys = [f"loc_{epoch}_{n}" for n in range(1, self.neighbour_count + 1)]
+            for n, key in enumerate(keys, start=1):
+                self._seed_paths[key] = f"{parent_path}/{n}"
+                future = self._executor.submit(self._generate_for_epoch, continent_id, key, epoch, self._seed_paths[key])
+                self._pending[key] = future
+        print(f"🔮 Поставлено в фоновую генерацию соседних локаций: {len(keys)}")
+
+    def _generate_for_epoch(self, continent_id: str, key: str, epoch: int, seed_path: str):
+        if epoch != self._epoch:
+            return  # Игрок уже ушел, работа не нужна
+        try:
+            passport = self.generate_location(continent_id, key, seed_path)
+        except Exception as e:
+            print(f"⚠️ Фоновая генерация локации '{key}' не удалась: {e}")
+            with self._lock:
+                self._pending.pop(key, None)
+            return
+
+        with self._lock:
+            self._pending.pop(key, None)
+            if epoch != self._epoch:
+                return
+            self._ready[key] = passport
+            while len(self._ready) > self.max_entries:
+                self._ready.popitem(last=False)
+
+    def _cancel_pending_locked(self):
+        for future in self._pending.values():
+            future.cancel()  # Уже запущенные задачи сами увидят смену поколения
+        self._pending.clear()
+
+    # --- Доступ к результатам ---
+
+    def candidates(self) -> List[Dict[str, str]]:
+        """Соседние локации: готовые (с именем) и те, что еще генерируются."""
+        with self._lock:
+            ready = [{"key": key, "name": passport.get("name", key), "ready": True}
+                     for key, passport in self._ready.items()]
+            pending = [{"key": key, "name": "...", "ready": False} for key in self._pending]
+        return sorted(ready + pending, key=lambda candidate: candidate["key"])
+
+    def take(self, key: str, wait: bool = True) -> Dict[str, Any] | None:
+        """
+        Забирает готовую локацию из хранилища. Если она еще генерируется
+        и wait=True, дожидается результата вместо повторной генерации.
+        """
+        with self._lock:
+            if key in self._ready:
+                return self._ready.pop(key)
+            future = self._pending.get(key)
+        if future is None or not wait:
+            return None
+        try:
+            future.result()
+        except (CancelledError, Exception):
+            return None
+        with self._lock:
+            return self._ready.pop(key, None)
+
+    def shutdown(self):
+        with self._lock:
+            self._epoch += 1
+            self._cancel_pending_locked()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,32 +1,99 @@
+import threading
 import yaml
+from typing import Dict, Iterable, List
+from models.tag_set import TagSet
+from services.world_snapshot import get_world_snapshot
+
+DEFAULT_REGISTRY_FILE = "data/tags_registry.yaml"
 
 class TagRegistry:
-    def __init__(self, filepath="data/tags_registry.yaml"):
-        try:
-            with open(filepath, 'r', encoding='utf-8') as file:
-                self._data = yaml.safe_load(file)
-            self._all_tags = self._flatten_tags()
+    """
+    Реестр тегов. Каждый тег интернируется в плотный целочисленный ID:
+    зарегистрированные теги получают ID 0..N-1 в порядке реестра, незарегистрированные
+    (например, "неизведанное" у локаций-заглушек) - следующие свободные ID при первом
+    появлении. ID живут только внутри процесса; сохраняются и уходят в промпты имена.
+    """
+    def __init__(self, filepath=DEFAULT_REGISTRY_FILE):
+        if filepath == DEFAULT_REGISTRY_FILE:
+            # Штатный реестр берется из скомпилированного снимка данных мира
+            self._data = get_world_snapshot().data("tags_registry.yaml")
             print("Реестр тегов успешно загружен.")
-        except FileNotFoundError:
-            print(f"ОШИБКА: Файл реестра тегов не найден по пути {filepath}")
-            self._data = {}
-            self._all_tags = set()
-
-    def _flatten_tags(self) -> set:
-        """Собирает все ID тегов из всех категорий в одно множество для быстрой проверки."""
-        flat_set = set()
+        else:
+            try:
+                with open(filepath, 'r', encoding='utf-8') as file:
+                    self._data = yaml.safe_load(file)
+                print("Реестр тегов успешно загружен.")
+            except FileNotFoundError:
+                print(f"ОШИБКА: Файл реестра тегов не найден по пути {filepath}")
+                self._data = {}
+
+        self._lock = threading.Lock()  # Интернирование идет и из потоков фоновой генерации
+        self._tag_ids: Dict[str, int] = {}
+        self._tag_names: List[str] = []
+        self._tag_info: List[dict | None] = []
+        for tag_id, info in self._flatten_tags().items():
+            self._intern_locked(tag_id, info)
+        self._all_tags = set(self._tag_ids)
+        self.registered = TagSet.from_ids(range(len(self._tag_names)))
+
+    def _flatten_tags(self) -> Dict[str, dict]:
+        """Собирает все теги из всех категорий в один словарь ID тега -> информация о теге."""
+        flat = {}
         for category_data in self._data.values():
             if 'tags' in category_data and isinstance(category_data['tags'], dict):
-                flat_set.update(category_data['tags'].keys())
-        return flat_set
+                flat.update(category_data['tags'])
+        return flat
+
+    def _intern_locked(self, tag: str, info: dict | None = None) -> int:
+        tag_id = len(self._tag_names)
+        self._tag_names.append(tag)
+        self._tag_info.append(info)
+        self._tag_ids[tag] = tag_id  # Последним: читатели без блокировки видят уже готовую запись
+        return tag_id
+
+    def intern(self, tag: str) -> int:
+        """Целочисленный ID тега. Незарегистрированный тег получает новый ID."""
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is not None:
+            return tag_id
+        with self._lock:
+            tag_id = self._tag_ids.get(tag)
+            return tag_id if tag_id is not None else self._intern_locked(tag)
+
+    def tag_name(self, tag_id: int) -> str:
+        return self._tag_names[tag_id]
+
+    def to_tag_set(self, tags: Iterable[str] | TagSet) -> TagSet:
+        """Строковые теги (из YAML или сохранения) -> битовая маска."""
+        if isinstance(tags, TagSet):
+            return tags
+        return TagSet.from_ids(self.intern(tag) for tag in tags)
+
+    def tag_names(self, tag_set: TagSet) -> List[str]:
+        """Битовая маска -> строковые теги. Только на границе с промптами и сохранениями."""
+        return [self._tag_names[tag_id] for tag_id in tag_set]
 
     def validate_tag(self, tag_id: str) -> bool:
         """Проверяет, существует ли тег в реестре. Главная функция валидации."""
         return tag_id in self._all_tags
 
+    def unregistered(self, tag_set: TagSet) -> List[str]:
+        """Теги множества, которых нет в реестре."""
+        return self.tag_names(tag_set - self.registered)
+
     def get_tag_info(self, tag_id: str) -> dict | None:
         """Возвращает полную информацию о теге (имя, описание)."""
-        for category_data in self._data.values():
-            if 'tags' in category_data and tag_id in category_data['tags']:
-                return category_data['tags'][tag_id]
-        return None
\ No newline at end of file
+        index = self._tag_ids.get(tag_id)
+        return self._tag_info[index] if index is not None else None
+
+
+_registry: TagRegistry | None = None
+_registry_lock = threading.Lock()
+
+def get_tag_registry() -> TagRegistry:
+    """Единый на процесс реестр: ID тегов одинаковы у Game, генераторов и Location."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TagRegistry()
+        return _registry
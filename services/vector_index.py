@@ -0,0 +1,437 @@
+# services/vector_index.py
+import os
+import time
+import random
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Sequence, Tuple
+import numpy as np
+
+# Бэкенд поиска памяти: chroma | bruteforce | hnsw | partitioned
+INDEX_BACKEND = os.getenv("MEMORY_INDEX_BACKEND", "chroma")
+# Поле метаданных, по которому шардируется partitioned-индекс
+PARTITION_FIELD = os.getenv("MEMORY_INDEX_PARTITION_FIELD", "location")
+# Бэкенд внутри каждого шарда partitioned-индекса
+PARTITION_BACKEND = os.getenv("MEMORY_INDEX_PARTITION_BACKEND", "bruteforce")
+# Параметры HNSW: больше M/ef - выше recall, но медленнее построение и поиск
+HNSW_M = int(os.getenv("MEMORY_HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("MEMORY_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("MEMORY_HNSW_EF_SEARCH", "64"))
+# Сколько записей читать из коллекции Chroma за раз при построении индекса в памяти
+LOAD_PAGE_SIZE = 5000
+LATENCY_WINDOW = 1000
+
+Filter = Dict[str, Any] | None
+
+
+def chroma_hnsw_metadata() -> Dict[str, Any]:
+    """Параметры встроенного HNSW-индекса Chroma для новой коллекции."""
+    return {"hnsw:M": HNSW_M, "hnsw:construction_ef": HNSW_EF_CONSTRUCTION, "hnsw:search_ef": HNSW_EF_SEARCH}
+
+
+def _matches(metadata: Dict[str, Any], where: Filter) -> bool:
+    return not where or all(metadata.get(key) == value for key, value in where.items())
+
+
+class VectorIndex(ABC):
+    """
+    Поисковый векторный индекс памяти. Расстояние - квадрат L2, как у Chroma по умолчанию.
+    where - фильтр-равенство по метаданным, как filter_metadata в MemoryService.
+    Каждый индекс сам замеряет время построения и задержки запросов (stats()).
+    """
+    name = "base"
+
+    def __init__(self):
+        self.build_seconds = 0.0
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    @abstractmethod
+    def add(self, ids: List[str], vectors: Sequence, metadatas: List[Dict[str, Any]]):
+        ...
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        ...
+
+    @abstractmethod
+    def _query(self, vector: np.ndarray, k: int, where: Filter) -> List[Tuple[str, float]]:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def query(self, vector, k: int, where: Filter = None) -> List[Tuple[str, float]]:
+        """Возвращает до k пар (id, расстояние) от ближайшего к дальнему."""
+        started_at = time.perf_counter()
+        try:
+            return self._query(np.asarray(vector, dtype=np.float32), k, where)
+        finally:
+            self._latencies.append(time.perf_counter() - started_at)
+
+    def build(self, pages):
+        """Наполняет индекс пачками (ids, vectors, metadatas) с замером времени построения."""
+        started_at = time.perf_counter()
+        for ids, vectors, metadatas in pages:
+            self.add(ids, vectors, metadatas)
+        self.build_seconds = time.perf_counter() - started_at
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        pick = lambda fraction: latencies[min(len(latencies) - 1, int(fraction * (len(latencies) - 1)))] if latencies else 0.0
+        return {
+            "backend": self.name,
+            "size": len(self),
+            "build_seconds": self.build_seconds,
+            "queries": len(latencies),
+            "query_p50_ms": pick(0.50) * 1000,
+            "query_p99_ms": pick(0.99) * 1000,
+        }
+
+
+class ChromaIndex(VectorIndex):
+    """Поиск прямо по коллекции Chroma. Данные пишет в коллекцию MemoryService, поэтому add/delete пустые."""
+    name = "chroma"
+
+    def __init__(self, collection):
+        super().__init__()
+        self.collection = collection
+
+    def add(self, ids, vectors, metadatas):
+        pass
+
+    def delete(self, ids):
+        pass
+
+    def __len__(self) -> int:
+        return self.collection.count()
+
+    def _query(self, vector, k, where):
+        conditions = [{key: {"$eq": value}} for key, value in (where or {}).items()]
+        options = {"query_embeddings": [vector.tolist()], "n_results": k, "include": ["distances"]}
+        if len(conditions) == 1:
+            options["where"] = conditions[0]
+        elif conditions:
+            options["where"] = {"$and": conditions}
+        results = self.collection.query(**options)
+        return list(zip(results["ids"][0], results["distances"][0]))
+
+
+class BruteForceIndex(VectorIndex):
+    """Точный перебор одной матрицей NumPy. Для небольших хранилищ быстрее и точнее любого ANN."""
+    name = "bruteforce"
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0  # Занятых строк матрицы (включая удаленные)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {}  # поле метаданных -> значения по строкам
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _reserve(self, dim: int, extra: int):
+        capacity = self._matrix.shape[0]
+        if self._matrix.shape[1] != dim and self._size == 0:
+            self._matrix = np.zeros((0, dim), dtype=np.float32)
+            capacity = 0
+        if self._size + extra <= capacity:
+            return
+        new_capacity = max(1024, capacity * 2, self._size + extra)
+        grow = new_capacity - capacity
+        self._matrix = np.vstack([self._matrix, np.zeros((grow, dim), dtype=np.float32)])
+        self._norms = np.concatenate([self._norms, np.zeros(grow, dtype=np.float32)])
+        self._alive = np.concatenate([self._alive, np.zeros(grow, dtype=bool)])
+        for field, column in self._columns.items():
+            self._columns[field] = np.concatenate([column, np.full(grow, None, dtype=object)])
+
+    def add(self, ids, vectors, metadatas):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+        with self._lock:
+            self._reserve(vectors.shape[1], len(ids))
+            for doc_id, vector, metadata in zip(ids, vectors, metadatas):
+                row = self._rows.get(doc_id)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._rows[doc_id] = row
+                    self._ids.append(doc_id)
+                self._matrix[row] = vector
+                self._norms[row] = float(vector @ vector)
+                self._alive[row] = True
+                for field in set(self._columns) | set(metadata):
+                    if field not in self._columns:
+                        self._columns[field] = np.full(self._matrix.shape[0], None, dtype=object)
+                    self._columns[field][row] = metadata.get(field)
+
+    def delete(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                row = self._rows.pop(doc_id, None)
+                if row is not None:
+                    self._alive[row] = False  # Строка-надгробие: в поиск больше не попадает
+
+    def _query(self, vector, k, where):
+        with self._lock:
+            if not self._rows:
+                return []
+            size = self._size
+            mask = self._alive[:size].copy()
+            for field, value in (where or {}).items():
+                column = self._columns.get(field)
+                if column is None:
+                    return []
+                mask &= column[:size] == value
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                return []
+            distances = self._norms[rows] + float(vector @ vector) - 2 * (self._matrix[rows] @ vector)
+            ids = [self._ids[row] for row in rows]
+        k = min(k, len(rows))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [(ids[i], float(max(distances[i], 0.0))) for i in top]
+
+
+class HNSWIndex(VectorIndex):
+    """
+    Приближенный поиск HNSW (hnswlib - зависимость chromadb, отдельной установки не требует).
+    M и ef_construction задают граф, ef_search - точность/скорость запроса.
+    Фильтр применяется внутри обхода графа через filter-функцию hnswlib.
+    """
+    name = "hnsw"
+
+    def __init__(self, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION, ef_search: int = HNSW_EF_SEARCH):
+        super().__init__()
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise RuntimeError("Для MEMORY_INDEX_BACKEND=hnsw нужен пакет hnswlib (chroma-hnswlib)") from e
+        self._hnswlib = hnswlib
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._lock = threading.Lock()
+        self._index = None
+        self._labels: Dict[str, int] = {}
+        self._ids: Dict[int, str] = {}
+        self._metadatas: Dict[int, Dict[str, Any]] = {}
+        self._next_label = 0
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def _ensure_capacity(self, dim: int, extra: int):
+        if self._index is None:
+            self._index = self._hnswlib.Index(space="l2", dim=dim)
+            self._index.init_index(max_elements=max(1024, extra * 2), ef_construction=self.ef_construction, M=self.m)
+            self._index.set_ef(self.ef_search)
+        needed = self._index.get_current_count() + extra
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, self._index.get_max_elements() * 2))
+
+    def add(self, ids, vectors, metadatas):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+        with self._lock:
+            self._ensure_capacity(vectors.shape[1], len(ids))
+            labels = []
+            for doc_id, metadata in zip(ids, metadatas):
+                label = self._labels.get(doc_id)
+                if label is None:
+                    label = self._next_label
+                    self._next_label += 1
+                    self._labels[doc_id] = label
+                    self._ids[label] = doc_id
+                self._metadatas[label] = metadata
+                labels.append(label)
+            # Существующая метка получает новый вектор - hnswlib обновляет его на месте
+            self._index.add_items(vectors, np.asarray(labels, dtype=np.int64))
+
+    def delete(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                label = self._labels.pop(doc_id, None)
+                if label is not None:
+                    self._index.mark_deleted(label)
+                    self._ids.pop(label, None)
+                    self._metadatas.pop(label, None)
+
+    def _query(self, vector, k, where):
+        with self._lock:
+            if self._index is None or not self._labels:
+                return []
+            if not where:
+                labels = None
+                k = min(k, len(self._labels))
+            else:
+                labels = [label for label in self._ids if _matches(self._metadatas.get(label, {}), where)]
+                if not labels:
+                    return []
+                if len(labels) <= k:
+                    # Под фильтр попало не больше k элементов: их все и возвращаем, точным перебором
+                    return self._exact_locked(vector, labels)
+            allowed = None if labels is None else set(labels)
+            try:
+                found, distances = self._index.knn_query(vector, k=k, filter=None if allowed is None else allowed.__contains__)
+            except RuntimeError:
+                # Обход графа с фильтром не набрал k элементов - перебираем отфильтрованные точно
+                return self._exact_locked(vector, labels if labels is not None else list(self._ids))[:k]
+            return [(self._ids[int(label)], float(distance)) for label, distance in zip(found[0], distances[0])
+                    if int(label) in self._ids]
+
+    def _exact_locked(self, vector: np.ndarray, labels: List[int]) -> List[Tuple[str, float]]:
+        vectors = np.asarray(self._index.get_items(labels), dtype=np.float32)
+        distances = ((vectors - vector) ** 2).sum(axis=1)
+        order = np.argsort(distances)
+        return [(self._ids[labels[i]], float(distances[i])) for i in order]
+
+
+class PartitionedIndex(VectorIndex):
+    """
+    Индекс, разбитый на шарды по полю метаданных (например, location или continent).
+    Запрос с фильтром по этому полю идет в один шард; без него - во все, с слиянием top-k.
+    """
+    name = "partitioned"
+
+    def __init__(self, field: str = PARTITION_FIELD, factory: Callable[[], VectorIndex] | None = None):
+        super().__init__()
+        self.field = field
+        self.factory = factory or BruteForceIndex
+        self._lock = threading.Lock()
+        self._partitions: Dict[Any, VectorIndex] = {}
+        self._partition_of: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._partition_of)
+
+    def _partition(self, key) -> VectorIndex:
+        with self._lock:
+            if key not in self._partitions:
+                self._partitions[key] = self.factory()
+            return self._partitions[key]
+
+    def add(self, ids, vectors, metadatas):
+        groups: Dict[Any, Tuple[list, list, list]] = {}
+        for doc_id, vector, metadata in zip(ids, vectors, metadatas):
+            key = metadata.get(self.field)
+            previous = self._partition_of.get(doc_id)
+            if previous is not None and previous != key:
+                self._partitions[previous].delete([doc_id])
+            self._partition_of[doc_id] = key
+            group = groups.setdefault(key, ([], [], []))
+            group[0].append(doc_id)
+            group[1].append(vector)
+            group[2].append(metadata)
+        for key, (group_ids, group_vectors, group_metadatas) in groups.items():
+            self._partition(key).add(group_ids, group_vectors, group_metadatas)
+
+    def delete(self, ids):
+        by_partition: Dict[Any, List[str]] = {}
+        for doc_id in ids:
+            if doc_id in self._partition_of:
+                by_partition.setdefault(self._partition_of.pop(doc_id), []).append(doc_id)
+        for key, partition_ids in by_partition.items():
+            self._partitions[key].delete(partition_ids)
+
+    def _query(self, vector, k, where):
+        if where and self.field in where:
+            partition = self._partitions.get(where[self.field])
+            if partition is None:
+                return []
+            rest = {key: value for key, value in where.items() if key != self.field}
+            return partition.query(vector, k, rest or None)
+        found = []
+        for partition in list(self._partitions.values()):
+            found.extend(partition.query(vector, k, where))
+        return sorted(found, key=lambda hit: hit[1])[:k]
+
+    def stats(self) -> Dict[str, Any]:
+        result = super().stats()
+        result["partitions"] = len(self._partitions)
+        result["partition_field"] = self.field
+        return result
+
+
+def create_vector_index(backend: str, collection) -> VectorIndex:
+    """Создает поисковый индекс выбранного бэкенда и наполняет его из коллекции Chroma."""
+    if backend == "chroma":
+        return ChromaIndex(collection)
+    if backend == "bruteforce":
+        index = BruteForceIndex()
+    elif backend == "hnsw":
+        index = HNSWIndex()
+    elif backend == "partitioned":
+        factory = HNSWIndex if PARTITION_BACKEND == "hnsw" else BruteForceIndex
+        index = PartitionedIndex(PARTITION_FIELD, factory)
+    else:
+        raise ValueError(f"Неизвестный бэкенд индекса памяти: '{backend}'")
+    index.build(_collection_pages(collection))
+    print(f"✅ Индекс памяти '{backend}' построен: {len(index)} векторов за {index.build_seconds:.2f} с")
+    return index
+
+
+def _collection_pages(collection):
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "metadatas"], limit=LOAD_PAGE_SIZE, offset=offset)
+        if not len(page["ids"]):
+            return
+        yield page["ids"], page["embeddings"], page["metadatas"]
+        offset += len(page["ids"])
+
+
+def measure_recall(index: VectorIndex, reference: VectorIndex, queries: Sequence, k: int = 5,
+                   where: Filter = None, wheres: Sequence[Filter] | None = None) -> float:
+    """
+    Средняя доля точного top-k (reference), которую находит index.
+    wheres - свой фильтр для каждого запроса (вместо общего where).
+    """
+    if not len(queries):
+        return 0.0
+    total = 0.0
+    for position, vector in enumerate(queries):
+        if wheres is not None:
+            where = wheres[position]
+        expected = {doc_id for doc_id, _ in reference.query(vector, k, where)}
+        if not expected:
+            total += 1.0
+            continue
+        found = {doc_id for doc_id, _ in index.query(vector, k, where)}
+        total += len(found & expected) / len(expected)
+    return total / len(queries)
+
+
+def evaluate_index(index: VectorIndex, collection, sample_size: int = 50, k: int = 5, seed: int = 0) -> Dict[str, Any]:
+    """
+    Отчет по индексу: время построения, задержки запросов и recall@k против
+    точного перебора. Запросами служат случайные векторы из самой коллекции.
+    Второй recall - с фильтром по PARTITION_FIELD запрашивающей записи, как у
+    слоев памяти по локации: под фильтр часто попадает меньше k записей.
+    """
+    reference = BruteForceIndex()
+    reference.build(_collection_pages(collection))
+    rng = random.Random(seed)
+    ids = list(reference._rows)
+    sample = rng.sample(ids, min(sample_size, len(ids)))
+    queries = [reference._matrix[reference._rows[doc_id]] for doc_id in sample]
+    column = reference._columns.get(PARTITION_FIELD)
+    values = [column[reference._rows[doc_id]] if column is not None else None for doc_id in sample]
+    wheres = [{PARTITION_FIELD: value} if value is not None else None for value in values]
+    report = {
+        "recall_at_k": measure_recall(index, reference, queries, k),
+        "filtered_recall_at_k": measure_recall(index, reference, queries, k, wheres=wheres),
+        "filter_field": PARTITION_FIELD,
+        "k": k,
+    }
+    report.update(index.stats())
+    return report
@@ -1,6 +1,7 @@
-import yaml
 from pathlib import Path
 from typing import Dict, List, Any
+from services.world_snapshot import get_world_snapshot
+from utils.alias_table import AliasTable
 
 DATA_DIR = Path(__file__).parent.parent / "data"
 DATA_TABLES_DIR = DATA_DIR / "data_tables"
@@ -8,25 +9,44 @@ DATA_TABLES_DIR = DATA_DIR / "data_tables"
 class WorldDataService:
     def __init__(self):
         print("⚙️ Загрузка всех данных мира...")
-        self._world_continents = self._load_yaml(DATA_DIR / "world_anatomy.yaml").get("world_continents", {})
+        # Таблицы и индексы по ID уже разобраны в снимке; YAML читается только для измененных файлов
+        self._snapshot = get_world_snapshot()
+        self._world_continents = self._snapshot.data("world_anatomy.yaml").get("world_continents", {})
 
-        # Загружаем все таблицы
-        anatomy = self._load_yaml(DATA_TABLES_DIR / "anatomy.yaml")
-        # ... можно добавить загрузку economy, history и т.д. по необходимости
-
-        # Преобразуем списки в словари для быстрого доступа по ID
-        self._region_types = {item['id']: item for item in anatomy.get("REGION_TYPES", [])}
-        self._biomes = {item['id']: item for item in anatomy.get("BIOMES", [])}
-        self._landmarks = {item['id']: item for item in anatomy.get("LANDMARKS", [])}
+        self._region_types = self._snapshot.index("data_tables/anatomy.yaml", "REGION_TYPES")
+        self._biomes = self._snapshot.index("data_tables/anatomy.yaml", "BIOMES")
+        self._landmarks = self._snapshot.index("data_tables/anatomy.yaml", "LANDMARKS")
+        self._build_sampling_tables()
         print("✅ Данные об анатомии мира успешно загружены.")
 
-    def _load_yaml(self, filepath: Path) -> Dict:
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return yaml.safe_load(f)
-        except Exception as e:
-            print(f"🔴 ОШИБКА: Не удалось загрузить YAML файл {filepath}: {e}")
-            return {}
+    def _build_sampling_tables(self):
+        """
+        Таблицы алиасов для генераторов строятся один раз при загрузке данных:
+        типы регионов континента, биомы типа региона, ориентиры биома.
+        Каждый выбор потом - O(1), без пересборки списков весов.
+        """
+        def table(items: List[Dict[str, Any]]) -> AliasTable | None:
+            items = [item for item in items if item.get("weight", 1) > 0]
+            return AliasTable(items, [item.get("weight", 1) for item in items]) if items else None
+
+        self._region_tables: Dict[str, AliasTable | None] = {
+            continent_id: table([self._region_types[rid] for rid in continent.get("allowed_region_type_ids", []) if rid in self._region_types])
+            for continent_id, continent in self._world_continents.items()
+        }
+        biomes_by_region: Dict[str, List[Dict[str, Any]]] = {}
+        for biome in self._biomes.values():
+            for region_id in biome.get("parent_region_ids", []):
+                biomes_by_region.setdefault(region_id, []).append(biome)
+        self._biome_tables = {region_id: table(biomes) for region_id, biomes in biomes_by_region.items()}
+
+        landmarks_by_biome: Dict[str, List[Dict[str, Any]]] = {}
+        for landmark in self._landmarks.values():
+            for biome_id in landmark.get("allowed_biome_ids", []):
+                landmarks_by_biome.setdefault(biome_id, []).append(landmark)
+        self._landmark_tables = {biome_id: table(landmarks) for biome_id, landmarks in landmarks_by_biome.items()}
+
+    def continent_ids(self) -> List[str]:
+        return list(self._world_continents)
 
     def get_continent_data(self, continent_id: str) -> Dict[str, Any] | None:
         return self._world_continents.get(continent_id)
@@ -34,6 +54,16 @@ class WorldDataService:
     def get_region_type_by_id(self, region_type_id: str) -> Dict[str, Any] | None:
         return self._region_types.get(region_type_id)
 
-    # В будущем здесь появятся другие геттеры, например:
-    # def get_compatible_biomes_for_region(self, region_id: str) -> List[Dict]:
-    #     ...
\ No newline at end of file
+    def region_type_table(self, continent_id: str) -> AliasTable | None:
+        """Взвешенный выбор типа региона континента; None, если ни один разрешенный тип не найден."""
+        return self._region_tables.get(continent_id)
+
+    def biome_table(self, region_type_id: str) -> AliasTable | None:
+        return self._biome_tables.get(region_type_id)
+
+    def landmark_table(self, biome_id: str) -> AliasTable | None:
+        return self._landmark_tables.get(biome_id)
+
+    def get_table_item(self, table_name: str, item_id: str) -> Dict[str, Any] | None:
+        """Запись любой таблицы data_tables (RESOURCES, RACES, ...) по ID."""
+        return self._snapshot.table_index(table_name).get(item_id)
\ No newline at end of file
@@ -0,0 +1,191 @@
+# services/world_snapshot.py
+"""
+Скомпилированный снимок данных мира: все YAML-таблицы (tags_registry.yaml,
+world_anatomy.yaml, data_tables/*.yaml) и индексы их записей по id в одном
+pickle-файле db/world_snapshot.pickle. Снимок привязан к хэшам исходников:
+при загрузке YAML разбирается заново только для изменившихся файлов.
+
+    python -m services.world_snapshot           # собрать/обновить снимок
+    python -m services.world_snapshot --force   # пересобрать с нуля
+"""
+import os
+import sys
+import time
+import pickle
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from typing import Any, Dict, List
+import yaml
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+SNAPSHOT_FILE = Path(__file__).parent.parent / "db" / "world_snapshot.pickle"
+# Меняется при изменении формата снимка - старые снимки тогда просто пересобираются
+SNAPSHOT_VERSION = 1
+
+
+def source_files() -> List[Path]:
+    """Все YAML-исходники данных мира."""
+    return [DATA_DIR / "tags_registry.yaml", DATA_DIR / "world_anatomy.yaml"] + sorted((DATA_DIR / "data_tables").glob("*.yaml"))
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _safe_hash(path: Path) -> str | None:
+    try:
+        return file_hash(path)
+    except OSError:
+        return None
+
+
+def build_id_indexes(data: Any) -> Dict[str, Dict[str, Any]]:
+    """Для каждой таблицы-списка записей с полем id строит словарь id -> запись."""
+    if not isinstance(data, dict):
+        return {}
+    indexes = {}
+    for table_name, rows in data.items():
+        if isinstance(rows, list) and rows and all(isinstance(row, dict) and "id" in row for row in rows):
+            indexes[table_name] = {row["id"]: row for row in rows}
+    return indexes
+
+
+def _compile_file(path: Path) -> Dict[str, Any]:
+    """
+    Разбирает один YAML-файл. Нечитаемый файл (нет доступа, не UTF-8, битый YAML)
+    дает пустые данные и текст ошибки.
+    """
+    entry = {"sha256": "", "mtime_ns": 0, "size": -1, "error": None}
+    try:
+        stat = path.stat()
+        raw = path.read_bytes()
+        entry.update(sha256=hashlib.sha256(raw).hexdigest(), mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        data = yaml.safe_load(raw.decode("utf-8")) or {}
+    except (OSError, UnicodeDecodeError, yaml.YAMLError) as e:
+        print(f"🔴 ОШИБКА: Не удалось загрузить YAML файл {path}: {e}")
+        data = {}
+        entry["error"] = str(e)
+    entry["data"] = data
+    entry["indexes"] = build_id_indexes(data)
+    return entry
+
+
+class WorldSnapshot:
+    """Разобранные таблицы мира и их индексы по id. Ключи - пути относительно data/."""
+    def __init__(self, files: Dict[str, Dict[str, Any]]):
+        self.files = files
+
+    def data(self, relative_path: str) -> Dict[str, Any]:
+        """Содержимое YAML-файла, например data("data_tables/anatomy.yaml")."""
+        entry = self.files.get(relative_path)
+        return entry["data"] if entry else {}
+
+    def index(self, relative_path: str, table_name: str) -> Dict[str, Any]:
+        """Записи таблицы файла по id."""
+        entry = self.files.get(relative_path)
+        return entry["indexes"].get(table_name, {}) if entry else {}
+
+    def table_index(self, table_name: str) -> Dict[str, Any]:
+        """Записи таблицы по id, в каком бы файле data_tables/ она ни лежала."""
+        for relative_path, entry in self.files.items():
+            if relative_path.startswith("data_tables/") and table_name in entry["indexes"]:
+                return entry["indexes"][table_name]
+        return {}
+
+    def errors(self) -> Dict[str, str]:
+        return {path: entry["error"] for path, entry in self.files.items() if entry["error"]}
+
+
+def _read_snapshot(path: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return {}
+    if not isinstance(payload, dict) or payload.get("version") != SNAPSHOT_VERSION:
+        return {}
+    return payload.get("files", {})
+
+
+def _write_snapshot(path: Path, files: Dict[str, Dict[str, Any]]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"version": SNAPSHOT_VERSION, "files": files}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)  # Атомарная замена: читатель не увидит недописанный снимок
+
+
+def compile_snapshot(snapshot_path: Path = SNAPSHOT_FILE, force: bool = False) -> WorldSnapshot:
+    """
+    Загружает снимок и сверяет его с исходниками: совпали размер и mtime - файл
+    не читается вовсе; иначе сверяется sha256, и только изменившийся файл
+    разбирается из YAML. Если что-то изменилось, снимок перезаписывается.
+    """
+    previous = {} if force else _read_snapshot(snapshot_path)
+    files, changed = {}, force or not previous
+    for path in source_files():
+        relative_path = path.relative_to(DATA_DIR).as_posix()
+        cached = previous.get(relative_path)
+        try:
+            stat = path.stat()
+        except OSError as e:
+            # Пропавший исходник просто отсутствует в снимке: data() для него вернет {}
+            print(f"🔴 ОШИБКА: Файл данных мира недоступен {path}: {e}")
+            continue
+        if cached and cached["mtime_ns"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+            files[relative_path] = cached
+            continue
+        if cached and cached["sha256"] == _safe_hash(path):
+            cached.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)  # Файл "тронут", но не изменен
+        else:
+            print(f"📄 Разбор YAML: {relative_path}")
+            cached = _compile_file(path)
+        files[relative_path] = cached
+        changed = True
+    if set(previous) - set(files):
+        changed = True  # Исходник удален
+
+    if changed:
+        try:
+            _write_snapshot(snapshot_path, files)
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить снимок данных мира: {e}")
+    return WorldSnapshot(files)
+
+
+_snapshot: WorldSnapshot | None = None
+_snapshot_lock = threading.Lock()
+
+def get_world_snapshot() -> WorldSnapshot:
+    """
+    Снимок на процесс: TagRegistry и WorldDataService каждого нового Game()
+    (в том числе при загрузке сохранения) получают уже разобранные таблицы.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = compile_snapshot()
+        return _snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Компиляция снимка данных мира")
+    parser.add_argument("--force", action="store_true", help="пересобрать снимок, не глядя на кэш")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    snapshot = compile_snapshot(force=args.force)
+    print(f"✅ Снимок {SNAPSHOT_FILE} готов за {(time.perf_counter() - started_at) * 1000:.0f} мс")
+    for relative_path, entry in snapshot.files.items():
+        tables = ", ".join(f"{name} ({len(rows)})" for name, rows in entry["indexes"].items()) or "-"
+        print(f"  {relative_path}: {tables}")
+    for relative_path, error in snapshot.errors().items():
+        print(f"🔴 {relative_path}: {error.splitlines()[0]}")
+    if snapshot.errors():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# utils/alias_table.py
+import random
+from typing import Generic, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+class AliasTable(Generic[T]):
+    """
+    Взвешенный выбор методом алиасов Уолкера (вариант Vose): таблица строится
+    один раз за O(n), а каждый выбор - O(1): одна ячейка и один бросок монеты.
+    Случайность берется только из переданного random.Random, поэтому при
+    одинаковом зерне последовательность выборов одна и та же.
+    """
+    __slots__ = ("items", "_probability", "_alias")
+
+    def __init__(self, items: Sequence[T], weights: Sequence[float]):
+        if not items or len(items) != len(weights):
+            raise ValueError("Для таблицы алиасов нужны непустые списки элементов и весов одной длины.")
+        if any(weight < 0 for weight in weights) or sum(weights) <= 0:
+            raise ValueError("Веса должны быть неотрицательными, и хотя бы один - положительным.")
+
+        count = len(items)
+        total = float(sum(weights))
+        scaled = [weight * count / total for weight in weights]
+        self.items: List[T] = list(items)
+        self._probability = [1.0] * count
+        self._alias = list(range(count))
+
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            low, high = small.pop(), large.pop()
+            self._probability[low] = scaled[low]
+            self._alias[low] = high
+            scaled[high] -= 1.0 - scaled[low]
+            (small if scaled[high] < 1.0 else large).append(high)
+        # Остатки из-за погрешности округления - ячейки с вероятностью 1
+        for i in small + large:
+            self._probability[i] = 1.0
+
+    def sample(self, rng: random.Random) -> T:
+        i = rng.randrange(len(self.items))
+        return self.items[i] if rng.random() < self._probability[i] else self.items[self._alias[i]]
+
+    def __len__(self) -> int:
+        return len(self.items)
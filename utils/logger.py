@@ -1,5 +1,11 @@
+import os
 import datetime
 import json
+import gzip
+import queue
+import atexit
+import shutil
+import threading
 from pathlib import Path
 import functools
 
@@ -7,6 +13,10 @@ import functools
 LOG_DIR = Path(__file__).parent.parent / "logs"
 GAME_LOG_FILE = LOG_DIR / "game_events.log"
 LLM_TRACE_FILE = LOG_DIR / "llm_trace.jsonl"
+TURN_METRICS_FILE = LOG_DIR / "turn_metrics.jsonl"
+
+FLUSH_INTERVAL_SECONDS = 1.0   # Как часто фоновый поток сбрасывает накопленные записи
+MAX_QUEUE_SIZE = 10_000        # Если диск не успевает, лишние записи отбрасываются, а не тормозят ход
 
 
 def setup_logging():
@@ -14,6 +24,151 @@ def setup_logging():
     LOG_DIR.mkdir(exist_ok=True)
 
 
+class _RotatingLogFile:
+    """Файл лога с ротацией по размеру: base -> base.1 -> base.2 ... (опционально со сжатием gzip)."""
+    def __init__(self, path: Path, max_bytes: int, backup_count: int, compress: bool):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+
+    def _backup_path(self, index: int) -> Path:
+        suffix = f".{index}.gz" if self.compress else f".{index}"
+        return self.path.with_name(self.path.name + suffix)
+
+    def write(self, lines: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            size = f.tell()
+        if size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        """Сдвигает резервные копии и убирает текущий файл в base.1 (сжимая, если нужно)."""
+        oldest = self._backup_path(self.backup_count)
+        if oldest.exists():
+            oldest.unlink()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = self._backup_path(index)
+            if source.exists():
+                source.rename(self._backup_path(index + 1))
+
+        target = self._backup_path(1)
+        if self.compress:
+            pending = self.path.with_name(self.path.name + ".rotating")
+            self.path.rename(pending)
+            with open(pending, "rb") as src, gzip.open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            pending.unlink()
+        else:
+            self.path.rename(target)
+
+
+_SNAPSHOT = "__snapshot__"
+
+
+def _replace_file(path: Path, text: str):
+    """Атомарно заменяет содержимое файла: читатель никогда не увидит его наполовину записанным."""
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+class _BackgroundLogWriter:
+    """
+    Фоновый поток, который пишет логи пачками. Игровой поток только кладет
+    готовую строку в очередь и никогда не ждет диск.
+    """
+    def __init__(self, files: dict, flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        self.files = files
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def submit(self, target: str, line: str):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((target, line))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0):
+        """Ждет, пока все уже поставленные записи окажутся на диске."""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        try:
+            self._queue.put((None, done), timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = {}
+            snapshots = {}
+            markers = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Забираем все, что успело накопиться, одной пачкой
+            while True:
+                target, payload = item
+                if target is None:
+                    markers.append(payload)
+                elif target == _SNAPSHOT:
+                    snapshots[payload[0]] = payload[1]  # Нужна только последняя версия файла
+                else:
+                    batch.setdefault(target, []).append(payload)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            for path, text in snapshots.items():
+                try:
+                    _replace_file(path, text)
+                except Exception as e:
+                    print(f"🔴 Не удалось обновить файл '{path}': {e}")
+            for target, lines in batch.items():
+                try:
+                    self.files[target].write(lines)
+                except Exception as e:
+                    print(f"🔴 Не удалось записать лог '{target}': {e}")
+            for marker in markers:
+                marker.set()
+
+
+_writer = _BackgroundLogWriter({
+    "game": _RotatingLogFile(GAME_LOG_FILE, max_bytes=5 * 1024 * 1024, backup_count=3, compress=False),
+    # Трасса LLM содержит промпты целиком и растет быстро - ее сжимаем
+    "llm_trace": _RotatingLogFile(LLM_TRACE_FILE, max_bytes=20 * 1024 * 1024, backup_count=10, compress=True),
+    "metrics": _RotatingLogFile(TURN_METRICS_FILE, max_bytes=10 * 1024 * 1024, backup_count=5, compress=True),
+})
+
+
+def flush_logs():
+    """Принудительно сбрасывает очередь логов на диск (перед выходом, в тестах и бенчмарках)."""
+    _writer.flush()
+
+
+def write_snapshot(path: Path, text: str):
+    """Фоново и атомарно заменяет файл целиком (например, сводку метрик для Prometheus)."""
+    _writer.submit(_SNAPSHOT, (path, text))
+
+
 # --- "Человеческий" лог ---
 def log_game_event(tag: str, message: str):
     """
@@ -23,9 +178,7 @@ def log_game_event(tag: str, message: str):
     try:
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         log_entry = f"[{timestamp}] [{tag.upper()}] {message}\n"
-        
-        with open(GAME_LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(log_entry)
+        _writer.submit("game", log_entry)
             
     except Exception as e:
         print(f"🔴 Не удалось записать в игровой лог: {e}")
@@ -39,14 +192,21 @@ def log_llm_trace(trace_data: dict):
     try:
         trace_data["timestamp"] = datetime.datetime.now().isoformat()
         log_entry = json.dumps(trace_data, ensure_ascii=False) + "\n"
-        
-        with open(LLM_TRACE_FILE, "a", encoding="utf-8") as f:
-            f.write(log_entry)
+        _writer.submit("llm_trace", log_entry)
             
     except Exception as e:
         print(f"🔴 Не удалось записать в LLM trace лог: {e}")
 
 
+# --- Метрики ходов ---
+def log_turn_metrics(turn_record: dict):
+    """Записывает замеры одного хода (длительности этапов, размеры) в JSONL файл."""
+    try:
+        _writer.submit("metrics", json.dumps(turn_record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"🔴 Не удалось записать метрики хода: {e}")
+
+
 # --- Декоратор для логирования ввода ---
 def log_player_input(func):
     """Декоратор, который логирует первый аргумент (команду) функции."""
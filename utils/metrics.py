@@ -0,0 +1,141 @@
+# utils/metrics.py
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List
+from utils.logger import LOG_DIR, log_turn_metrics, write_snapshot
+
+PROMETHEUS_FILE = LOG_DIR / "metrics.prom"
+ROLLING_WINDOW = 200  # Сколько последних ходов учитывается в p50/p95
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class TurnMetrics:
+    """
+    Легкие замеры этапов игрового хода.
+    Каждый этап оборачивается в span(имя); вложенные спаны вычитаются из
+    родителя, так что в записи хода у каждого этапа - его собственное время.
+    По завершении хода запись уходит в logs/turn_metrics.jsonl, а сводка
+    в формате Prometheus - в logs/metrics.prom.
+    """
+    def __init__(self, window: int = ROLLING_WINDOW):
+        self._lock = threading.Lock()
+        self._turn: Dict | None = None
+        self._stack: List[list] = []  # [имя, начало, время вложенных спанов]
+        self._turn_started_at = 0.0
+        self._windows: Dict[str, Deque[float]] = {}
+        self._totals: Dict[str, List[float]] = {}  # имя -> [сумма, количество]
+        self._kinds: Dict[str, str] = {}  # имя -> "stage" | "value"
+        self._window = window
+        self.turns = 0
+
+    # --- Сбор данных внутри хода ---
+
+    def begin_turn(self, **info):
+        with self._lock:
+            self._turn = {"info": info, "stages": {}, "values": {}}
+            self._stack = []
+            self._turn_started_at = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str):
+        """Замеряет этап хода. Вне хода ничего не делает."""
+        if self._turn is None:
+            yield
+            return
+        frame = [name, time.perf_counter(), 0.0]
+        with self._lock:
+            self._stack.append(frame)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - frame[1]
+            with self._lock:
+                if self._turn is not None and frame in self._stack:
+                    self._stack.remove(frame)
+                    if self._stack:
+                        self._stack[-1][2] += elapsed
+                    stages = self._turn["stages"]
+                    stages[name] = stages.get(name, 0.0) + elapsed - frame[2]
+
+    def record(self, name: str, value: float):
+        """Записывает величину хода (размер промпта, время до первого токена и т.п.)."""
+        with self._lock:
+            if self._turn is not None:
+                self._turn["values"][name] = value
+
+    def seconds_since_turn_start(self) -> float:
+        return time.perf_counter() - self._turn_started_at
+
+    def end_turn(self):
+        with self._lock:
+            turn, self._turn = self._turn, None
+            if turn is None:
+                return
+            turn["total_seconds"] = time.perf_counter() - self._turn_started_at
+            turn["timestamp"] = time.time()
+            self.turns += 1
+            self._observe("total", turn["total_seconds"], "stage")
+            for name, seconds in turn["stages"].items():
+                self._observe(name, seconds, "stage")
+            for name, value in turn["values"].items():
+                self._observe(name, value, "value")
+            prometheus_text = self._render_prometheus()
+
+        log_turn_metrics(turn)
+        write_snapshot(PROMETHEUS_FILE, prometheus_text)
+
+    def _observe(self, name: str, value: float, kind: str):
+        self._kinds[name] = kind
+        self._windows.setdefault(name, deque(maxlen=self._window)).append(value)
+        totals = self._totals.setdefault(name, [0.0, 0])
+        totals[0] += value
+        totals[1] += 1
+
+    # --- Отчеты ---
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95 по каждому этапу и величине за последние ходы."""
+        with self._lock:
+            result = {}
+            for name, window in self._windows.items():
+                values = sorted(window)
+                result[name] = {
+                    "kind": self._kinds[name],
+                    "count": len(values),
+                    "p50": _percentile(values, 0.50),
+                    "p95": _percentile(values, 0.95),
+                }
+            return result
+
+    def _render_prometheus(self) -> str:
+        lines = [
+            "# HELP silgarron_turns_total Количество завершенных ходов.",
+            "# TYPE silgarron_turns_total counter",
+            f"silgarron_turns_total {self.turns}",
+            "# HELP silgarron_turn_stage_seconds Собственное время этапов хода.",
+            "# TYPE silgarron_turn_stage_seconds summary",
+        ]
+        value_lines = [
+            "# HELP silgarron_turn_value Величины хода (размеры промпта и ответа, задержки).",
+            "# TYPE silgarron_turn_value summary",
+        ]
+        for name in sorted(self._windows):
+            is_stage = self._kinds[name] == "stage"
+            metric = "silgarron_turn_stage_seconds" if is_stage else "silgarron_turn_value"
+            label = "stage" if is_stage else "name"
+            target = lines if is_stage else value_lines
+            values = sorted(self._windows[name])
+            for quantile in (0.5, 0.95):
+                target.append(f'{metric}{{{label}="{name}",quantile="{quantile}"}} {_percentile(values, quantile):.6f}')
+            total, count = self._totals[name]
+            target.append(f'{metric}_sum{{{label}="{name}"}} {total:.6f}')
+            target.append(f'{metric}_count{{{label}="{name}"}} {count}')
+        return "\n".join(lines + value_lines) + "\n"
@@ -1,24 +1,252 @@
+import json
+import string
 from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Set, Tuple
 
 # Указываем путь к папке с промптами относительно корня проекта
 PROMPT_DIR = Path(__file__).parent.parent / "prompts"
 
+class PromptTemplate:
+    """
+    Шаблон промпта, заранее разобранный на сегменты "литерал + поле".
+    Рендер - это просто склейка сегментов, без повторного чтения и разбора файла.
+    """
+    def __init__(self, name: str, path: Path):
+        self.name = name
+        self.path = path
+        self.mtime_ns = 0
+        # Разобранный шаблон хранится одним кортежем (сегменты, поля) и подменяется
+        # одним присваиванием: рендер в другом потоке никогда не видит сегменты
+        # нового файла вместе с полями старого
+        self._parsed: Tuple[List[Tuple[str, str | None, str, str | None]], FrozenSet[str]] = ([], frozenset())
+        self.load()
+
+    @property
+    def segments(self) -> List[Tuple[str, str | None, str, str | None]]:
+        return self._parsed[0]
+
+    @property
+    def fields(self) -> FrozenSet[str]:
+        return self._parsed[1]
+
+    def load(self):
+        stat = self.path.stat()
+        with open(self.path, "r", encoding="utf-8") as f:
+            text = f.read()
+        segments = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(text):
+            segments.append((literal, field_name, format_spec or "", conversion))
+        self._parsed = (segments, frozenset(field for _, field, _, _ in segments if field))
+        self.mtime_ns = stat.st_mtime_ns
+
+    def render(self, **kwargs) -> str:
+        segments, fields = self._parsed
+        missing = fields - kwargs.keys()
+        if missing:
+            raise KeyError(", ".join(sorted(missing)))
+        parts = []
+        for literal, field_name, format_spec, conversion in segments:
+            parts.append(literal)
+            if field_name is None:
+                continue
+            value = kwargs[field_name]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "s":
+                value = str(value)
+            parts.append(format(value, format_spec) if format_spec else str(value))
+        return "".join(parts)
+
+
+class PromptRegistry:
+    """
+    Реестр всех шаблонов из папки prompts/. Загружает и разбирает их один раз,
+    перечитывает файл только если изменилось его время модификации,
+    и умеет заранее сверить поля шаблонов с тем, что передают места вызова.
+    """
+    def __init__(self, prompt_dir: Path = PROMPT_DIR):
+        self.prompt_dir = prompt_dir
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._expected_fields: Dict[str, Set[str]] = {}
+        for path in sorted(prompt_dir.glob("*.txt")):
+            self._templates[path.stem] = PromptTemplate(path.stem, path)
+
+    def get(self, prompt_name: str) -> PromptTemplate:
+        template = self._templates.get(prompt_name)
+        path = self.prompt_dir / f"{prompt_name}.txt"
+        if template is None:
+            # Шаблон мог появиться после старта
+            template = PromptTemplate(prompt_name, path)
+            self._templates[prompt_name] = template
+        elif path.stat().st_mtime_ns != template.mtime_ns:
+            print(f"🔄 Шаблон '{prompt_name}' изменился на диске, перезагружаем.")
+            template.load()
+        return template
+
+    def render(self, prompt_name: str, **kwargs) -> str:
+        return self.get(prompt_name).render(**kwargs)
+
+    def expect(self, prompt_name: str, fields: Set[str]):
+        """Регистрирует набор переменных, который место вызова передает в шаблон."""
+        self._expected_fields[prompt_name] = set(fields)
+
+    def validate(self) -> List[str]:
+        """Сверяет поля шаблонов с зарегистрированными местами вызова. Возвращает список проблем."""
+        problems = []
+        for prompt_name, provided in self._expected_fields.items():
+            try:
+                template = self.get(prompt_name)
+            except FileNotFoundError:
+                problems.append(f"Шаблон '{prompt_name}' не найден в {self.prompt_dir}")
+                continue
+            fields = template.fields
+            missing = fields - provided
+            unused = provided - fields
+            if missing:
+                problems.append(f"Шаблону '{prompt_name}' не передаются переменные: {', '.join(sorted(missing))}")
+            if unused:
+                problems.append(f"Шаблон '{prompt_name}' не использует переменные: {', '.join(sorted(unused))}")
+        for problem in problems:
+            print(f"🔴 ОШИБКА ПРОМПТА: {problem}")
+        return problems
+
+
+prompt_registry = PromptRegistry()
+
 def load_and_format_prompt(prompt_name: str, **kwargs) -> str:
     """
-    Загружает промпт из файла и форматирует его, подставляя значения.
+    Форматирует заранее разобранный шаблон из реестра, подставляя значения.
     
     :param prompt_name: Имя файла без .txt (например, 'combat_action')
     :param kwargs: Словарь с переменными для подстановки
     """
     try:
-        filepath = PROMPT_DIR / f"{prompt_name}.txt"
-        with open(filepath, "r", encoding="utf-8") as f:
-            prompt_template = f.read()
-        
-        return prompt_template.format(**kwargs)
+        return prompt_registry.render(prompt_name, **kwargs)
     except FileNotFoundError:
-        print(f"🔴 ОШИБКА: Файл промпта не найден: {filepath}")
+        print(f"🔴 ОШИБКА: Файл промпта не найден: {PROMPT_DIR / f'{prompt_name}.txt'}")
         return "Ошибка: промпт не найден."
     except KeyError as e:
         print(f"🔴 ОШИБКА: В промпте '{prompt_name}' не хватает переменной: {e}")
-        return "Ошибка: неверная переменная в промпте."
\ No newline at end of file
+        return "Ошибка: неверная переменная в промпте."
+
+
+# --- Бюджет токенов для слотов промпта ---
+
+# Грубая оценка: в русском тексте на один токен приходится ~3 символа.
+# Точный токенизатор не нужен - важно, чтобы размер промпта не рос бесконечно.
+CHARS_PER_TOKEN = 3
+
+# Максимальный размер (в токенах) переменных частей каждого шаблона
+PROMPT_BUDGETS = {
+    "exploration_action": {
+        "memories": 400,
+        "context_json": 800,
+    },
+    "combat_action": {
+        "lore": 200,
+        "combat_log": 900,    # Последние ходы боя дословно
+        "combat_digest": 250, # Сжатая сводка более старых ходов
+    },
+}
+
+def estimate_tokens(text: str) -> int:
+    """Оценивает размер текста в токенах."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def get_slot_budget(prompt_name: str, slot: str) -> int | None:
+    """Бюджет слота в токенах или None, если для слота он не задан."""
+    return PROMPT_BUDGETS.get(prompt_name, {}).get(slot)
+
+def fit_text_to_budget(text: str, max_tokens: int | None) -> str:
+    """Обрезает текст по бюджету, помечая обрезку многоточием."""
+    if max_tokens is None or estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max(0, max_tokens * CHARS_PER_TOKEN - 1)] + "…"
+
+def fit_dict_to_budget(data: Dict[str, Any], max_tokens: int | None, **dumps_kwargs) -> str:
+    """
+    Сериализует словарь в JSON в пределах бюджета. Ключи идут в порядке важности;
+    не влезающий ключ отбрасывается целиком, чтобы JSON оставался корректным.
+    Первый ключ всегда сохраняется; если это строка, она обрезается.
+    """
+    text = json.dumps(data, **dumps_kwargs)
+    if max_tokens is None or estimate_tokens(text) <= max_tokens or not data:
+        return text
+    first_key, *other_keys = data
+    fitted = {first_key: data[first_key]}
+    if isinstance(data[first_key], str):
+        overhead = estimate_tokens(json.dumps({first_key: ""}, **dumps_kwargs))
+        fitted[first_key] = fit_text_to_budget(data[first_key], max(1, max_tokens - overhead))
+    for key in other_keys:
+        candidate = {**fitted, key: data[key]}
+        if estimate_tokens(json.dumps(candidate, **dumps_kwargs)) <= max_tokens:
+            fitted = candidate
+    return json.dumps(fitted, **dumps_kwargs)
+
+def fit_items_to_budget(items: List[str], max_tokens: int | None) -> List[str]:
+    """
+    Оставляет столько элементов (в порядке важности), сколько помещается в бюджет.
+    Первый элемент всегда сохраняется, при необходимости обрезанный.
+    """
+    if max_tokens is None:
+        return items
+    fitted, used = [], 0
+    for item in items:
+        cost = estimate_tokens(item) + 1  # +1 на перевод строки/маркер списка
+        if used + cost > max_tokens:
+            if not fitted:
+                fitted.append(fit_text_to_budget(item, max_tokens))
+            break
+        fitted.append(item)
+        used += cost
+    return fitted
+
+def first_sentence(text: str) -> str:
+    for separator in (". ", "! ", "? "):
+        index = text.find(separator)
+        if index != -1:
+            return text[:index + 1]
+    return text
+
+def _summarize_log_entries(entries: List[str]) -> tuple[str, int]:
+    """Сворачивает самые старые записи лога боя в одну строку сводки. Возвращает (строка, сколько записей поглощено)."""
+    first = entries[0]
+    if first.startswith("Игрок:") and len(entries) > 1 and entries[1].startswith("Результат:"):
+        command = first[len("Игрок:"):].strip()
+        outcome = first_sentence(entries[1][len("Результат:"):].strip())
+        return f"- {command} -> {outcome}", 2
+    return f"- {first_sentence(first)}", 1
+
+def compact_combat_log(entries: List[str], digest: str, prompt_name: str = "combat_action") -> tuple[List[str], str]:
+    """
+    Держит лог боя в рамках бюджета шаблона: пока дословный лог больше
+    бюджета, самые старые ходы сворачиваются в скользящую сводку, а из
+    сводки, в свою очередь, вытесняются самые старые строки.
+    Возвращает (новый лог, новая сводка); размер промпта не зависит от длины боя.
+    """
+    log_budget = get_slot_budget(prompt_name, "combat_log")
+    digest_budget = get_slot_budget(prompt_name, "combat_digest")
+    if log_budget is None:
+        return entries, digest
+
+    entries = list(entries)
+    digest_lines = digest.splitlines() if digest else []
+    # Последний ход (пара записей) всегда остается дословным
+    while len(entries) > 2 and estimate_tokens("\n".join(entries)) > log_budget:
+        line, consumed = _summarize_log_entries(entries)
+        digest_lines.append(line)
+        del entries[:consumed]
+    # Слишком длинный последний ход обрезается, начиная с самой длинной записи
+    for i in sorted(range(len(entries)), key=lambda i: -len(entries[i])):
+        if estimate_tokens("\n".join(entries)) <= log_budget:
+            break
+        rest = estimate_tokens("\n".join(entry for j, entry in enumerate(entries) if j != i)) + 1
+        entries[i] = fit_text_to_budget(entries[i], max(1, log_budget - rest))
+
+    if digest_budget is not None:
+        while len(digest_lines) > 1 and estimate_tokens("\n".join(digest_lines)) > digest_budget:
+            digest_lines.pop(0)
+        if digest_lines:
+            digest_lines[0] = fit_text_to_budget(digest_lines[0], digest_budget)
+
+    return entries, "\n".join(digest_lines)
@@ -0,0 +1,265 @@
+# utils/response_parser.py
+import json
+from typing import Any, Callable, Dict, List, Optional
+from logic.constants import NARRATIVE, STATE_CHANGES
+
+_WHITESPACE = " \t\r\n"
+
+
+def _is_high_surrogate(hex_digits: str) -> bool:
+    try:
+        return 0xD800 <= int(hex_digits, 16) <= 0xDBFF
+    except ValueError:
+        return False
+
+
+class StreamingResponseParser:
+    """
+    Инкрементальный парсер JSON-ответа LLM на ход игрока.
+    Получает ответ кусками (feed) и, не дожидаясь конца:
+      - отдает текст ключа narrative в on_narrative по мере поступления;
+      - отдает каждую запись из state_changes в on_state_change, как только
+        значение этой записи полностью получено.
+    Все, что до первой '{' (```json, вступления) и после закрывающей '}'
+    (завершающие ``` или рассуждения модели), пропускается за тот же проход.
+    """
+    def __init__(self,
+                 on_narrative: Optional[Callable[[str], None]] = None,
+                 on_state_change: Optional[Callable[[str, Any], None]] = None):
+        self.on_narrative = on_narrative
+        self.on_state_change = on_state_change
+
+        self.narrative: Optional[str] = None
+        self.state_changes: Dict[str, Any] = {}
+        self.done = False
+        self.error: Optional[str] = None
+
+        self._text = ""
+        self._pos = 0
+        self._started = False
+        # Стек открытых контейнеров: {"kind": "obj"|"arr", "expect": ..., "key": ..., "value_start": ...}
+        self._stack: List[Dict[str, Any]] = []
+        # Текущая строка: начало (индекс открывающей кавычки) и ее роль
+        self._string_start: Optional[int] = None
+        self._string_is_key = False
+        self._narrative_parts: List[str] = []
+        self._narrative_emitted = 0  # Сколько символов сырой строки narrative уже отдано
+        # Текущий скаляр (число, true/false/null)
+        self._scalar_start: Optional[int] = None
+
+    # --- Публичный интерфейс ---
+
+    def feed(self, chunk: str):
+        if self.done or self.error:
+            return
+        self._text += chunk
+        try:
+            self._run()
+        except ValueError as e:
+            self.error = str(e)
+
+    def close(self) -> "StreamingResponseParser":
+        """Завершает разбор. Если объект так и не закрылся, выставляет error."""
+        if not self.done and not self.error:
+            self.error = "Ответ оборвался до конца JSON-объекта" if self._started else "В ответе нет JSON-объекта"
+        return self
+
+    # --- Разбор ---
+
+    def _run(self):
+        text = self._text
+        end = len(text)
+        i = self._pos
+
+        if not self._started:
+            start = text.find("{", i)
+            if start == -1:
+                self._pos = end
+                return
+            self._started = True
+            self._stack.append({"kind": "obj", "expect": "key_or_end", "key": None, "value_start": None})
+            i = start + 1
+
+        while i < end and not self.done:
+            if self._string_start is not None:
+                i = self._scan_string(i)
+                if self._string_start is not None:
+                    break  # Строка еще не закрыта - ждем следующий кусок
+                continue
+            if self._scalar_start is not None:
+                char = text[i]
+                if char in ",}]" or char in _WHITESPACE:
+                    self._finish_value(self._scalar_start, i)
+                    self._scalar_start = None
+                    continue  # Разделитель обрабатывается как обычный символ
+                i += 1
+                continue
+
+            char = text[i]
+            if char in _WHITESPACE:
+                i += 1
+                continue
+
+            frame = self._stack[-1]
+            expect = frame["expect"]
+
+            if expect in ("key_or_end", "key"):
+                if char == '"':
+                    self._string_start = i
+                    self._string_is_key = True
+                elif char == "}" and expect == "key_or_end":
+                    self._close_container(i)
+                else:
+                    raise ValueError(f"Ожидался ключ объекта, а встретилось '{char}'")
+            elif expect == "colon":
+                if char != ":":
+                    raise ValueError(f"Ожидалось ':', а встретилось '{char}'")
+                frame["expect"] = "value"
+            elif expect in ("value", "value_or_end"):
+                if char == "]" and expect == "value_or_end":
+                    self._close_container(i)
+                else:
+                    self._start_value(i, char)
+            elif expect == "comma_or_end":
+                closing = "}" if frame["kind"] == "obj" else "]"
+                if char == ",":
+                    frame["expect"] = "key" if frame["kind"] == "obj" else "value"
+                elif char == closing:
+                    self._close_container(i)
+                else:
+                    raise ValueError(f"Ожидалось ',' или '{closing}', а встретилось '{char}'")
+            i += 1
+
+        self._pos = i
+        self._stream_narrative()
+
+    def _start_value(self, i: int, char: str):
+        frame = self._stack[-1]
+        frame["value_start"] = i
+        if char == "{":
+            self._stack.append({"kind": "obj", "expect": "key_or_end", "key": None, "value_start": None})
+        elif char == "[":
+            self._stack.append({"kind": "arr", "expect": "value_or_end", "key": None, "value_start": None})
+        elif char == '"':
+            self._string_start = i
+            self._string_is_key = False
+        elif char in "-0123456789tfn":
+            self._scalar_start = i
+        else:
+            raise ValueError(f"Неожиданный символ '{char}' в начале значения")
+
+    def _scan_string(self, i: int) -> int:
+        """Ищет конец текущей строки, корректно пропуская escape-последовательности."""
+        text = self._text
+        end = len(text)
+        while i < end:
+            char = text[i]
+            if char == "\\":
+                if i + 1 >= end:
+                    return i  # Escape-последовательность разорвана между кусками
+                i += 2
+                continue
+            if char == '"':
+                start = self._string_start
+                self._string_start = None
+                if self._string_is_key:
+                    frame = self._stack[-1]
+                    frame["key"] = self._decode(text[start + 1:i])
+                    frame["expect"] = "colon"
+                else:
+                    self._finish_value(start, i + 1)
+                return i + 1
+            i += 1
+        return i
+
+    def _close_container(self, i: int):
+        self._stack.pop()
+        if not self._stack:
+            self.done = True  # Верхний объект закрыт, хвост ответа не нужен
+            return
+        self._finish_value(self._stack[-1]["value_start"], i + 1)
+
+    def _finish_value(self, start: int, end: int):
+        """Значение внутри текущего контейнера получено полностью."""
+        frame = self._stack[-1]
+        frame["expect"] = "comma_or_end"
+        depth = len(self._stack)
+
+        if depth == 1 and frame["key"] == NARRATIVE:
+            raw = self._text[start:end]
+            if raw.startswith('"'):
+                self._stream_narrative(final_end=end - 1)
+                self.narrative = "".join(self._narrative_parts)
+            else:
+                self.narrative = str(self._decode_value(raw))
+        elif depth == 2 and self._in_state_changes():
+            key = frame["key"]
+            value = self._decode_value(self._text[start:end])
+            self.state_changes[key] = value
+            if self.on_state_change:
+                self.on_state_change(key, value)
+
+    def _in_state_changes(self) -> bool:
+        return (len(self._stack) == 2 and self._stack[1]["kind"] == "obj"
+                and self._stack[0]["key"] == STATE_CHANGES)
+
+    # --- Потоковая отдача narrative ---
+
+    def _stream_narrative(self, final_end: Optional[int] = None):
+        """Отдает еще не отданный кусок строки narrative, не разрывая escape-последовательности."""
+        if final_end is None:
+            if (self._string_start is None or self._string_is_key or len(self._stack) != 1
+                    or self._stack[0]["key"] != NARRATIVE):
+                return
+        body_start = self._stack[0]["value_start"] + 1
+        if final_end is None:
+            final_end = self._safe_string_end(body_start)
+
+        raw = self._text[body_start + self._narrative_emitted:final_end]
+        if not raw:
+            return
+        self._narrative_emitted += len(raw)
+        text = self._decode(raw)
+        self._narrative_parts.append(text)
+        if self.on_narrative:
+            self.on_narrative(text)
+
+    def _safe_string_end(self, body_start: int) -> int:
+        """Граница, до которой незакрытую строку можно декодировать прямо сейчас."""
+        text = self._text
+        i = body_start + self._narrative_emitted
+        end = len(text)
+        safe = i
+        while i < end:
+            if text[i] == "\\":
+                length = 6 if i + 1 < end and text[i + 1] == "u" else 2
+                if i + length > end:
+                    break
+                if length == 6 and _is_high_surrogate(text[i + 2:i + 6]):
+                    # Старшая половина суррогатной пары декодируется только вместе с младшей
+                    if i + 12 > end:
+                        break
+                    if text[i + 6:i + 8] == "\\u":
+                        length = 12
+                i += length
+            else:
+                i += 1
+            safe = i
+        return safe
+
+    # --- Декодирование ---
+
+    @staticmethod
+    def _decode(raw_string_body: str) -> str:
+        try:
+            # strict=False: модели иногда оставляют в строках настоящие переводы строк
+            return json.loads(f'"{raw_string_body}"', strict=False)
+        except json.JSONDecodeError:
+            return raw_string_body
+
+    @staticmethod
+    def _decode_value(raw: str) -> Any:
+        try:
+            return json.loads(raw, strict=False)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Некорректное значение '{raw[:40]}': {e}")
@@ -1,61 +1,225 @@
-import yaml
+"""
+Проверка ссылочной целостности данных мира. Строит единый граф ID по
+data/data_tables/*.yaml, world_anatomy.yaml и tags_registry.yaml и сообщает:
+  - висячие ссылки (ID, которого нет в целевой таблице или реестре тегов) - ошибка;
+  - дубликаты ID внутри одной таблицы - ошибка;
+  - сироты (ID, на который никто не ссылается) - предупреждение.
+
+Файлы разбираются параллельно, а результаты разбора кэшируются по sha256:
+повторный запуск заново читает только изменившиеся файлы.
+
+    python validate_data.py          # код возврата 1, если есть ошибки
+    python validate_data.py --full   # без кэша
+"""
+import sys
+import pickle
+import hashlib
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from services.tag_registry_service import TagRegistry
+from typing import Any, Dict, List, Tuple
+import yaml
+from services.world_snapshot import DATA_DIR, file_hash, source_files
+
+CACHE_FILE = Path(__file__).parent / "db" / "validation_cache.pickle"
+# Меняется вместе со схемой: старый кэш тогда не используется
+CACHE_VERSION = 1
+
+# Пространства имен графа: таблицы data_tables, "continents" и "tags"
+TAGS = "tags"
+CONTINENTS = "continents"
+# Схема ссылок: таблица -> поле-список ID -> таблица, в которой эти ID должны быть
+REFERENCE_RULES: Dict[str, Dict[str, str]] = {
+    CONTINENTS: {"allowed_region_type_ids": "REGION_TYPES"},
+    "REGION_TYPES": {"base_tags": TAGS},
+    "BIOMES": {"parent_region_ids": "REGION_TYPES"},
+    "LANDMARKS": {"allowed_biome_ids": "BIOMES"},
+    "RESOURCES": {"source_biome_ids": "BIOMES"},
+    "ECONOMY_BRANCHES": {
+        "required_resource_ids": "RESOURCES",
+        "produced_resource_ids": "RESOURCES",
+        "specialist_race_ids": "RACES",
+    },
+    "CURRENCIES": {"issuer_race_ids": "RACES"},
+    "FLORA": {"parent_biome_ids": "BIOMES"},
+    "FAUNA": {"parent_biome_ids": "BIOMES"},
+    "ECOLOGICAL_THREATS": {"affected_regions": "REGION_TYPES"},
+}
+# Сиротами считаются только ID таблиц, на которые схема вообще ссылается
+ORPHAN_CHECKED = {target for fields in REFERENCE_RULES.values() for target in fields.values()}
+
+# (пространство имен, ID, где встретился)
+Definition = Tuple[str, str, str]
+# (целевое пространство имен, ID, откуда ссылка)
+Reference = Tuple[str, str, str]
+
+
+def _extract_facts(relative_path: str, data: Any) -> Dict[str, List]:
+    """Определения ID и ссылки одного файла по схеме REFERENCE_RULES."""
+    definitions: List[Definition] = []
+    references: List[Reference] = []
+    if not isinstance(data, dict):
+        return {"definitions": definitions, "references": references}
+
+    if relative_path == "tags_registry.yaml":
+        for category_id, category in data.items():
+            for tag_id in (category or {}).get("tags") or {}:
+                definitions.append((TAGS, tag_id, f"{relative_path}: {category_id}"))
+        return {"definitions": definitions, "references": references}
 
-DATA_DIR = Path(__file__).parent / "generators"
-TAG_REGISTRY_FILE = DATA_DIR / "tags_registry.yaml"
-WORLD_ANATOMY_FILE = DATA_DIR / "world_anatomy.yaml"
-# RACE_DATA_FILE = DATA_DIR / "races.yaml" 
+    if relative_path == "world_anatomy.yaml":
+        tables = {CONTINENTS: [{"id": key, **(value or {})} for key, value in (data.get("world_continents") or {}).items()]}
+    else:
+        tables = {name: rows for name, rows in data.items() if isinstance(rows, list)}
+
+    for table_name, rows in tables.items():
+        rules = REFERENCE_RULES.get(table_name, {})
+        for position, row in enumerate(rows):
+            if not isinstance(row, dict) or "id" not in row:
+                definitions.append((table_name, None, f"{relative_path}: {table_name}[{position}]"))
+                continue
+            where = f"{relative_path}: {table_name}[{row['id']}]"
+            definitions.append((table_name, row["id"], where))
+            for field, target in rules.items():
+                for target_id in row.get(field) or []:
+                    references.append((target, target_id, f"{where}.{field}"))
+    return {"definitions": definitions, "references": references}
+
+
+def _parse_file(path: Path) -> Dict[str, Any]:
+    """Разбор одного файла; выполняется в отдельном процессе."""
+    relative_path = path.relative_to(DATA_DIR).as_posix()
+    result = {"sha256": "", "error": None, "definitions": [], "references": []}
+    try:
+        raw = path.read_bytes()
+        result["sha256"] = hashlib.sha256(raw).hexdigest()
+        data = yaml.safe_load(raw.decode("utf-8"))
+    except (OSError, UnicodeDecodeError, yaml.YAMLError) as e:
+        result["error"] = str(e).replace("\n", " ")
+        return result
+    result.update(_extract_facts(relative_path, data))
+    return result
+
+
+def _current_hash(path: Path) -> str | None:
+    """sha256 файла или None, если файл не читается (тогда его разберет _parse_file и запишет ошибку)."""
+    try:
+        return file_hash(path)
+    except OSError:
+        return None
+
+
+def _load_cache(path: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return {}
+    # Битый, но распакованный кэш (не словарь) просто отбрасывается
+    if not isinstance(payload, dict) or payload.get("version") != CACHE_VERSION:
+        return {}
+    files = payload.get("files")
+    return files if isinstance(files, dict) else {}
 
-def run_validation():
+
+def _save_cache(path: Path, files: Dict[str, Dict[str, Any]]):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump({"version": CACHE_VERSION, "files": files}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"⚠️ Не удалось сохранить кэш валидации: {e}")
+
+
+def collect_facts(full: bool = False, workers: int | None = None) -> Dict[str, Dict[str, Any]]:
+    """Факты по всем файлам: неизменившиеся берутся из кэша, остальные разбираются параллельно."""
+    cache = {} if full else _load_cache(CACHE_FILE)
+    files, changed = {}, []
+    for path in source_files():
+        relative_path = path.relative_to(DATA_DIR).as_posix()
+        cached = cache.get(relative_path)
+        if cached and cached["sha256"] == _current_hash(path):
+            files[relative_path] = cached
+        else:
+            changed.append(path)
+
+    if changed:
+        print(f"📄 Разбор изменившихся файлов: {len(changed)} из {len(changed) + len(files)}")
+        if len(changed) == 1:
+            results = [_parse_file(changed[0])]  # Ради одного файла пул процессов не поднимаем
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_parse_file, changed))
+        for path, result in zip(changed, results):
+            files[path.relative_to(DATA_DIR).as_posix()] = result
+        _save_cache(CACHE_FILE, files)
+    else:
+        print("✅ Ни один файл не изменился с прошлой проверки.")
+    return files
+
+
+def check_graph(files: Dict[str, Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+    """Сводит факты всех файлов в граф ID. Возвращает (ошибки, предупреждения)."""
+    errors, warnings = [], []
+    defined: Dict[str, Dict[str, List[str]]] = defaultdict(lambda: defaultdict(list))
+    referenced = defaultdict(set)
+
+    for relative_path, facts in files.items():
+        if facts["error"]:
+            errors.append(f"{relative_path}: файл не читается как YAML: {facts['error']}")
+        for namespace, item_id, where in facts["definitions"]:
+            if item_id is None:
+                errors.append(f"{where}: запись без поля id")
+            else:
+                defined[namespace][item_id].append(where)
+
+    for namespace, ids in defined.items():
+        for item_id, places in ids.items():
+            if len(places) > 1:
+                errors.append(f"Дубликат ID '{item_id}' в {namespace}: " + "; ".join(places))
+
+    for facts in files.values():
+        for target, target_id, where in facts["references"]:
+            referenced[target].add(target_id)
+            if target_id not in defined.get(target, {}):
+                errors.append(f"{where}: висячая ссылка '{target_id}' (нет в {target})")
+
+    for namespace in sorted(ORPHAN_CHECKED):
+        orphans = [item_id for item_id in defined.get(namespace, {}) if item_id not in referenced[namespace]]
+        if orphans:
+            warnings.append(f"{namespace}: на {len(orphans)} ID никто не ссылается: " + ", ".join(orphans))
+    return errors, warnings
+
+
+def run_validation(full: bool = False, workers: int | None = None) -> bool:
     """
     Главная функция для проверки всех игровых данных на корректность.
-    Запускается вручную для проверки целостности мира.
+    Возвращает True, если ошибок нет (предупреждения допустимы).
     """
     print("--- Запуск валидации игровых данных ---")
-    
-    # 1. Инициализируем реестр тегов. Он - наш источник правды.
-    tag_registry = TagRegistry(filepath=TAG_REGISTRY_FILE)
-    if not tag_registry._all_tags:
-        print("🔴 КРИТИЧЕСКАЯ ОШИБКА: Реестр тегов пуст или не загружен. Валидация невозможна.")
-        return
-
-    print(f"✅ Реестр тегов загружен. Всего легальных тегов: {len(tag_registry._all_tags)}")
-    
-    # 2. Валидация world_anatomy.yaml
-    print("\n--- Проверка world_anatomy.yaml ---")
-    try:
-        with open(WORLD_ANATOMY_FILE, 'r', encoding='utf-8') as f:
-            world_data = yaml.safe_load(f)
-        
-        # Проверяем, что все 'allowed_region_type_ids' ссылаются на существующие теги
-        # (предполагая, что типы регионов тоже являются тегами в реестре)
-        for continent_id, continent_data in world_data.get("world_continents", {}).items():
-            for region_type_id in continent_data.get("allowed_region_type_ids", []):
-                if not tag_registry.validate_tag(region_type_id):
-                    print(f"  🔴 ОШИБКА в континенте '{continent_id}': "
-                          f"Нелегальный ID типа региона '{region_type_id}'. Его нет в реестре тегов.")
-    except Exception as e:
-        print(f"  🔴 Не удалось прочитать или обработать файл: {e}")
-
-    # 3. Валидация файла с расами (пример)
-    # print("\n--- Проверка races.yaml ---")
-    # try:
-    #     # ... код для загрузки файла с расами ...
-    #     for race_id, race_data in all_races.items():
-    #         # Проверяем основные теги расы
-    #         for tag in race_data.get("tags", []):
-    #             if not tag_registry.validate_tag(tag):
-    #                 print(f"  🔴 ОШИБКА в расе '{race_id}': Нелегальный тег '{tag}'.")
-    #         # Проверяем теги в правилах совместимости
-    #         for tag in race_data.get("compatibility", {}).get("tags", {}).keys():
-    #             if not tag_registry.validate_tag(tag):
-    #                 print(f"  🔴 ОШИБКА в расе '{race_id}' (compatibility): Нелегальный тег '{tag}'.")
-    
-    # except Exception as e:
-    #     print(f"  🔴 Не удалось прочитать или обработать файл: {e}")
-
-    print("\n--- Валидация завершена ---")
+    files = collect_facts(full=full, workers=workers)
+    errors, warnings = check_graph(files)
+
+    definitions = sum(len(facts["definitions"]) for facts in files.values())
+    references = sum(len(facts["references"]) for facts in files.values())
+    print(f"📊 Файлов: {len(files)}, ID: {definitions}, ссылок: {references}")
+    for warning in warnings:
+        print(f"  🟡 {warning}")
+    for error in errors:
+        print(f"  🔴 {error}")
+
+    print(f"\n--- Валидация завершена: ошибок {len(errors)}, предупреждений {len(warnings)} ---")
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка ссылочной целостности данных мира")
+    parser.add_argument("--full", action="store_true", help="разобрать все файлы заново, не глядя на кэш")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов для разбора")
+    args = parser.parse_args()
+    sys.exit(0 if run_validation(full=args.full, workers=args.workers) else 1)
+
 
 if __name__ == "__main__":
-    run_validation()
\ No newline at end of file
+    main()